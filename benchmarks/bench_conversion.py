@@ -0,0 +1,190 @@
+"""
+Benchmark suite of the conversion hot paths, on synthetic documents (see benchmarks.generators) of every kind and size.
+
+For every document it measures the time of the parsing stages (block tokenizer, inline style scanner, whole compile),
+of the request optimizations (coalescing and merging) and of sending the plan to a stubbed Google Docs service, along
+with the number of compiled and sent requests, the serialized bytes sent and the number of batchUpdate round trips.
+
+The results are saved as JSON. Given the results of an earlier run as a baseline, slower stages (beyond the tolerance)
+and any growth in requests or round trips are reported as regressions, and the exit status is 1.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_conversion [--kinds mixed,tables] [--sizes 1KB,100KB,10MB] [--repeat 3]
+        [--output benchmarks/results/conversion.json] [--baseline previous.json] [--tolerance 0.2]
+        [--min-seconds 0.05]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import datetime
+from src.markgdoc import markgdoc
+from src.markgdoc.markgdoc import (
+    compile_markdown,
+    tokenize_blocks,
+    parse_inline_styles,
+    coalesce_requests,
+    merge_paragraph_requests,
+    merge_text_style_requests,
+    execute_request_plan,
+)
+from .generators import GENERATORS, SIZE_UNITS, generate_document, parse_size
+
+DEFAULT_SIZES = "1KB,100KB,10MB"
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "conversion.json")
+
+# Stages compared against the baseline, and metrics which must not grow
+TIMED_STAGES = ("tokenize", "inline", "compile", "optimize", "send")
+COUNTED_METRICS = ("compiled_requests", "sent_requests", "round_trips")
+MIN_COMPARED_SECONDS = 0.05
+
+
+class StubDocsService:
+    """
+    A Google Docs service answering every batchUpdate at once, without looking at the requests
+    """
+
+    def documents(self):
+        return self
+
+    def batchUpdate(self, documentId, body):
+        return self
+
+    def execute(self):
+        return {}
+
+
+def measure(function, repeat):
+    """
+    Runs the function repeat times, returns its result and the best time
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def benchmark_document(kind, size, repeat):
+    content = generate_document(kind, size)
+    tokens, tokenize_seconds = measure(lambda: list(tokenize_blocks(content)), repeat)
+    texts = [token.text for token in tokens if token.kind != "table"]
+    _, inline_seconds = measure(lambda: [parse_inline_styles(text) for text in texts], repeat)
+    plan, compile_seconds = measure(lambda: compile_markdown(content), repeat)
+
+    def optimize():
+        text_requests = list(merge_paragraph_requests(coalesce_requests(plan.text_requests)))
+        return text_requests, merge_text_style_requests(plan.style_requests)
+
+    _, optimize_seconds = measure(optimize, repeat)
+    stats, send_seconds = measure(lambda: execute_request_plan(StubDocsService(), "doc_id", plan), repeat)
+
+    megabytes = len(content.encode("utf-8")) / 1024 ** 2
+    return {
+        "kind": kind,
+        "size": size,
+        "bytes": len(content.encode("utf-8")),
+        "lines": content.count("\n") + 1,
+        "blocks": len(tokens),
+        "seconds": {
+            "tokenize": tokenize_seconds,
+            "inline": inline_seconds,
+            "compile": compile_seconds,
+            "optimize": optimize_seconds,
+            "send": send_seconds,
+        },
+        "compile_mb_per_second": megabytes / compile_seconds if compile_seconds else None,
+        "compiled_requests": len(plan.text_requests) + len(plan.style_requests),
+        "sent_requests": sum(batch["requests"] for batch in stats),
+        "sent_bytes": sum(batch["bytes"] for batch in stats),
+        "round_trips": len(stats),
+    }
+
+
+def find_regressions(results, baseline, tolerance, min_seconds=MIN_COMPARED_SECONDS):
+    """
+    Compares the results with the results of a baseline run, and returns a description of every regression.
+    Stages faster than min_seconds in both runs are too noisy to compare and are skipped.
+    """
+    baseline_results = {(result["kind"], result["size"]): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline_results.get((result["kind"], result["size"]))
+        if previous is None:
+            continue
+        name = f"{result['kind']} {format_size(result['size'])}"
+        for stage in TIMED_STAGES:
+            seconds, previous_seconds = result["seconds"][stage], previous["seconds"][stage]
+            if max(seconds, previous_seconds) >= min_seconds and seconds > previous_seconds * (1 + tolerance):
+                regressions.append(f"{name}: {stage} took {seconds:.4f}s (baseline {previous_seconds:.4f}s)")
+        for metric in COUNTED_METRICS:
+            if result[metric] > previous[metric]:
+                regressions.append(f"{name}: {metric} grew to {result[metric]} (baseline {previous[metric]})")
+    return regressions
+
+
+def format_size(size):
+    for unit in ("GB", "MB", "KB"):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f"{size // SIZE_UNITS[unit]}{unit}"
+    return f"{size}B"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the markdown conversion hot paths")
+    parser.add_argument("--kinds", default=",".join(GENERATORS), help="Comma separated document kinds")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma separated document sizes (1KB up to 100MB)")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs, the best one is reported")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Path of the JSON results file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown against the baseline")
+    parser.add_argument("--min-seconds", type=float, default=MIN_COMPARED_SECONDS,
+                        help="Stages faster than this are not compared against the baseline")
+    args = parser.parse_args()
+
+    # The stubbed service answers at once, the benchmark does not wait on the Docs API quota
+    markgdoc.DOCS_WRITE_RATE_LIMITER = markgdoc.RateLimiter(10 ** 9, burst=10 ** 9)
+
+    results = []
+    print(f"{'document':<20} {'compile':>10} {'MB/s':>8} {'send':>9} {'requests':>18} {'round trips':>12} {'bytes sent':>12}")
+    for kind in args.kinds.split(","):
+        for size in map(parse_size, args.sizes.split(",")):
+            # Large documents are only measured once
+            result = benchmark_document(kind, size, args.repeat if size <= 10 * 1024 ** 2 else 1)
+            results.append(result)
+            print(
+                f"{kind + ' ' + format_size(size):<20} {result['seconds']['compile']:9.3f}s "
+                f"{result['compile_mb_per_second']:8.2f} {result['seconds']['send']:8.3f}s "
+                f"{result['compiled_requests']:>8} -> {result['sent_requests']:<7} {result['round_trips']:>12} "
+                f"{result['sent_bytes']:>12}"
+            )
+
+    report = {
+        "suite": "conversion",
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "compiler_version": markgdoc.COMPILER_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), args.tolerance, args.min_seconds)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Benchmark of the start-up cost paid by short-lived batch jobs and serverless workers: importing markgdoc, and the
+cold start of the command line interface (python -m markgdoc --help). Every measurement runs in a fresh interpreter.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_startup [--repeat 10]
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+SOURCE_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+COMMANDS = {
+    "python (baseline)": ["-c", "pass"],
+    "import markgdoc": ["-c", "import markgdoc"],
+    "import markgdoc (request builders only)": ["-c", "from markgdoc import compile_markdown"],
+    "markgdoc CLI cold start": ["-m", "markgdoc", "--help"],
+}
+
+
+def measure(arguments, repeat):
+    environment = dict(os.environ, PYTHONPATH=SOURCE_DIRECTORY)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + arguments, env=environment, check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark markgdoc import and CLI start-up time")
+    parser.add_argument("--repeat", type=int, default=10, help="Number of runs, the median is reported")
+    args = parser.parse_args()
+
+    for name, arguments in COMMANDS.items():
+        print(f"{name:<42} {measure(arguments, args.repeat) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Benchmark of the conversion of very large markdown tables (CSV-like exports of thousands of rows).
+
+For every table size it measures the compile time, the number of compiled and sent requests, the serialized bytes
+sent and the number of batchUpdate round trips, and the wall time of sending the plan to a stubbed Google Docs service
+and to the in-memory fake Google Docs service (which applies every request, so the indexes are checked as well).
+
+Run from the root of the repository:
+    python -m benchmarks.bench_tables [--rows 1000,10000] [--columns 6] [--empty 0.2] [--chunk-rows 500]
+        [--repeat 3] [--output benchmarks/results/tables.json]
+"""
+import os
+import json
+import random
+import argparse
+import platform
+import datetime
+from src.markgdoc import markgdoc
+from src.markgdoc.markgdoc import compile_markdown, execute_request_plan
+from src.markgdoc.fake_service import FakeDocsService
+from .bench_conversion import StubDocsService, measure
+from .generators import sentence
+
+DEFAULT_ROWS = "1000,10000"
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "tables.json")
+
+
+def generate_table(rows, columns, empty_ratio=0.2, seed=0):
+    """
+    Returns a markdown table of rows data rows (plus its header row) and columns columns, where about empty_ratio of
+    the cells are empty and some are styled
+    """
+    rng = random.Random(seed)
+    lines = [
+        "| " + " | ".join(f"Column {column}" for column in range(columns)) + " |",
+        "|" + " - |" * columns,
+    ]
+    for _ in range(rows):
+        cells = []
+        for _ in range(columns):
+            roll = rng.random()
+            if roll < empty_ratio:
+                cells.append("")
+            elif roll < empty_ratio + 0.1:
+                cells.append(f"**{rng.randint(0, 10 ** 6)}**")
+            elif roll < empty_ratio + 0.4:
+                cells.append(sentence(rng, 1, 4))
+            else:
+                cells.append(str(rng.randint(0, 10 ** 6)))
+        lines.append("| " + " | ".join(cells) + " |")
+    return "Table export\n" + "\n".join(lines) + "\n\nThe end"
+
+
+def benchmark_table(rows, columns, empty_ratio, repeat):
+    content = generate_table(rows, columns, empty_ratio)
+    plan, compile_seconds = measure(lambda: compile_markdown(content), repeat)
+    stats, send_seconds = measure(lambda: execute_request_plan(StubDocsService(), "doc_id", plan), repeat)
+
+    def convert_on_fake_service():
+        docs_service = FakeDocsService()
+        document = docs_service.add_document()
+        execute_request_plan(docs_service, document.doc_id, plan)
+        return document
+
+    document, fake_seconds = measure(convert_on_fake_service, 1)
+    return {
+        "rows": rows,
+        "columns": columns,
+        "empty_ratio": empty_ratio,
+        "bytes": len(content.encode("utf-8")),
+        "tables": len(plan.tables),
+        "seconds": {"compile": compile_seconds, "send": send_seconds, "fake_service": fake_seconds},
+        "compiled_requests": len(plan.text_requests) + len(plan.style_requests),
+        "sent_requests": sum(batch["requests"] for batch in stats),
+        "sent_bytes": sum(batch["bytes"] for batch in stats),
+        "round_trips": len(stats),
+        "document_characters": len(document.get_text()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the conversion of very large markdown tables")
+    parser.add_argument("--rows", default=DEFAULT_ROWS, help="Comma separated numbers of table rows")
+    parser.add_argument("--columns", type=int, default=6, help="Number of table columns")
+    parser.add_argument("--empty", type=float, default=0.2, help="Ratio of empty cells")
+    parser.add_argument("--chunk-rows", type=int, default=markgdoc.MAX_TABLE_CHUNK_ROWS,
+                        help="Most rows of a single table, larger tables are split (see MAX_TABLE_CHUNK_ROWS)")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs, the best one is reported")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Path of the JSON results file")
+    args = parser.parse_args()
+
+    # The stubbed services answer at once, the benchmark does not wait on the Docs API quota
+    markgdoc.DOCS_WRITE_RATE_LIMITER = markgdoc.RateLimiter(10 ** 9, burst=10 ** 9)
+    markgdoc.MAX_TABLE_CHUNK_ROWS = args.chunk_rows
+
+    results = []
+    for rows in (int(rows) for rows in args.rows.split(",")):
+        result = benchmark_table(rows, args.columns, args.empty, args.repeat)
+        results.append(result)
+        seconds = result["seconds"]
+        print(
+            f"{rows:>7} rows  {result['tables']:>3} tables  compile {seconds['compile']:.3f}s  "
+            f"send {seconds['send']:.3f}s  fake service {seconds['fake_service']:.3f}s  "
+            f"requests {result['compiled_requests']} -> {result['sent_requests']}  "
+            f"round trips {result['round_trips']}"
+        )
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    report = {
+        "suite": "tables",
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "compiler_version": markgdoc.COMPILER_VERSION,
+        "max_table_chunk_rows": markgdoc.MAX_TABLE_CHUNK_ROWS,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
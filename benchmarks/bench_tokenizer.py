@@ -0,0 +1,196 @@
+"""
+Benchmark of the block classification stage: the per-line regex cascade used before the block tokenizer
+against tokenize_blocks, on a synthetic 100k-line markdown document.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_tokenizer [--lines 100000] [--repeat 3]
+"""
+import re
+import time
+import argparse
+from src.markgdoc.markgdoc import (
+    get_hyperlink_request,
+    get_style_request,
+    is_paragraph,
+    preprocess_nested_styles,
+    preprocess_numbered_lists,
+    tokenize_blocks,
+)
+
+SAMPLE_LINES = [
+    "# Weekly Report",
+    "This is a paragraph with **bold** text and a [link](https://www.google.com/).",
+    "## Summary",
+    "- **Item:** an unordered list item",
+    "- Another _italic_ item",
+    "1. First numbered item",
+    "2. Second numbered item",
+    "",
+    "| Name | Value |",
+    "| ---- | ----- |",
+    "| Alpha | ~1~ |",
+    "",
+    "---",
+    "Closing paragraph without any styling at all.",
+]
+
+
+def generate_document(line_count):
+    return "\n".join(SAMPLE_LINES[i % len(SAMPLE_LINES)] for i in range(line_count))
+
+
+def legacy_preprocess_nested_styles(chunk, index, paragraph_flag, debug=False):
+    """
+    preprocess_nested_styles as it was before the single pass inline style scanner: one regex search per style,
+    only the first occurrence of every style is handled
+    """
+    style_requests = []
+
+    # Now, detect all other styles and hyperlinks in the main chunk
+    matches = []
+
+    bolditalics_match = re.search(r"\*\*\_(.+?)\_\*\*", chunk) or re.search(r"\_\*\*(.+?)\*\*\_", chunk)
+    bold_match = re.search(r"\*\*(.+?)\*\*", chunk)
+    italic_match = re.search(r"\_(.+?)\_", chunk)
+    strike_match = re.search(r"\~(.+?)\~", chunk)
+    hyperlink_match = re.search(r"\[(.+?)\]\((http[s]?:\/\/.+?)\)", chunk)
+
+    if bolditalics_match:
+        matches.append(("bolditalics", bolditalics_match))
+
+    elif bold_match:
+        matches.append(("bold", bold_match))
+
+    elif italic_match:
+        matches.append(("italic", italic_match))
+
+    if strike_match:
+        matches.append(("strike", strike_match))
+
+    if hyperlink_match:
+        matches.append(("hyperlink", hyperlink_match))
+
+    # Sort matches by their starting index
+    matches.sort(key=lambda x: x[1].start())
+
+    # Offset to track the difference between original and modified chunk
+    offset = 0
+
+    # Process matches in order
+    for match_type, match in matches:
+        original_start_idx = match.start() + offset
+        original_end_idx = match.end() + offset
+
+        # Update the start index based on the modified chunk
+        if match_type == "bolditalics":
+            text = match.group(1).strip()
+            start_idx = original_start_idx if paragraph_flag else 0
+            style_requests.append(get_style_request(text, "bold", index + start_idx, debug=debug))
+            style_requests.append(get_style_request(text, "italic", index + start_idx, debug=debug))
+            chunk = chunk[:original_start_idx] + text + chunk[original_end_idx:]
+
+        elif match_type == "bold":
+            text = match.group(1).strip()
+            start_idx = original_start_idx if paragraph_flag else 0
+            style_requests.append(get_style_request(text, "bold", index + start_idx, debug=debug))
+            chunk = chunk[:original_start_idx] + text + chunk[original_end_idx:]
+
+        elif match_type == "italic":
+            text = match.group(1).strip()
+            start_idx = original_start_idx if paragraph_flag else 0
+            style_requests.append(get_style_request(text, "italic", index + start_idx, debug=debug))
+            chunk = chunk[:original_start_idx] + text + chunk[original_end_idx:]
+
+        elif match_type == "strike":
+            text = match.group(1).strip()
+            start_idx = original_start_idx if paragraph_flag else 0
+            style_requests.append(get_style_request(text, "strike", index + start_idx, debug=debug))
+            chunk = chunk[:original_start_idx] + text + chunk[original_end_idx:]
+
+        elif match_type == "hyperlink":
+            text = match.group(1).strip()
+            url = match.group(2).strip()
+            start_idx = original_start_idx if paragraph_flag else 0
+            style_requests.append(get_hyperlink_request(text, url, index + start_idx, debug=debug))
+            chunk = chunk[:original_start_idx] + text + chunk[original_end_idx:]
+
+        # Adjust the offset based on the length difference between the original match and the new text
+        offset -= (len(match.group(0)) - len(text))
+
+    cleaned_chunk = chunk
+    return style_requests, cleaned_chunk
+
+
+def legacy_classify(content):
+    """
+    The classification cascade of process_markdown_content before the block tokenizer
+    """
+    content = preprocess_numbered_lists(content)
+    chunks = iter(re.split(r"(?<=\n)", content))
+    kinds = []
+    for chunk in chunks:
+        chunk = chunk.strip()
+        paragraph_flag = is_paragraph(chunk)
+        _, cleaned_chunk = legacy_preprocess_nested_styles(chunk, 1, paragraph_flag)
+        header_match = re.match(r"^(#{1,6})\s+(.+)", cleaned_chunk)
+        bullet_point_match = re.match(r"^-\s+(.+)", cleaned_chunk)
+        numbered_list_match = re.match(r"^\d+\.\s+(.+)", cleaned_chunk)
+        table_match = re.match(r"^\|.+\|", cleaned_chunk)
+        horizontal_line_match = re.match(r"^[-*_]{3,}$", cleaned_chunk)
+        if header_match:
+            level = len(re.match(r"^#+", cleaned_chunk).group(0))
+            kinds.append(("header", cleaned_chunk[level:].strip()))
+        elif bullet_point_match:
+            kinds.append(("bullet", cleaned_chunk[2:].strip()))
+        elif numbered_list_match:
+            kinds.append(("numbered", re.sub(r"^\d+\.\s", "", cleaned_chunk).strip()))
+        elif horizontal_line_match:
+            kinds.append(("hr", ""))
+        elif table_match:
+            rows = [chunk]
+            for next_chunk in chunks:
+                next_chunk = next_chunk.strip()
+                if not re.match(r"^\|.+\|", next_chunk):
+                    break
+                rows.append(next_chunk)
+            kinds.append(("table", rows))
+        else:
+            kinds.append(("paragraph", cleaned_chunk))
+    return kinds
+
+
+def tokenizer_classify(content):
+    """
+    The block tokenizer, followed by the style preprocessing of every block's text
+    """
+    kinds = []
+    for token in tokenize_blocks(content):
+        if token.kind != "table":
+            preprocess_nested_styles(token.text, 1, True)
+        kinds.append(token.kind)
+    return kinds
+
+
+def measure(function, content, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(content)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark markdown block classification")
+    parser.add_argument("--lines", type=int, default=100_000, help="Number of lines in the generated document")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs, the best one is reported")
+    args = parser.parse_args()
+
+    content = generate_document(args.lines)
+    for name, function in (("before (regex cascade)", legacy_classify), ("after (block tokenizer)", tokenizer_classify)):
+        seconds = measure(function, content, args.repeat)
+        print(f"{name:<26} {seconds:8.3f}s  {args.lines / seconds:>12,.0f} lines/sec")
+
+
+if __name__ == "__main__":
+    main()
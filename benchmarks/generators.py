@@ -0,0 +1,116 @@
+"""
+Synthetic markdown generators for the benchmarks. Every generator builds a deterministic document (for a given seed) of
+roughly the requested size in bytes, stressing one part of the conversion:
+
+- paragraphs: plain paragraphs separated by blank lines
+- lists: long runs of bullet and numbered list items
+- tables: tables of 3 to 6 columns and 5 to 20 rows between short paragraphs
+- inline: paragraphs packed with bold, italic, strikethrough, nested styles and hyperlinks
+- mixed: all of the above, with headers and horizontal lines
+"""
+import re
+import random
+
+WORDS = (
+    "the quarterly report shows steady growth across all regions while costs remained within the planned budget "
+    "our team shipped several features and fixed many issues reported by customers during the last release cycle"
+).split()
+
+SIZE_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)\s*(B|KB|MB|GB)?$", re.IGNORECASE)
+SIZE_UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+
+def parse_size(size):
+    """
+    Parses a size such as "1KB", "100 MB" or "4096" into a number of bytes
+    """
+    match = SIZE_PATTERN.match(size.strip())
+    if match is None:
+        raise ValueError(f"Invalid size: {size!r}")
+    return int(float(match.group(1)) * SIZE_UNITS[(match.group(2) or "B").upper()])
+
+
+def sentence(rng, low=6, high=18):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high))).capitalize() + "."
+
+
+def styled_sentence(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 20))]
+    for position in range(0, len(words), 3):
+        kind = rng.randrange(5)
+        if kind == 0:
+            words[position] = f"**{words[position]}**"
+        elif kind == 1:
+            words[position] = f"_{words[position]}_"
+        elif kind == 2:
+            words[position] = f"~{words[position]}~"
+        elif kind == 3:
+            words[position] = f"**_{words[position]}_**"
+        else:
+            words[position] = f"[{words[position]}](https://example.com/{words[position]})"
+    return " ".join(words)
+
+
+def paragraph_blocks(rng):
+    return [" ".join(sentence(rng) for _ in range(rng.randint(2, 6))), ""]
+
+
+def list_blocks(rng):
+    if rng.random() < 0.5:
+        items = [f"- {sentence(rng, 3, 10)}" for _ in range(rng.randint(5, 30))]
+    else:
+        items = [f"{number}. {sentence(rng, 3, 10)}" for number in range(1, rng.randint(5, 30))]
+    return items + [""]
+
+
+def table_blocks(rng):
+    columns = rng.randint(3, 6)
+    lines = [
+        "| " + " | ".join(rng.choice(WORDS).capitalize() for _ in range(columns)) + " |",
+        "| " + " | ".join("---" for _ in range(columns)) + " |",
+    ]
+    for _ in range(rng.randint(5, 20)):
+        lines.append("| " + " | ".join(rng.choice(WORDS) for _ in range(columns)) + " |")
+    return lines + [sentence(rng, 3, 8)]
+
+
+def inline_blocks(rng):
+    return [" ".join(styled_sentence(rng) for _ in range(rng.randint(1, 4))), ""]
+
+
+def mixed_blocks(rng):
+    kind = rng.randrange(8)
+    if kind == 0:
+        return [f"{'#' * rng.randint(1, 3)} {sentence(rng, 2, 6)}"]
+    if kind == 1:
+        return ["---"]
+    return rng.choice((paragraph_blocks, list_blocks, table_blocks, inline_blocks, inline_blocks, paragraph_blocks))(rng)
+
+
+GENERATORS = {
+    "paragraphs": paragraph_blocks,
+    "lists": list_blocks,
+    "tables": table_blocks,
+    "inline": inline_blocks,
+    "mixed": mixed_blocks,
+}
+
+
+def generate_lines(kind, size, seed=0):
+    """
+    Yields the lines of a generated document of the given kind, until about size bytes were generated
+    """
+    rng = random.Random(seed)
+    blocks = GENERATORS[kind]
+    generated = 0
+    while generated < size:
+        for line in blocks(rng):
+            generated += len(line) + 1
+            yield line
+
+
+def generate_document(kind, size, seed=0):
+    """
+    Returns a generated document of the given kind of about size bytes
+    """
+    return "\n".join(generate_lines(kind, size, seed))
@@ -9,5 +9,33 @@ from .markgdoc import (
     get_table_content_request,
     get_unordered_list_request,
     convert_to_google_docs,
+    convert_file_to_google_docs,
+    ConversionJob,
+    ConversionCancelled,
+    stream_markdown_content,
     create_empty_google_doc,
+    create_empty_google_docs,
+    CreatedDoc,
+    MarkGDocSession,
+    convert_many,
+    ConversionResult,
+    sync_markdown,
+    SyncResult,
+    compile_markdown,
+    compile_markdown_parallel,
+    compile_many,
+    tokenize_blocks,
+    parse_inline_styles,
+    execute_request_plan,
+    coalesce_requests,
+    merge_text_style_requests,
+    merge_paragraph_requests,
+    RequestPlan,
+    CompactRequest,
+    request_to_dict,
+    BatchSizer,
+    send_batch_update,
+    RateLimiter,
+    execute_request,
+    Metrics,
 )
\ No newline at end of file
@@ -1,7 +1,10 @@
 import os
+import sys
+import glob
+import json
+import time
 import argparse
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+import concurrent.futures
 from . import markgdoc
 
 # Initialization for this global variable constant. This is the path to your credentials.json file, you can edit it to whatever path you want 
@@ -40,15 +43,12 @@ def main(debug=False):
     
     print("Building...")
 
-    # Attempt to build the Google Docs service with the updated SERVICE ACCOUNT FILE
+    # Attempt to start a session with the updated SERVICE ACCOUNT FILE, its credentials and services are reused for
+    # every conversion
     try:
-        docs_service = build(
-            "docs",
-            "v1",
-            credentials=service_account.Credentials.from_service_account_file(
-                SERVICE_ACCOUNT_FILE, scopes=SCOPES
-            ),
-        )
+        session = markgdoc.MarkGDocSession(SERVICE_ACCOUNT_FILE, SCOPES)
+        with session.services():
+            pass
         print("Google Docs Service Initialized Successfully!\n")
     except Exception as e:
         print(f"Error: Google Docs service initialization failed. {e}")
@@ -74,10 +74,10 @@ def main(debug=False):
                     md_content = file.read()
 
                 print("Converting your Markdown to a Google Doc!")
-                doc_url = markgdoc.convert_to_google_docs(md_content, document_title, docs_service, credentials_file=SERVICE_ACCOUNT_FILE, scopes=SCOPES, debug=debug)
+                job = markgdoc.convert_to_google_docs(md_content, document_title, session=session, debug=debug)
                 
                 if not debug: 
-                    print(f"Google Doc Link: {doc_url}\n")
+                    print(f"Google Doc Link: {job.doc_url}\n")
 
             else:
                 print("Error: The file path provided does not exist or is not a valid file.")
@@ -104,9 +104,9 @@ def main(debug=False):
 
             document_title = "Example Markdown File"
             print("Converting your Markdown to a Google Doc!")
-            doc_url = markgdoc.convert_to_google_docs(md_content, document_title, docs_service, credentials_file=SERVICE_ACCOUNT_FILE, scopes=SCOPES, debug=debug)
+            job = markgdoc.convert_to_google_docs(md_content, document_title, session=session, debug=debug)
             if not debug: 
-                print(f"Google Doc Link: {doc_url}\n")
+                print(f"Google Doc Link: {job.doc_url}\n")
 
         elif user_input == "q" or user_input == "Q":
             break
@@ -124,8 +124,233 @@ def main(debug=False):
         if user_cont == "n" or user_cont == "q" or user_cont == "Q":
             break
 
+
+# Batch Conversion =======================================================================================================
+# The convert subcommand converts whole directories of markdown files without any prompt, for scripts and cron jobs:
+#     markgdoc convert "notes/**/*.md" --credentials credentials.json --title "Notes - {stem}" --jobs 8
+# A JSON line {"file", "title", "doc_id", "doc_url", "seconds", "requests", "error"} is printed for every file.
+
+def expand_file_patterns(patterns):
+    """
+    This is a helper function which expands the file patterns (globs, "**" matching any number of directories) into
+    the list of matching files, in order and without duplicates. A pattern matching no file is returned as it is, so
+    that it is reported as a failed conversion.
+    """
+    files = []
+    seen = set()
+    for pattern in patterns:
+        matches = sorted(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path)) or [pattern]
+        for path in matches:
+            if path not in seen:
+                seen.add(path)
+                files.append(path)
+    return files
+
+
+def add_permission_arguments(parser):
+    """
+    This is a helper function which adds the options choosing how the new google docs are shared: --permission (a
+    Drive permission as JSON, repeatable) or --private
+    """
+    sharing = parser.add_mutually_exclusive_group()
+    sharing.add_argument("--permission", action="append", type=json.loads,
+                         help='Drive permission given on every new google doc, as JSON (such as \'{"type": "user", '
+                              '"role": "reader", "emailAddress": "..."}\'), can be repeated. Anyone with the link can '
+                              'edit by default')
+    sharing.add_argument("--private", action="store_true", help="Keep the new google docs private")
+
+
+def get_permission_body(args):
+    """
+    This is a helper function which returns the permission_body of the new google docs given the --permission and
+    --private options (see create_empty_google_doc)
+    """
+    if args.private:
+        return None
+    return args.permission or markgdoc.DEFAULT_PERMISSION_BODY
+
+
+def count_sent_requests(plan):
+    """
+    This is a helper function which counts the requests execute_request_plan sends for the plan (after coalescing and
+    merging them)
+    """
+    text_requests = markgdoc.merge_paragraph_requests(markgdoc.coalesce_requests(plan.text_requests))
+    return sum(1 for _ in text_requests) + len(markgdoc.merge_text_style_requests(plan.style_requests))
+
+
+def convert_file(
+    path, title, session=None, dry_run=False, compile_executor=None, permission_body=markgdoc.DEFAULT_PERMISSION_BODY
+):
+    """
+    This converts a single markdown file into a new google doc shared with the permission_body (or only compiles it on
+    a dry run), and returns the JSON line reported for it. With a compile_executor (a ProcessPoolExecutor), the file is
+    compiled on its processes.
+    """
+    started = time.perf_counter()
+    result = {"file": path, "title": title, "doc_id": None, "doc_url": None, "seconds": None, "requests": None,
+              "error": None}
+    try:
+        with open(path, "r", encoding="utf-8") as markdown_file:
+            content_markdown = markdown_file.read()
+        if dry_run:
+            if compile_executor is not None:
+                plan = markgdoc.compile_markdown_parallel(content_markdown, executor=compile_executor)
+            else:
+                plan = markgdoc.compile_markdown(content_markdown)
+            result["requests"] = count_sent_requests(plan)
+        else:
+            with session.services() as (docs_service, drive_service):
+                doc_id, doc_url = markgdoc.create_empty_google_doc(
+                    title, drive_service=drive_service, permission_body=permission_body
+                )
+                result["doc_id"], result["doc_url"] = doc_id, doc_url
+                stats = markgdoc.process_markdown_content(
+                    docs_service, doc_id, content_markdown, compile_executor=compile_executor
+                )
+            result["requests"] = sum(batch["requests"] for batch in stats)
+    except Exception as error:
+        result["error"] = f"{type(error).__name__}: {error}"
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def convert_command(args, output=None):
+    """
+    This runs the convert subcommand: the files matching the patterns are converted on a pool of args.jobs threads
+    (sharing a single MarkGDocSession) and a JSON line is written to the output for every file, in completion order.
+    With args.processes, the files are compiled on a pool of that many processes shared by the threads.
+    Returns the exit status: 0 if every file was converted, 1 otherwise.
+    """
+    output = output or sys.stdout
+    files = expand_file_patterns(args.patterns)
+    session = None
+    if not args.dry_run:
+        try:
+            session = markgdoc.MarkGDocSession(args.credentials, args.scopes or SCOPES)
+        except Exception as error:
+            print(f"Error: the credentials could not be loaded. {error}", file=sys.stderr)
+            return 1
+
+    failed = 0
+    compile_executor = None
+    if args.processes:
+        compile_executor = concurrent.futures.ProcessPoolExecutor(max_workers=args.processes)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+            futures = [
+                executor.submit(
+                    convert_file, path, markgdoc.format_title(args.title, path, number), session, args.dry_run,
+                    compile_executor, get_permission_body(args)
+                )
+                for number, path in enumerate(files, 1)
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                failed += result["error"] is not None
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+    finally:
+        if compile_executor is not None:
+            compile_executor.shutdown()
+    return 1 if failed else 0
+
+
+def watch_command(args, output=None):
+    """
+    This runs the watch subcommand: the markdown files of args.directory are kept synced to their google docs (see
+    MarkdownWatcher) until interrupted, and a JSON line is written to the output for every push.
+    Returns the exit status: 0, or 1 if the credentials could not be loaded (or a push failed with --once).
+    """
+    from .watch import MarkdownWatcher
+
+    output = output or sys.stdout
+    try:
+        session = markgdoc.MarkGDocSession(args.credentials, args.scopes or SCOPES)
+    except Exception as error:
+        print(f"Error: the credentials could not be loaded. {error}", file=sys.stderr)
+        return 1
+
+    def report(result):
+        output.write(json.dumps(result) + "\n")
+        output.flush()
+
+    watcher = MarkdownWatcher(
+        args.directory, session=session, mapping_path=args.mapping, debounce=args.debounce, max_workers=args.jobs,
+        poll_interval=args.interval, title_template=args.title, use_notifications=not args.polling,
+        permission_body=get_permission_body(args),
+    )
+    if args.once:
+        results = watcher.run_once()
+        for result in results:
+            report(result)
+        return 1 if any(result["error"] is not None for result in results) else 0
+
+    watcher.on_result = report
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def run(argv=None):
+    """
+    Entry point of the markgdoc command: the interactive menu, or the convert and watch subcommands when given
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in ("convert", "watch"):
+        parser = argparse.ArgumentParser(prog="markgdoc", description="Run MarkGDoc with Optional Debugging")
+        parser.add_argument('--debug', action='store_true', help="Enable debug mode")
+        parser.epilog = (
+            "Run 'markgdoc convert --help' to convert markdown files without any prompt, "
+            "or 'markgdoc watch --help' to keep a directory of markdown files synced to google docs."
+        )
+        args = parser.parse_args(argv)
+        main(debug=args.debug)
+        return 0
+
+    if argv[0] == "watch":
+        parser = argparse.ArgumentParser(
+            prog="markgdoc watch",
+            description="Keep the markdown files of a directory synced to Google Docs, printing a JSON line per push",
+        )
+        parser.add_argument("directory", help="Directory of the markdown files (watched recursively)")
+        parser.add_argument("--credentials", default=SERVICE_ACCOUNT_FILE, help="Path to your credentials.json file")
+        parser.add_argument("--scopes", nargs="+", help="Scopes of the credentials (documents and drive by default)")
+        parser.add_argument("--title", default="{stem}",
+                            help="Title template of the new google docs, with {stem}, {name}, {parent} and {path}")
+        parser.add_argument("--jobs", "-j", type=int, default=4, help="Number of files pushed in parallel")
+        parser.add_argument("--debounce", type=float, default=2.0,
+                            help="Seconds a file has to stay unchanged before it is pushed")
+        parser.add_argument("--interval", type=float, default=1.0, help="Seconds between two scans when polling")
+        parser.add_argument("--mapping", help="File keeping the google doc of every markdown file "
+                                              "(.markgdoc-docs.json in the directory by default)")
+        parser.add_argument("--polling", action="store_true",
+                            help="Poll the directory instead of using filesystem notifications (watchdog)")
+        parser.add_argument("--once", action="store_true", help="Push the changed files once and exit")
+        add_permission_arguments(parser)
+        args = parser.parse_args(argv[1:])
+        return watch_command(args)
+
+    parser = argparse.ArgumentParser(
+        prog="markgdoc convert",
+        description="Convert markdown files into new Google Docs without any prompt, printing a JSON line per file",
+    )
+    parser.add_argument("patterns", nargs="+", help="Markdown files or glob patterns (quote them, ** is supported)")
+    parser.add_argument("--credentials", default=SERVICE_ACCOUNT_FILE, help="Path to your credentials.json file")
+    parser.add_argument("--scopes", nargs="+", help="Scopes of the credentials (documents and drive by default)")
+    parser.add_argument("--title", default="{stem}",
+                        help="Title template of the google docs, with {stem}, {name}, {parent}, {path} and {number}")
+    parser.add_argument("--jobs", "-j", type=int, default=4, help="Number of files converted in parallel")
+    parser.add_argument("--processes", "-p", type=int, default=0,
+                        help="Number of processes compiling the files (compiled in the converting threads by default)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only compile the files and count their requests, without creating any google doc")
+    add_permission_arguments(parser)
+    args = parser.parse_args(argv[1:])
+    return convert_command(args)
+
+
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Run MarkGDoc with Optional Debugging")
-    parser.add_argument('--debug', action='store_true', help="Enable debug mode")
-    args = parser.parse_args()
-    main(debug=args.debug)
\ No newline at end of file
+    sys.exit(run())
\ No newline at end of file
@@ -0,0 +1,433 @@
+import ssl
+import json
+import time
+import types
+import asyncio
+import urllib.parse
+from collections import Counter
+from .markgdoc import (
+    DEFAULT_PERMISSION_BODY,
+    BatchSizer,
+    coalesce_requests,
+    compile_markdown,
+    compile_markdown_chunk,
+    merge_compiled_chunks,
+    split_markdown_chunks,
+    merge_paragraph_requests,
+    merge_text_style_requests,
+    get_permission_bodies,
+    get_retry_delay,
+    is_retryable_error,
+    record_batch_metrics,
+    update_write_control,
+)
+from . import markgdoc
+
+# Asyncio Backend ========================================================================================================
+# Coroutine versions of the Google Drive and Google Docs calls made by MarkGDoc, so that thousands of conversions can be
+# in flight on a single event loop. Requests are sent over a small keep-alive HTTP/1.1 client built on asyncio streams.
+
+DOCS_API_URL = "https://docs.googleapis.com/v1"
+DRIVE_API_URL = "https://www.googleapis.com/drive/v3"
+
+
+class HttpStatusError(Exception):
+    """
+    An API call answered with an HTTP error status. Like the errors of the Google API client, the status is available
+    as error.resp.status (see markgdoc.is_retryable_error).
+    """
+
+    def __init__(self, status, content):
+        super().__init__(f"HTTP {status}: {content[:200]!r}")
+        self.status = status
+        self.content = content
+        self.resp = types.SimpleNamespace(status=status)
+
+
+def is_retryable_async_error(error, idempotent=True):
+    """
+    This is the asyncio version of markgdoc.is_retryable_error: the timeouts of asyncio.wait_for raise
+    asyncio.TimeoutError, which is only the builtin TimeoutError from Python 3.11 on, so they are checked here too
+    """
+    if isinstance(error, asyncio.TimeoutError):
+        return idempotent
+    return is_retryable_error(error, idempotent)
+
+
+class AsyncHTTPClient:
+    """
+    A minimal HTTP/1.1 client on asyncio streams keeping connections alive between requests.
+    At most max_connections requests are in flight per host, further requests wait for a free connection.
+    Connections belong to the event loop they were opened on, so a client should only be used on a single loop.
+    """
+
+    def __init__(self, max_connections=32, timeout=60.0, ssl_context=None):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.ssl_context = ssl_context or ssl.create_default_context()
+        self._idle_connections = {}
+        self._connection_limits = {}
+
+    async def request(self, method, url, body=None, headers=None, idempotent=True):
+        """
+        Sends the request (body is JSON encoded) and returns the status and the decoded JSON response.
+        Kept-alive connections which the server has closed meanwhile are dropped. When a kept-alive connection fails
+        anyway, the request is sent again on a new connection if it was never sent, or if it is idempotent: a request
+        which is not idempotent may have been applied by the server before the connection dropped, so the error is
+        raised and the retry policy of the caller decides (see markgdoc.is_retryable_error).
+        """
+        parts = urllib.parse.urlsplit(url)
+        secure = parts.scheme == "https"
+        port = parts.port or (443 if secure else 80)
+        key = (parts.scheme, parts.hostname, port)
+        target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+
+        payload = json.dumps(body).encode() if body is not None else b""
+        head = [f"{method} {target} HTTP/1.1", f"Host: {parts.netloc}", "Accept-Encoding: identity"]
+        head.append(f"Content-Length: {len(payload)}")
+        if body is not None:
+            head.append("Content-Type: application/json")
+        head.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+        message = ("\r\n".join(head) + "\r\n\r\n").encode() + payload
+
+        if key not in self._connection_limits:
+            self._connection_limits[key] = asyncio.Semaphore(self.max_connections)
+
+        loop = asyncio.get_running_loop()
+        async with self._connection_limits[key]:
+            idle = self._idle_connections.setdefault(key, [])
+            while True:
+                reused = False
+                while idle and not reused:
+                    reader, writer = idle.pop()
+                    if reader.at_eof():
+                        writer.close()
+                    else:
+                        reused = True
+                if not reused:
+                    reader, writer = await asyncio.wait_for(
+                        asyncio.open_connection(parts.hostname, port, ssl=self.ssl_context if secure else None),
+                        self.timeout,
+                    )
+                deadline = loop.time() + self.timeout
+                try:
+                    writer.write(message)
+                    await asyncio.wait_for(writer.drain(), self.timeout)
+                except ConnectionError:
+                    writer.close()
+                    # The request never reached the server, so it cannot be applied twice
+                    if reused:
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                try:
+                    status, data, keep_alive = await asyncio.wait_for(
+                        self._read_response(reader), deadline - loop.time()
+                    )
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    if reused and idempotent:
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                break
+
+            if keep_alive:
+                idle.append((reader, writer))
+            else:
+                writer.close()
+
+        if status >= 400:
+            raise HttpStatusError(status, data)
+        return status, json.loads(data) if data.strip() else {}
+
+    @staticmethod
+    async def _read_response(reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed before a response was received")
+        status = int(status_line.split()[1])
+
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+
+        keep_alive = response_headers.get("connection", "").lower() != "close"
+        if status in (204, 304):
+            data = b""
+        elif response_headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            data = b"".join(chunks)
+        elif "content-length" in response_headers:
+            data = await reader.readexactly(int(response_headers["content-length"]))
+        else:
+            data = await reader.read()
+            keep_alive = False
+        return status, data, keep_alive
+
+    async def close(self):
+        for connections in self._idle_connections.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle_connections.clear()
+
+
+class AsyncDocsClient:
+    """
+    Coroutine Google Drive and Google Docs client used by the asyncio backend.
+    Requests are authorized with google-auth credentials (refreshed in a worker thread when they expire), or sent
+    without authorization when credentials is None (for example against a local stub server). API calls share the
+    rate limiters of markgdoc with the synchronous calls and temporary errors are retried with the same backoff.
+    With metrics (see markgdoc.Metrics), the API calls, errors, retries and waits are measured.
+    """
+
+    def __init__(self, credentials=None, http=None, docs_api_url=DOCS_API_URL, drive_api_url=DRIVE_API_URL,
+                 max_retries=5, backoff=1.0, max_backoff=32.0, metrics=None):
+        self.credentials = credentials
+        self.http = http or AsyncHTTPClient()
+        self.docs_api_url = docs_api_url.rstrip("/")
+        self.drive_api_url = drive_api_url.rstrip("/")
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.metrics = metrics
+        self._refresh_lock = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self.http.close()
+
+    async def _authorization_headers(self):
+        if self.credentials is None:
+            return {}
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+
+        async with self._refresh_lock:
+            if not self.credentials.valid:
+                from google.auth.transport.requests import Request
+
+                await asyncio.get_running_loop().run_in_executor(None, self.credentials.refresh, Request())
+        return {"Authorization": f"Bearer {self.credentials.token}"}
+
+    async def call(self, method, url, body=None, rate_limiter=None, method_id=None, idempotent=True, timings=None):
+        """
+        Sends a single API call through the rate_limiter, retrying temporary errors (only the errors raised before
+        the call was applied when it is not idempotent, see markgdoc.is_retryable_error). Returns the decoded response.
+        The method_id (such as docs.documents.batchUpdate) names the API method in the metrics.
+        The rate limiter waits and retry backoffs are added up in the timings Counter, if any (see
+        markgdoc.execute_request).
+        """
+        metrics = self.metrics
+        attempt = 0
+        while True:
+            if rate_limiter is not None:
+                wait = rate_limiter.reserve()
+                if wait:
+                    if metrics is not None:
+                        metrics.timing("rate_limit_wait", wait)
+                    if timings is not None:
+                        timings["rate_limit_wait"] += wait
+                    await asyncio.sleep(wait)
+            if metrics is not None:
+                metrics.count(f"api_calls.{method_id or 'unknown'}")
+            try:
+                headers = await self._authorization_headers()
+                _, response = await self.http.request(method, url, body, headers, idempotent=idempotent)
+                return response
+            except Exception as error:
+                if metrics is not None:
+                    metrics.count(f"errors.{getattr(error, 'status', None) or type(error).__name__}")
+                if attempt >= self.max_retries or not is_retryable_async_error(error, idempotent):
+                    raise
+                delay = get_retry_delay(attempt, self.backoff, self.max_backoff)
+                if metrics is not None:
+                    metrics.count("retries")
+                    metrics.timing("retry_wait", delay)
+                    metrics.event("retry", attempt=attempt + 1, delay=delay, error=repr(error))
+                if timings is not None:
+                    timings["retry_wait"] += delay
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def create_document(self, document_title, permission_body=DEFAULT_PERMISSION_BODY):
+        """
+        Creates an empty google doc and shares it with the permission_body (a Drive permission, a list of them or None
+        for a private doc, anyone can edit by default, see markgdoc.create_empty_google_doc). Returns its id and url.
+        """
+        doc = await self.call(
+            "POST",
+            f"{self.drive_api_url}/files",
+            {"name": document_title, "mimeType": "application/vnd.google-apps.document"},
+            rate_limiter=markgdoc.DRIVE_RATE_LIMITER,
+            method_id="drive.files.create",
+            idempotent=False,
+        )
+        doc_id = doc["id"]
+
+        for permission in get_permission_bodies(permission_body):
+            await self.call(
+                "POST",
+                f"{self.drive_api_url}/files/{doc_id}/permissions",
+                permission,
+                rate_limiter=markgdoc.DRIVE_RATE_LIMITER,
+                method_id="drive.permissions.create",
+            )
+        return doc_id, f"https://docs.google.com/document/d/{doc_id}/edit"
+
+    async def batch_update(self, doc_id, requests, write_control=None, timings=None):
+        """
+        Sends a batchUpdate, requiring the revision of the write_control (if any) and updating it with the revision
+        the batch left the doc at (see markgdoc.send_batch_update). The waits are added up in the timings, if any.
+        """
+        if write_control is None:
+            write_control = {}
+        body = {"requests": requests}
+        if write_control.get("requiredRevisionId") is not None:
+            body["writeControl"] = {"requiredRevisionId": write_control["requiredRevisionId"]}
+        response = await self.call(
+            "POST",
+            f"{self.docs_api_url}/documents/{urllib.parse.quote(doc_id)}:batchUpdate",
+            body,
+            rate_limiter=markgdoc.DOCS_WRITE_RATE_LIMITER,
+            method_id="docs.documents.batchUpdate",
+            idempotent="writeControl" in body,
+            timings=timings,
+        )
+        update_write_control(write_control, response)
+        return response
+
+    async def get_document(self, doc_id, fields=None):
+        query = f"?fields={urllib.parse.quote(fields)}" if fields else ""
+        return await self.call(
+            "GET",
+            f"{self.docs_api_url}/documents/{urllib.parse.quote(doc_id)}{query}",
+            rate_limiter=markgdoc.DOCS_READ_RATE_LIMITER,
+            method_id="docs.documents.get",
+        )
+
+
+async def send_batch_update_async(client, doc_id, requests, batch_sizer=None, metrics=None, write_control=None):
+    """
+    Coroutine version of markgdoc.send_batch_update: sends the requests in batches sized by the batch_sizer, every
+    batch requiring the revision the previous one left the doc at (carried across calls by the write_control).
+    Like there, the seconds of a batch leave out the rate limiter waits and the retry backoffs.
+    Returns the stats of every batch sent.
+    """
+    if batch_sizer is None:
+        batch_sizer = BatchSizer()
+    if write_control is None:
+        write_control = {}
+
+    stats = []
+    start = 0
+
+    while start < len(requests):
+        end, batch_bytes, batch_requests = batch_sizer.next_batch(requests, start)
+        waits = Counter()
+        started = time.perf_counter()
+        try:
+            await client.batch_update(doc_id, batch_requests, write_control, timings=waits)
+        except HttpStatusError as error:
+            # A batch rejected as too large (HTTP 413) is split up and sent again
+            if error.status == 413 and len(batch_requests) > 1:
+                batch_sizer.shrink(len(batch_requests))
+                continue
+            raise
+
+        seconds = time.perf_counter() - started - sum(waits.values())
+        batch_stats = {"requests": len(batch_requests), "bytes": batch_bytes, "seconds": max(seconds, 0.0)}
+        batch_sizer.record(batch_stats)
+        stats.append(batch_stats)
+        start = end
+        if metrics is not None:
+            record_batch_metrics(metrics, batch_requests, batch_stats)
+
+    return stats
+
+
+async def compile_markdown_async(content_markdown, compile_executor):
+    """
+    Coroutine version of markgdoc.compile_markdown_parallel: the chunks of the markdown content are compiled on the
+    processes of the compile_executor while the event loop keeps sending the requests of other conversions
+    """
+    loop = asyncio.get_running_loop()
+    compiled_chunks = await asyncio.gather(*(
+        loop.run_in_executor(compile_executor, compile_markdown_chunk, chunk)
+        for chunk in split_markdown_chunks(content_markdown)
+    ))
+    return merge_compiled_chunks(compiled_chunks)
+
+
+async def process_markdown_content_async(
+    client, doc_id, content_markdown, debug=False, batch_sizer=None, compile_executor=None
+):
+    """
+    Coroutine version of markgdoc.process_markdown_content: compiles the markdown content into a RequestPlan and
+    sends its text requests and then its style requests (coalesced and merged, see markgdoc.execute_request_plan)
+    onto the google doc. Returns the stats of every batch sent. The metrics of the client (if any) are measured.
+    With a compile_executor (a ProcessPoolExecutor), the content is compiled on its processes instead of blocking the
+    event loop (see compile_markdown_async).
+    """
+    if batch_sizer is None:
+        batch_sizer = BatchSizer()
+    metrics = client.metrics
+    if compile_executor is not None and not debug:
+        started = time.perf_counter()
+        plan = await compile_markdown_async(content_markdown, compile_executor)
+        if metrics is not None:
+            metrics.timing("compile", time.perf_counter() - started)
+    else:
+        plan = compile_markdown(content_markdown, debug=debug, metrics=metrics)
+
+    started = time.perf_counter()
+    text_requests = list(merge_paragraph_requests(coalesce_requests(plan.text_requests)))
+    style_requests = merge_text_style_requests(plan.style_requests)
+    if metrics is not None:
+        metrics.timing("optimize", time.perf_counter() - started)
+
+    write_control = {}
+    stats = await send_batch_update_async(client, doc_id, text_requests, batch_sizer, metrics, write_control)
+    stats.extend(await send_batch_update_async(client, doc_id, style_requests, batch_sizer, metrics, write_control))
+    return stats
+
+
+async def convert_to_google_docs_async(
+    content_markdown, document_title, client, debug=False, compile_executor=None,
+    permission_body=DEFAULT_PERMISSION_BODY
+):
+    """
+    Coroutine version of markgdoc.convert_to_google_docs: creates an empty google doc (shared with the
+    permission_body), converts the markdown content into it and returns the google doc url once the whole content has
+    been sent. With a compile_executor (a ProcessPoolExecutor), the content is compiled on its processes.
+    """
+    doc_id, doc_url = await client.create_document(document_title, permission_body)
+
+    if debug:
+        print(f"Google Doc Link: {doc_url}\n")
+
+    await process_markdown_content_async(
+        client, doc_id, content_markdown, debug=debug, compile_executor=compile_executor
+    )
+    return doc_url
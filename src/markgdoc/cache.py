@@ -0,0 +1,177 @@
+import os
+import json
+import hashlib
+import threading
+from .markgdoc import (
+    COMPILER_VERSION, PLAN_FORMAT_VERSION, CompactRequest, RequestPlan, compile_markdown, compile_markdown_parallel
+)
+
+# Plan Cache =============================================================================================================
+# Compiled RequestPlans are stored on disk, keyed by the hash of the markdown content and the compiler version, so that
+# identical (or templated) markdown is compiled once and then sent straight from the cache.
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".markgdoc", "cache", "plans")
+
+# Default limit of the total size of the cached plans on disk
+DEFAULT_MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+
+def encode_request(request):
+    """
+    This is a helper function which encodes a request for the cache: a CompactRequest as a [kind, start, end, value]
+    list (much quicker to store and load than the full request), any other request as it is
+    """
+    if isinstance(request, CompactRequest):
+        return [request.kind, request.start, request.end, request.value]
+    return request
+
+
+def decode_requests(data):
+    """
+    This is a helper function which decodes a list of requests encoded by encode_request.
+    Table sizes and hyperlinks come back as lists rather than tuples, which CompactRequests handle the same way.
+    """
+    return [CompactRequest(*request) if request.__class__ is list else request for request in data]
+
+
+class PlanCache:
+    """
+    An on-disk cache of compiled RequestPlans, one JSON file per plan holding its requests in their compact form
+    (see encode_request).
+
+    Plans are keyed by the sha256 of the markdown content together with the compiler and plan format versions, so a
+    new version of MarkGDoc never uses plans compiled by an older one. Once the cached plans take more than max_bytes
+    on disk, the least recently used ones (by file modification time, which is refreshed on every hit) are evicted.
+
+    The hits, misses and evictions counters count the lookups and evictions made through this PlanCache object.
+    A cache directory can be shared by several PlanCache objects and processes.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"PlanCache({self.cache_dir!r}, hits={self.hits}, misses={self.misses}, evictions={self.evictions})"
+
+    def key(self, content_markdown):
+        """
+        Returns the cache key of the markdown content, which must be a str (decode bytes before caching them)
+        """
+        if not isinstance(content_markdown, str):
+            raise TypeError(f"The markdown content must be a str, not {type(content_markdown).__name__}")
+        digest = hashlib.sha256(f"{COMPILER_VERSION}:{PLAN_FORMAT_VERSION}:".encode("utf-8"))
+        digest.update(content_markdown.encode("utf-8"))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def get(self, content_markdown):
+        """
+        Returns the cached plan of the markdown content, or None when it is not in the cache
+        """
+        path = self.path(self.key(content_markdown))
+        try:
+            with open(path, "r", encoding="utf-8") as plan_file:
+                data = json.load(plan_file)
+            plan = RequestPlan(
+                decode_requests(data["text_requests"]), decode_requests(data["style_requests"]), data["tables"]
+            )
+            os.utime(path)
+        except FileNotFoundError:
+            plan = None
+        except (ValueError, KeyError, TypeError):
+            # An unreadable plan (for example cut short while being written by a crashed process) is dropped
+            self._remove(path)
+            plan = None
+
+        self._count("misses" if plan is None else "hits")
+        return plan
+
+    def put(self, content_markdown, plan):
+        """
+        Stores the plan of the markdown content in the cache, then evicts the least recently used plans if the cache
+        has grown over max_bytes
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(self.key(content_markdown))
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        data = {
+            "text_requests": [encode_request(request) for request in plan.text_requests],
+            "style_requests": [encode_request(request) for request in plan.style_requests],
+            "tables": plan.tables,
+        }
+        with open(temporary_path, "w", encoding="utf-8") as plan_file:
+            json.dump(data, plan_file, separators=(",", ":"))
+        os.replace(temporary_path, path)
+        self.evict()
+
+    def compile(self, content_markdown, debug=False, metrics=None, executor=None):
+        """
+        Returns the plan of the markdown content from the cache, compiling it (and caching it) on a miss
+        (see compile_markdown, or compile_markdown_parallel on the processes of the executor when one is passed).
+        With metrics (see markgdoc.Metrics), the hits and misses are counted as well.
+        In debug mode, the traces of the compiler are printed on a hit as well as on a miss: the markdown content is
+        compiled again in this process only for its traces, and the cached plan is returned.
+        """
+        plan = self.get(content_markdown)
+        if metrics is not None:
+            metrics.count("plan_cache.hits" if plan is not None else "plan_cache.misses")
+        if plan is not None and debug:
+            compile_markdown(content_markdown, debug=True)
+        elif plan is None:
+            if executor is not None and not debug:
+                plan = compile_markdown_parallel(content_markdown, executor=executor, metrics=metrics)
+            else:
+                plan = compile_markdown(content_markdown, debug=debug, metrics=metrics)
+            self.put(content_markdown, plan)
+        return plan
+
+    def evict(self):
+        """
+        Removes the least recently used plans until the cache takes at most max_bytes on disk
+        """
+        entries = []
+        total_bytes = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, entry.path, stat.st_size))
+            total_bytes += stat.st_size
+
+        for _, path, size in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            if self._remove(path):
+                self._count("evictions")
+            total_bytes -= size
+
+    def clear(self):
+        """
+        Removes every cached plan
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".json"):
+                self._remove(entry.path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
@@ -0,0 +1,747 @@
+import re
+import json
+import time
+import types
+import random
+import bisect
+import itertools
+import threading
+import collections
+
+# Fake Google Services ===================================================================================================
+# In-memory stand-ins for the docs_service and drive_service builds, so that conversions can be load tested and checked
+# without network access. Documents follow the index semantics of the Google Docs API: every character (and every
+# table, row and cell start) takes one index, the body starts at index 1 and always ends with a newline.
+
+# Structural characters standing for the start of a table, of a row and of a cell, and for the end of a table
+TABLE_START, ROW_START, CELL_START, TABLE_END = "\ue000", "\ue001", "\ue002", "\ue003"
+STRUCTURAL_CHARACTERS = TABLE_START + ROW_START + CELL_START + TABLE_END
+_PARAGRAPH_SEPARATORS = "\n" + STRUCTURAL_CHARACTERS
+_STRUCTURAL_PATTERN = re.compile(f"[{STRUCTURAL_CHARACTERS}]")
+
+
+# Most calls a batch request may hold (see FakeBatchHttpRequest)
+MAX_BATCH_CALLS = 100
+
+
+class FakeHttpError(Exception):
+    """
+    An API call of a fake service answered with an HTTP error status. Like the errors of the Google API client, the
+    status is available as error.resp.status and the JSON error (with its reason, if any) as error.content
+    (see markgdoc.is_retryable_error).
+    """
+
+    def __init__(self, status, message="", reason=None):
+        super().__init__(f"HTTP {status}: {message}" if message else f"HTTP {status}")
+        self.status = status
+        self.resp = types.SimpleNamespace(status=status)
+        errors = [{"reason": reason, "message": message}] if reason is not None else []
+        self.content = json.dumps({"error": {"code": status, "message": message, "errors": errors}}).encode()
+
+
+class _TextBuffer:
+    """
+    The text of a document, kept in chunks so that insertions and deletions in large documents stay cheap.
+    The last chunk looked up is remembered, as requests mostly follow each other through the document.
+    """
+
+    CHUNK_SIZE = 4096
+
+    def __init__(self, text=""):
+        self.chunks = self._split(text) or [""]
+        self.length = len(text)
+        self._cursor = (0, 0)
+
+    def _split(self, text):
+        return [text[start:start + self.CHUNK_SIZE] for start in range(0, len(text), self.CHUNK_SIZE)]
+
+    def copy(self):
+        buffer = _TextBuffer()
+        buffer.chunks = list(self.chunks)
+        buffer.length = self.length
+        buffer._cursor = self._cursor
+        return buffer
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self):
+        return "".join(self.chunks)
+
+    def _locate(self, position):
+        """
+        Returns the number of the chunk holding the position and the position its starts at
+        """
+        chunks = self.chunks
+        number, start = self._cursor
+        if number >= len(chunks):
+            number, start = 0, 0
+        while position < start:
+            number -= 1
+            start -= len(chunks[number])
+        while position >= start + len(chunks[number]) and number < len(chunks) - 1:
+            start += len(chunks[number])
+            number += 1
+        self._cursor = (number, start)
+        return number, start
+
+    def insert(self, position, text):
+        number, start = self._locate(position)
+        chunk = self.chunks[number]
+        chunk = chunk[:position - start] + text + chunk[position - start:]
+        if len(chunk) > 2 * self.CHUNK_SIZE:
+            self.chunks[number:number + 1] = self._split(chunk)
+        else:
+            self.chunks[number] = chunk
+        self.length += len(text)
+
+    def delete(self, start_position, end_position):
+        remaining = end_position - start_position
+        while remaining:
+            number, start = self._locate(start_position)
+            chunk = self.chunks[number]
+            offset = start_position - start
+            removed = min(remaining, len(chunk) - offset)
+            chunk = chunk[:offset] + chunk[offset + removed:]
+            if chunk or len(self.chunks) == 1:
+                self.chunks[number] = chunk
+            else:
+                del self.chunks[number]
+            self.length -= removed
+            remaining -= removed
+
+    def slice(self, start_position, end_position):
+        parts = []
+        position = start_position
+        while position < end_position:
+            number, start = self._locate(position)
+            part = self.chunks[number][position - start:end_position - start]
+            parts.append(part)
+            position += len(part)
+        return "".join(parts)
+
+    def find_newline(self, position):
+        """
+        Returns the position of the first newline at or after the position, or -1
+        """
+        number, start = self._locate(position)
+        offset = position - start
+        while number < len(self.chunks):
+            found = self.chunks[number].find("\n", offset)
+            if found >= 0:
+                return start + found
+            start += len(self.chunks[number])
+            number += 1
+            offset = 0
+        return -1
+
+    def rfind_separator(self, position):
+        """
+        Returns the position of the last paragraph separator (a newline or a structural character) before the
+        position, or -1
+        """
+        number, start = self._locate(max(position - 1, 0))
+        limit = position - start
+        while number >= 0:
+            chunk = self.chunks[number]
+            found = max(chunk.rfind(separator, 0, limit) for separator in _PARAGRAPH_SEPARATORS)
+            if found >= 0:
+                return start + found
+            number -= 1
+            if number >= 0:
+                start -= len(self.chunks[number])
+                limit = len(self.chunks[number])
+        return -1
+
+
+class _RangeLayer:
+    """
+    The values of a single style field over a document: sorted, non-overlapping [start, end) index ranges with a
+    value each (indexes outside of every range have no value). Adjacent ranges with equal values are merged.
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.values = []
+
+    def copy(self):
+        layer = _RangeLayer()
+        layer.starts, layer.ends, layer.values = list(self.starts), list(self.ends), list(self.values)
+        return layer
+
+    def value_at(self, index):
+        number = bisect.bisect_right(self.starts, index) - 1
+        if number >= 0 and self.ends[number] > index:
+            return self.values[number]
+        return None
+
+    def set(self, start, end, value):
+        """
+        Sets the value of the [start, end) range, a value of None clearing it
+        """
+        starts, ends, values = self.starts, self.ends, self.values
+        first = bisect.bisect_right(ends, start)
+        last = bisect.bisect_left(starts, end)
+        pieces = []
+        if first < last and starts[first] < start:
+            pieces.append((starts[first], start, values[first]))
+        if value is not None:
+            pieces.append((start, end, value))
+        if first < last and ends[last - 1] > end:
+            pieces.append((end, ends[last - 1], values[last - 1]))
+
+        starts[first:last] = [piece[0] for piece in pieces]
+        ends[first:last] = [piece[1] for piece in pieces]
+        values[first:last] = [piece[2] for piece in pieces]
+        self._merge(first - 1, first + len(pieces))
+
+    def _merge(self, first, last):
+        """
+        Merges the adjacent ranges with equal values among the ranges first to last
+        """
+        number = min(last, len(self.starts) - 1) - 1
+        while number >= max(first, 0):
+            if self.ends[number] == self.starts[number + 1] and self.values[number] == self.values[number + 1]:
+                self.ends[number] = self.ends[number + 1]
+                del self.starts[number + 1], self.ends[number + 1], self.values[number + 1]
+            number -= 1
+
+    def insert(self, index, length, paragraph=False):
+        """
+        Moves the ranges for length characters inserted at the index. Text inserted within a range takes on its value.
+        Inserted text takes on the text style of the character before it (paragraph=False), or the paragraph style of
+        the paragraph it is inserted in, even at its very start (paragraph=True).
+        """
+        starts, ends = self.starts, self.ends
+        for number in range(bisect.bisect_left(ends, index), len(starts)):
+            start = starts[number]
+            if start > index or (start == index and not paragraph):
+                starts[number] += length
+                ends[number] += length
+            elif not paragraph or ends[number] > index:
+                ends[number] += length
+
+    def delete(self, start, end):
+        """
+        Removes the [start, end) range, moving back the ranges after it
+        """
+        self.set(start, end, None)
+        length = end - start
+        first = bisect.bisect_left(self.starts, end)
+        for number in range(first, len(self.starts)):
+            self.starts[number] -= length
+            self.ends[number] -= length
+        self._merge(first - 1, first + 1)
+
+    def boundaries(self):
+        return self.starts + self.ends
+
+
+class FakeDocument:
+    """
+    A Google Doc kept in memory: its text (tables being made of structural characters, see STRUCTURAL_CHARACTERS), a
+    range layer per text style field and per paragraph style field, and the bullets of its paragraphs.
+    The revision is bumped by every batchUpdate applied.
+    """
+
+    def __init__(self, doc_id, title=""):
+        self.doc_id = doc_id
+        self.title = title
+        self.revision = 1
+        self.permissions = []
+        self.lists = {}
+        self._text = _TextBuffer("\n")
+        self._text_styles = {}
+        self._paragraph_styles = {}
+        self._bullets = _RangeLayer()
+        self._list_ids = itertools.count(1)
+
+    @property
+    def revision_id(self):
+        return f"{self.doc_id}-r{self.revision}"
+
+    @property
+    def end_index(self):
+        return len(self._text) + 1
+
+    def get_text(self):
+        """
+        Returns the text of the document, without the structural characters of its tables
+        """
+        return _STRUCTURAL_PATTERN.sub("", str(self._text))
+
+    def _layers(self):
+        return [self._bullets, *self._text_styles.values(), *self._paragraph_styles.values()]
+
+    def snapshot(self):
+        return (
+            self._text.copy(),
+            {name: layer.copy() for name, layer in self._text_styles.items()},
+            {name: layer.copy() for name, layer in self._paragraph_styles.items()},
+            self._bullets.copy(),
+            dict(self.lists),
+        )
+
+    def restore(self, snapshot):
+        self._text, self._text_styles, self._paragraph_styles, self._bullets, self.lists = snapshot
+
+    # Applying requests ==================================================================================================
+
+    def apply(self, request):
+        """
+        Applies a single request of a batchUpdate, raising a FakeHttpError (400) for an invalid request
+        """
+        if not isinstance(request, dict) or len(request) != 1:
+            raise FakeHttpError(400, f"Invalid request: {request!r}")
+        ((kind, body),) = request.items()
+        apply_request = self._REQUEST_KINDS.get(kind)
+        if apply_request is None:
+            raise FakeHttpError(400, f"Unsupported request: {kind}")
+        try:
+            apply_request(self, body)
+        except (KeyError, TypeError, ValueError) as error:
+            raise FakeHttpError(400, f"Invalid {kind} request: {error!r}")
+
+    def _location(self, body):
+        if "endOfSegmentLocation" in body:
+            return len(self._text)
+        index = body["location"]["index"]
+        if not 1 <= index <= len(self._text):
+            raise FakeHttpError(400, f"Index {index} must be less than the end index of the segment ({self.end_index})")
+        if self._text.slice(index - 1, index) in STRUCTURAL_CHARACTERS:
+            raise FakeHttpError(400, f"Index {index} is not inside a paragraph")
+        return index
+
+    def _range(self, body):
+        start, end = body["range"]["startIndex"], body["range"]["endIndex"]
+        if not 1 <= start < end <= self.end_index:
+            raise FakeHttpError(400, f"Invalid range [{start}, {end}) of a segment ending at {self.end_index}")
+        return start, end
+
+    def _paragraph_range(self, body):
+        """
+        Returns the range of the paragraphs overlapping the range of the request
+        """
+        start, end = self._range(body)
+        newline = self._text.find_newline(end - 2)
+        return self._text.rfind_separator(start - 1) + 2, (newline if newline >= 0 else len(self._text) - 1) + 2
+
+    def _insert(self, index, text):
+        self._text.insert(index - 1, text)
+        for layer in self._text_styles.values():
+            layer.insert(index, len(text))
+        for layer in [self._bullets, *self._paragraph_styles.values()]:
+            layer.insert(index, len(text), paragraph=True)
+
+    def insert_text(self, body):
+        text = body["text"]
+        if _STRUCTURAL_PATTERN.search(text):
+            raise FakeHttpError(400, "The text to insert contains invalid characters")
+        if text:
+            self._insert(self._location(body), text)
+
+    def insert_table(self, body):
+        rows, columns = int(body["rows"]), int(body["columns"])
+        if rows < 1 or columns < 1:
+            raise FakeHttpError(400, f"Invalid table size: {rows}x{columns}")
+        index = self._location(body)
+        table = TABLE_START + (ROW_START + (CELL_START + "\n") * columns) * rows + TABLE_END
+        # The table goes into a new paragraph, its cells start without any style
+        self._insert(index, "\n" + table)
+        for layer in self._layers():
+            layer.set(index + 1, index + 1 + len(table), None)
+
+    def delete_content_range(self, body):
+        start, end = self._range(body)
+        if end > len(self._text):
+            raise FakeHttpError(400, "The newline at the end of the segment cannot be deleted")
+        depth = 0
+        for character in _STRUCTURAL_PATTERN.findall(self._text.slice(start - 1, end - 1)):
+            if character == TABLE_START:
+                depth += 1
+            elif character == TABLE_END:
+                depth -= 1
+            if depth < 0 or (depth == 0 and character != TABLE_END):
+                raise FakeHttpError(400, "The range deletes part of a table")
+        if depth:
+            raise FakeHttpError(400, "The range deletes part of a table")
+        if self._text.slice(end - 1, end) in STRUCTURAL_CHARACTERS[1:] and self._text.slice(end - 2, end - 1) == "\n":
+            raise FakeHttpError(400, "The newline at the end of a table cell cannot be deleted")
+
+        self._text.delete(start - 1, end - 1)
+        for layer in self._layers():
+            layer.delete(start, end)
+
+    def update_text_style(self, body):
+        start, end = self._range(body)
+        text_style = body.get("textStyle", {})
+        fields = list(self._text_styles) + list(text_style) if body["fields"] == "*" else body["fields"].split(",")
+        for field in fields:
+            value = text_style.get(field.strip())
+            layer = self._text_styles.setdefault(field.strip(), _RangeLayer())
+            layer.set(start, end, value if value not in (None, False, {}) else None)
+
+    def update_paragraph_style(self, body):
+        start, end = self._paragraph_range(body)
+        paragraph_style = body.get("paragraphStyle", {})
+        fields = body["fields"]
+        fields = list(self._paragraph_styles) + list(paragraph_style) if fields == "*" else fields.split(",")
+        for field in fields:
+            value = paragraph_style.get(field.strip())
+            if field.strip() == "namedStyleType" and value == "NORMAL_TEXT":
+                value = None
+            self._paragraph_styles.setdefault(field.strip(), _RangeLayer()).set(start, end, value)
+
+    def create_paragraph_bullets(self, body):
+        start, end = self._paragraph_range(body)
+        list_id = f"fake.list.{next(self._list_ids)}"
+        self.lists[list_id] = body.get("bulletPreset", "BULLET_DISC_CIRCLE_SQUARE")
+        self._bullets.set(start, end, list_id)
+
+    def delete_paragraph_bullets(self, body):
+        start, end = self._paragraph_range(body)
+        self._bullets.set(start, end, None)
+
+    _REQUEST_KINDS = {
+        "insertText": insert_text,
+        "insertTable": insert_table,
+        "deleteContentRange": delete_content_range,
+        "updateTextStyle": update_text_style,
+        "updateParagraphStyle": update_paragraph_style,
+        "createParagraphBullets": create_paragraph_bullets,
+        "deleteParagraphBullets": delete_paragraph_bullets,
+    }
+
+    # Reading the document ===============================================================================================
+
+    def to_dict(self):
+        """
+        Returns the document in the JSON shape of documents().get of the Google Docs API
+        """
+        text = str(self._text)
+        boundaries = sorted({index for layer in self._text_styles.values() for index in layer.boundaries()})
+        content, _ = self._structural_elements(text, 0, boundaries)
+        return {
+            "documentId": self.doc_id,
+            "title": self.title,
+            "revisionId": self.revision_id,
+            "body": {"content": [{"endIndex": 1, "sectionBreak": {"sectionStyle": {}}}] + content},
+        }
+
+    def _structural_elements(self, text, position, boundaries):
+        """
+        Returns the paragraphs and tables from the position up to the end of the text (or of the table cell), along
+        with the position they end at
+        """
+        elements = []
+        while position < len(text):
+            character = text[position]
+            if character == TABLE_START:
+                table, position = self._table(text, position, boundaries)
+                elements.append(table)
+            elif character in STRUCTURAL_CHARACTERS:
+                break
+            else:
+                newline = text.find("\n", position)
+                elements.append(self._paragraph(text, position + 1, newline + 2, boundaries))
+                position = newline + 1
+        return elements, position
+
+    def _table(self, text, position, boundaries):
+        start_index = position + 1
+        position += 1
+        table_rows = []
+        while text[position] == ROW_START:
+            row_start_index = position + 1
+            position += 1
+            table_cells = []
+            while text[position] == CELL_START:
+                cell_start_index = position + 1
+                content, position = self._structural_elements(text, position + 1, boundaries)
+                table_cells.append({"startIndex": cell_start_index, "endIndex": position + 1, "content": content})
+            table_rows.append({"startIndex": row_start_index, "endIndex": position + 1, "tableCells": table_cells})
+        position += 1
+        table = {"rows": len(table_rows), "columns": len(table_rows[0]["tableCells"]), "tableRows": table_rows}
+        return {"startIndex": start_index, "endIndex": position + 1, "table": table}, position
+
+    def _paragraph(self, text, start_index, end_index, boundaries):
+        cuts = [start_index]
+        cuts.extend(boundaries[bisect.bisect_right(boundaries, start_index):bisect.bisect_left(boundaries, end_index)])
+        cuts.append(end_index)
+
+        elements = []
+        for run_start, run_end in zip(cuts, cuts[1:]):
+            text_style = {}
+            for field, layer in self._text_styles.items():
+                value = layer.value_at(run_start)
+                if value is not None:
+                    text_style[field] = value
+            elements.append({
+                "startIndex": run_start,
+                "endIndex": run_end,
+                "textRun": {"content": text[run_start - 1:run_end - 1], "textStyle": text_style},
+            })
+
+        paragraph_style = {"namedStyleType": "NORMAL_TEXT"}
+        for field, layer in self._paragraph_styles.items():
+            value = layer.value_at(start_index)
+            if value is not None:
+                paragraph_style[field] = value
+        paragraph = {"elements": elements, "paragraphStyle": paragraph_style}
+        list_id = self._bullets.value_at(start_index)
+        if list_id is not None:
+            paragraph["bullet"] = {"listId": list_id, "nestingLevel": 0}
+        return {"startIndex": start_index, "endIndex": end_index, "paragraph": paragraph}
+
+
+class FakeRequest:
+    """
+    A pending API call of a fake service, made when execute() is called (like the requests of the Google API client,
+    its methodId names the API method, such as docs.documents.batchUpdate)
+    """
+
+    def __init__(self, service, method, call, payload_bytes=0):
+        self.service = service
+        self.method = method
+        self.methodId = f"{service.API_NAME}.{method}"
+        self.call = call
+        self.payload_bytes = payload_bytes
+
+    def execute(self):
+        return self.service._execute(self.method, self.call, self.payload_bytes)
+
+
+class _FakeService:
+    """
+    The latency and error injection and the counters shared by the fake services.
+
+    Every call waits for latency seconds (or latency(method) seconds when it is a callable), then fails with a
+    FakeHttpError of error_status with a probability of error_rate (drawn from a random generator seeded by seed).
+    Calls can also be made to fail one after another with fail_next. Calls carrying more than max_payload_bytes
+    of JSON are rejected with an HTTP 413, like requests too large for the Google APIs.
+
+    The calls made per method, the payload bytes received and the errors injected are counted in calls,
+    bytes_received and errors_injected. Calls can be sent together with new_batch_http_request (see
+    FakeBatchHttpRequest), every batch sent is counted as a "batch" call.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, error_status=503, max_payload_bytes=None, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.max_payload_bytes = max_payload_bytes
+        self.calls = collections.Counter()
+        self.bytes_received = 0
+        self.errors_injected = 0
+        self._random = random.Random(seed)
+        self._failures = collections.deque()
+        self._lock = threading.RLock()
+
+    def fail_next(self, count=1, status=503, applied=False, reason=None):
+        """
+        Makes the next count calls fail with an HTTP error of the given status (and reason, such as
+        rateLimitExceeded). With applied switched on, the calls are made before failing, like calls whose answer was
+        lost after the server applied them.
+        """
+        with self._lock:
+            self._failures.extend([(status, applied, reason)] * count)
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls.clear()
+            self.bytes_received = 0
+            self.errors_injected = 0
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatchHttpRequest(self, callback)
+
+    def _execute(self, method, call, payload_bytes):
+        latency = self.latency(method) if callable(self.latency) else self.latency
+        if latency:
+            time.sleep(latency)
+        return self._answer(method, call, payload_bytes)
+
+    def _answer(self, method, call, payload_bytes):
+        with self._lock:
+            self.calls[method] += 1
+            self.bytes_received += payload_bytes
+            if self._failures:
+                self.errors_injected += 1
+                status, applied, reason = self._failures.popleft()
+                if applied:
+                    call()
+                raise FakeHttpError(status, f"Injected error of {method}", reason)
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.errors_injected += 1
+                raise FakeHttpError(self.error_status, f"Injected error of {method}")
+            if self.max_payload_bytes is not None and payload_bytes > self.max_payload_bytes:
+                raise FakeHttpError(413, f"Request of {payload_bytes} bytes is too large")
+            return call()
+
+
+class FakeBatchHttpRequest:
+    """
+    A batch of calls to a fake service, made in a single round trip when execute() is called (like the
+    BatchHttpRequest returned by new_batch_http_request). Every call of the batch is answered on its own: the callback
+    of the call and the callback of the batch are called with its request_id, its response and its error (None when
+    it succeeded), and injected errors hit the calls one by one. Batches of more than MAX_BATCH_CALLS calls are
+    rejected with an HTTP 400, like the Google APIs do.
+    """
+
+    def __init__(self, service, callback=None):
+        self.service = service
+        self.callback = callback
+        self._calls = []
+
+    def add(self, request, callback=None, request_id=None):
+        if request_id is None:
+            request_id = str(len(self._calls) + 1)
+        self._calls.append((request_id, request, callback))
+
+    def execute(self):
+        service = self.service
+        latency = service.latency("batch") if callable(service.latency) else service.latency
+        if latency:
+            time.sleep(latency)
+        with service._lock:
+            service.calls["batch"] += 1
+        if len(self._calls) > MAX_BATCH_CALLS:
+            raise FakeHttpError(400, f"A batch request holds at most {MAX_BATCH_CALLS} calls")
+
+        for request_id, request, callback in self._calls:
+            try:
+                response, error = service._answer(request.method, request.call, request.payload_bytes), None
+            except FakeHttpError as exception:
+                response, error = None, exception
+            for batch_callback in (callback, self.callback):
+                if batch_callback is not None:
+                    batch_callback(request_id, response, error)
+
+
+class FakeDocsService(_FakeService):
+    """
+    An in-memory stand-in for the Google Docs service build (docs_service). It answers documents().create,
+    documents().get (always with the whole document, whatever the fields asked for) and documents().batchUpdate.
+
+    A batchUpdate applies insertText, insertTable, deleteContentRange, updateTextStyle, updateParagraphStyle,
+    createParagraphBullets and deleteParagraphBullets requests to the FakeDocument, with the index semantics of the
+    Google Docs API. Like the real API, a batch is applied atomically: if any request is invalid, an HTTP 400 is raised
+    and none of the batch is applied. A writeControl requiredRevisionId is checked against the document revision.
+
+    See _FakeService for the latency and error injection and the counters, requests_applied counts the requests of
+    every batch applied. A FakeDocsService can be shared by threads.
+    """
+
+    API_NAME = "docs"
+
+    def __init__(self, latency=0.0, error_rate=0.0, error_status=503, max_payload_bytes=None, seed=None):
+        super().__init__(latency, error_rate, error_status, max_payload_bytes, seed)
+        self.docs = {}
+        self.requests_applied = 0
+        self._doc_ids = itertools.count(1)
+
+    def reset_counters(self):
+        with self._lock:
+            super().reset_counters()
+            self.requests_applied = 0
+
+    def documents(self):
+        return self
+
+    def document(self, doc_id):
+        """
+        Returns the FakeDocument of the doc id
+        """
+        return self.docs[doc_id]
+
+    def add_document(self, title=""):
+        """
+        Adds an empty document (without counting an API call) and returns it
+        """
+        with self._lock:
+            document = FakeDocument(f"fake-doc-{next(self._doc_ids)}", title)
+            self.docs[document.doc_id] = document
+            return document
+
+    def _get_document(self, doc_id):
+        if doc_id not in self.docs:
+            raise FakeHttpError(404, f"Requested entity was not found: {doc_id}")
+        return self.docs[doc_id]
+
+    def create(self, body=None):
+        def call():
+            return self.add_document((body or {}).get("title", "")).to_dict()
+
+        return FakeRequest(self, "documents.create", call)
+
+    def get(self, documentId, fields=None, **kwargs):
+        return FakeRequest(self, "documents.get", lambda: self._get_document(documentId).to_dict())
+
+    def batchUpdate(self, documentId, body):
+        def call():
+            document = self._get_document(documentId)
+            required_revision_id = body.get("writeControl", {}).get("requiredRevisionId")
+            if required_revision_id is not None and required_revision_id != document.revision_id:
+                raise FakeHttpError(400, f"The document revision is not {required_revision_id}")
+
+            snapshot = document.snapshot()
+            try:
+                for request in body["requests"]:
+                    document.apply(request)
+            except FakeHttpError:
+                document.restore(snapshot)
+                raise
+            document.revision += 1
+            self.requests_applied += len(body["requests"])
+            return {
+                "documentId": documentId,
+                "replies": [{} for _ in body["requests"]],
+                "writeControl": {"requiredRevisionId": document.revision_id},
+            }
+
+        return FakeRequest(self, "documents.batchUpdate", call, len(json.dumps(body)))
+
+
+class _FakeResource:
+    def __init__(self, service, name):
+        self.service = service
+        self.name = name
+
+    def create(self, **kwargs):
+        def call():
+            return getattr(self.service, f"_create_{self.name}")(**kwargs)
+
+        return FakeRequest(self.service, f"{self.name}.create", call, len(json.dumps(kwargs.get("body", {}))))
+
+
+class FakeDriveService(_FakeService):
+    """
+    An in-memory stand-in for the Google Drive service build (drive_service), answering files().create and
+    permissions().create. Google Docs created through it are added to the FakeDocsService (a new one by default)
+    with the name of the file as their title, and their permissions are kept in FakeDocument.permissions.
+    See _FakeService for the latency and error injection and the counters.
+    """
+
+    API_NAME = "drive"
+
+    def __init__(self, docs_service=None, latency=0.0, error_rate=0.0, error_status=503, max_payload_bytes=None,
+                 seed=None):
+        super().__init__(latency, error_rate, error_status, max_payload_bytes, seed)
+        self.docs_service = docs_service if docs_service is not None else FakeDocsService()
+
+    def files(self):
+        return _FakeResource(self, "files")
+
+    def permissions(self):
+        return _FakeResource(self, "permissions")
+
+    def _create_files(self, body, **kwargs):
+        document = self.docs_service.add_document(body.get("name", ""))
+        return {"id": document.doc_id, "name": document.title, "mimeType": body.get("mimeType")}
+
+    def _create_permissions(self, fileId, body, **kwargs):
+        document = self.docs_service._get_document(fileId)
+        with self.docs_service._lock:
+            document.permissions.append(dict(body))
+            return dict(body, id=f"permission-{len(document.permissions)}")
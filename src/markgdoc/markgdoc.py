@@ -1,10 +1,29 @@
+import os
 import re
+import json
+import hashlib
+import difflib
+import time
+import random
+import datetime
+import socket
+import contextlib
 import threading
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+import concurrent.futures
+from collections import Counter, namedtuple
 
 # Markdown Syntax Notes: https://www.markdownguide.org/basic-syntax/
 
+# Version of the RequestPlan serialization format (see RequestPlan.to_dict)
+PLAN_FORMAT_VERSION = 1
+
+# Version of the markdown compiler, to be bumped whenever the requests compiled for the same markdown change
+# (cached plans of another compiler version are never used, see markgdoc.cache)
+COMPILER_VERSION = 2
+
+# Default limit of serialized request bytes sent in a single batchUpdate call (see BatchSizer)
+DEFAULT_MAX_BATCH_BYTES = 1024 * 1024
+
 # Google Docs API Request Functions ===================================================================================
 # Disclaimer! Every Request has an optional 'debug' parameter. By default this is False, however if switched on as True
 # You will be able to see the request made, the content, extra parameters and the index the content is being inserted at 
@@ -205,174 +224,384 @@ def get_table_content_request(table_data, index, debug=False):
     - Output: Content Insertion Requests for each cell, Styling Requests for each cell, Table ending index
     """
 
-    if(debug): 
-        print("Applying Table Content Insertion Request: =========================================\n")
-
     table_requests = []
     style_requests = []
+    table_end_index = compile_table_content(table_data, index, table_requests, style_requests, debug=debug)
 
-    # Accounting for table initiation
-    index = index + 1
-    for i_row, row in enumerate(table_data):
-        # For each row we increment
-        index += 1
-        for i_cell, cell in enumerate(row):
-            # For each cell we incremenet
-            index += 1
+    # Every styled span of a cell comes with its reset request (see get_style_request)
+    style_requests = [request.to_dict() for request in style_requests]
+    style_pairs = [style_requests[position:position + 2] for position in range(0, len(style_requests), 2)]
+    return [request.to_dict() for request in table_requests], style_pairs, table_end_index
 
-            if(debug): 
-                print("Start Index: ", index)
 
-            received_styles, cleaned_cell = preprocess_nested_styles(cell, index, False)
-            style_requests.extend(received_styles)
+# Compact Requests =======================================================================================================
+# While compiling, requests are held as CompactRequests rather than the nested dicts of the Google Docs API, and only
+# turned into dicts batch by batch right before being sent (see send_batch_update)
 
-            if(debug): 
-                print(f"Inserting content: {cleaned_cell} at Index: {index}")
-            
-            request = {
-                "insertText": {"location": {"index": index}, "text": cleaned_cell}
-            }
+# The paragraph styles compact requests refer to by their id
+HORIZONTAL_LINE_STYLE = "HORIZONTAL_LINE"
 
-            table_requests.append(request)
 
-            if(debug): 
-                print("Length of Characters in cell: ", len(cleaned_cell) + 1)
+class CompactRequest:
+    """
+    A single Google Docs API request, storing only its kind, its index range and a value:
 
-            # Accounting for newline character
-            index += len(cleaned_cell) + 1
+    - insertText: start is the index, value the text to insert
+    - insertTable: start is the index, value the (rows, columns) of the table
+    - updateParagraphStyle: start and end are the range, value the paragraph style id (HEADING_1 to HEADING_6 or
+      HORIZONTAL_LINE)
+    - createParagraphBullets: start and end are the range, value the bullet preset
+    - updateTextStyle: start and end are the range, value the style (bold, italic, strike), ("link", url) for
+      hyperlinks or None for a reset request
 
-            if(debug): 
-                print(f"End Index: {index}\n")
+    A CompactRequest compares equal to the Google Docs API request it stands for (see to_dict).
+    """
 
-    table_end_index = index + 1
+    __slots__ = ("kind", "start", "end", "value")
+
+    def __init__(self, kind, start, end=None, value=None):
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.value = value
+
+    def __eq__(self, other):
+        if isinstance(other, CompactRequest):
+            other = other.to_dict()
+        if not isinstance(other, dict):
+            return NotImplemented
+        return self.to_dict() == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"CompactRequest({self.kind!r}, {self.start!r}, {self.end!r}, {self.value!r})"
+
+    def shifted(self, delta):
+        """
+        Returns a copy of the request with its index (or range) moved by delta
+        """
+        end = self.end + delta if self.end is not None else None
+        return CompactRequest(self.kind, self.start + delta, end, self.value)
+
+    def to_dict(self):
+        """
+        Returns the request in the JSON shape of the Google Docs API
+        """
+        kind = self.kind
+        if kind == "insertText":
+            return {"insertText": {"location": {"index": self.start}, "text": self.value}}
+        if kind == "insertTable":
+            rows, columns = self.value
+            return {"insertTable": {"rows": rows, "columns": columns, "location": {"index": self.start}}}
+
+        request_range = {"startIndex": self.start, "endIndex": self.end}
+        if kind == "createParagraphBullets":
+            return {"createParagraphBullets": {"range": request_range, "bulletPreset": self.value}}
+        if kind == "updateParagraphStyle":
+            if self.value == HORIZONTAL_LINE_STYLE:
+                paragraph_style = {
+                    "borderBottom": {
+                        "color": {"color": {"rgbColor": {"red": 0, "green": 0, "blue": 0}}},
+                        "width": {"magnitude": 1, "unit": "PT"},
+                        "padding": {"magnitude": 1, "unit": "PT"},
+                        "dashStyle": "SOLID",
+                    }
+                }
+                fields = "borderBottom"
+            else:
+                paragraph_style = {"namedStyleType": self.value}
+                fields = "namedStyleType"
+            return {"updateParagraphStyle": {"range": request_range, "paragraphStyle": paragraph_style, "fields": fields}}
+
+        if self.value is None:
+            text_style, fields = {}, "*"
+        elif isinstance(self.value, str):
+            text_style, fields = {self.value: True}, self.value
+        else:
+            text_style, fields = {"link": {"url": self.value[1]}}, "link"
+        return {"updateTextStyle": {"range": request_range, "textStyle": text_style, "fields": fields}}
 
-    if(debug): 
-        print("===================================================================================\n")
 
-    return table_requests, style_requests, table_end_index
+def request_to_dict(request):
+    """
+    This is a helper function which returns the request in the JSON shape of the Google Docs API, whether it is a
+    CompactRequest or already a dict
+    """
+    return request.to_dict() if isinstance(request, CompactRequest) else request
+
 
 # ========================================================================================================================
 # Google Doc Creation Helper Functions ====================================================================================
+# The Google API client libraries are only imported once an API call is about to be made, so that importing markgdoc
+# (for example to only compile markdown) stays fast
+def load_service_account_credentials(credentials_file, scopes):
+    """
+    Loads the service account credentials from your credentials file for the given scopes
+    """
+    from google.oauth2 import service_account
+
+    return service_account.Credentials.from_service_account_file(credentials_file, scopes=scopes)
+
+
+def build_service(service_name, version, credentials):
+    """
+    Builds a Google API service (such as "docs", "v1" or "drive", "v3") from the static discovery documents bundled
+    with the Google API client library, without fetching or caching discovery documents at runtime
+    """
+    from googleapiclient.discovery import build
+
+    return build(service_name, version, credentials=credentials, static_discovery=True, cache_discovery=False)
+
+
 def authenticate_google_drive(credentials_file, scopes):
     """
     Authentication of Google Drive for Google Doc Creation\
     Simply make sure you pass the path to your credentials file and scopes of what you aim to use it for
     """
 
-    creds = service_account.Credentials.from_service_account_file(
-        credentials_file, scopes=scopes
-    )
-    return build("drive", "v3", credentials=creds)
+    creds = load_service_account_credentials(credentials_file, scopes)
+    return build_service("drive", "v3", creds)
 
 
-def create_empty_google_doc(document_title, credentials_file, scopes):
+class MarkGDocSession:
     """
-    This helper function can be used to create an empty google docs
-    Simply make sure you pass the path to your credentials file and scopes of what you aim to use it for
+    A session loads your credentials once and keeps the Google Docs and Google Drive service builds it creates, so
+    that many conversions can run one after another (or concurrently) without re-authenticating every time.
+    Simply pass the path to your credentials file and scopes, or already loaded google-auth credentials.
+
+    The access token is refreshed ahead of time, once it is within refresh_margin seconds of expiring. Service builds
+    are not thread-safe, so every caller borrows its own pair of builds through services() and gives it back after.
+    """
+
+    def __init__(self, credentials_file=None, scopes=None, credentials=None, refresh_margin=300):
+        if credentials is None:
+            credentials = load_service_account_credentials(credentials_file, scopes)
+        self.credentials = credentials
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin)
+        self._free_services = []
+        self._lock = threading.Lock()
+
+    def ensure_fresh(self):
+        """
+        Refreshes the access token if there is none yet or if it is about to expire
+        """
+        with self._lock:
+            expiry = self.credentials.expiry
+            now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+            if not self.credentials.token or expiry is None or expiry - now < self.refresh_margin:
+                from google.auth.transport.requests import Request
+
+                self.credentials.refresh(Request())
+
+    @contextlib.contextmanager
+    def services(self):
+        """
+        Borrows a (docs_service, drive_service) pair of service builds, building a new one only if all of them
+        are in use:
+            with session.services() as (docs_service, drive_service):
+        """
+        self.ensure_fresh()
+        with self._lock:
+            pair = self._free_services.pop() if self._free_services else None
+        if pair is None:
+            pair = (build_service("docs", "v1", self.credentials), build_service("drive", "v3", self.credentials))
+        try:
+            yield pair
+        finally:
+            with self._lock:
+                self._free_services.append(pair)
+
+
+# Permission given on every google doc created, unless another permission_body is passed: anyone with the link can
+# view and edit the doc right away
+DEFAULT_PERMISSION_BODY = {"type": "anyone", "role": "writer"}
+
+
+def get_permission_bodies(permission_body):
+    """
+    This is a helper function which returns the permissions to create on a new google doc: none for None, the
+    permission_body for a single permission (a dict), or every permission of a list of them
+    """
+    if permission_body is None:
+        return []
+    if isinstance(permission_body, dict):
+        return [permission_body]
+    return list(permission_body)
+
+
+def get_doc_metadata(document_title):
+    """
+    This is a helper function which returns the Drive file metadata of a new google doc
     """
-    drive_service = authenticate_google_drive(credentials_file, scopes)
-    doc_metadata = {
+    return {
         "name": document_title,
         "mimeType": "application/vnd.google-apps.document",
     }
 
-    doc = drive_service.files().create(body=doc_metadata).execute()
+
+def create_empty_google_doc(
+    document_title, credentials_file=None, scopes=None, drive_service=None, session=None, metrics=None,
+    permission_body=DEFAULT_PERMISSION_BODY
+):
+    """
+    This helper function can be used to create an empty google docs
+    Simply make sure you pass the path to your credentials file and scopes of what you aim to use it for,
+    an already authenticated Google Drive service build or a MarkGDocSession.
+    The doc is shared with the permission_body (a Drive permission, a list of them or None, anyone can edit by default).
+    """
+    if drive_service is None and session is not None:
+        with session.services() as (_, drive_service):
+            return create_empty_google_doc(
+                document_title, drive_service=drive_service, metrics=metrics, permission_body=permission_body
+            )
+    if drive_service is None:
+        drive_service = authenticate_google_drive(credentials_file, scopes)
+
+    # A file creation is not idempotent: it is only retried when it was turned down, so that a creation whose answer
+    # was lost never leaves a second doc behind
+    doc = execute_request(
+        drive_service.files().create(body=get_doc_metadata(document_title)), rate_limiter=DRIVE_RATE_LIMITER,
+        metrics=metrics, idempotent=False,
+    )
     doc_id = doc["id"]
 
     # Set permissions to allow user to view and edit immediately
-    permission_body = {"type": "anyone", "role": "writer"}
-    drive_service.permissions().create(fileId=doc_id, body=permission_body).execute()
+    for permission in get_permission_bodies(permission_body):
+        execute_request(
+            drive_service.permissions().create(fileId=doc_id, body=permission), rate_limiter=DRIVE_RATE_LIMITER,
+            metrics=metrics,
+        )
 
     doc_url = f"https://docs.google.com/document/d/{doc_id}/edit"
     return doc_id, doc_url
 
 
-def preprocess_nested_styles(chunk, index, paragraph_flag, debug=False):
-    """
-    This is a helper function that deals with nested markdown syntax. 
-    Since you can have multiple markdown syntax in a chunk of text, 
-    we first preprocess the ones that don't rely on text insertion such as 
-    styling (bold, italics, strikethrough), hyperlinks, blockquotes. 
+# Creating Docs in Bulk ==================================================================================================
+# Creating a google doc takes two Drive calls (the file, then its permission). To create many docs, the calls are
+# sent through the HTTP batch endpoint of the Drive API: up to MAX_BATCH_CALLS calls per round trip, every call still
+# answered (and counted against the quota) on its own.
 
-    This function inputs the chunk of text, the index, and whether the chunk 
-    is a paragraph or not (as well as optional debugging).
-    This function outputs the stored style_requests and the cleaned-up chunk.
-    """
-    style_requests = []
+# Most calls the Google APIs accept in a single batch request
+MAX_BATCH_CALLS = 100
 
-    # Now, detect all other styles and hyperlinks in the main chunk
-    matches = []
-    
-    bolditalics_match = re.search(r"\*\*\_(.+?)\_\*\*", chunk) or re.search(r"\_\*\*(.+?)\*\*\_", chunk)
-    bold_match = re.search(r"\*\*(.+?)\*\*", chunk)
-    italic_match = re.search(r"\_(.+?)\_", chunk)
-    strike_match = re.search(r"\~(.+?)\~", chunk)
-    hyperlink_match = re.search(r"\[(.+?)\]\((http[s]?:\/\/.+?)\)", chunk)
+# A google doc created by create_empty_google_docs: its title, doc id and url, and the error its creation failed with
+# (None on success). A doc created but not shared keeps its doc_id and doc_url along with the error of its permission.
+CreatedDoc = namedtuple("CreatedDoc", ["title", "doc_id", "doc_url", "error"])
 
-    if bolditalics_match:
-        matches.append(("bolditalics", bolditalics_match))
 
-    elif bold_match:
-        matches.append(("bold", bold_match))
-    
-    elif italic_match:
-        matches.append(("italic", italic_match))
-    
-    if strike_match:
-        matches.append(("strike", strike_match))
-    
-    if hyperlink_match:
-        matches.append(("hyperlink", hyperlink_match))
-
-    # Sort matches by their starting index
-    matches.sort(key=lambda x: x[1].start())
-
-    # Offset to track the difference between original and modified chunk
-    offset = 0
-
-    # Process matches in order
-    for match_type, match in matches:
-        original_start_idx = match.start() + offset
-        original_end_idx = match.end() + offset
-
-        # Update the start index based on the modified chunk
-        if match_type == "bolditalics":
-            text = match.group(1).strip()
-            start_idx = original_start_idx if paragraph_flag else 0
-            style_requests.append(get_style_request(text, "bold", index + start_idx, debug=debug))
-            style_requests.append(get_style_request(text, "italic", index + start_idx, debug=debug))
-            chunk = chunk[:original_start_idx] + text + chunk[original_end_idx:]
-        
-        elif match_type == "bold":
-            text = match.group(1).strip()
-            start_idx = original_start_idx if paragraph_flag else 0
-            style_requests.append(get_style_request(text, "bold", index + start_idx, debug=debug))
-            chunk = chunk[:original_start_idx] + text + chunk[original_end_idx:]
-        
-        elif match_type == "italic":
-            text = match.group(1).strip()
-            start_idx = original_start_idx if paragraph_flag else 0
-            style_requests.append(get_style_request(text, "italic", index + start_idx, debug=debug))
-            chunk = chunk[:original_start_idx] + text + chunk[original_end_idx:]
-        
-        elif match_type == "strike":
-            text = match.group(1).strip()
-            start_idx = original_start_idx if paragraph_flag else 0 
-            style_requests.append(get_style_request(text, "strike", index + start_idx, debug=debug))
-            chunk = chunk[:original_start_idx] + text + chunk[original_end_idx:]
-        
-        elif match_type == "hyperlink":
-            text = match.group(1).strip()  
-            url = match.group(2).strip()
-            start_idx = original_start_idx if paragraph_flag else 0
-            style_requests.append(get_hyperlink_request(text, url, index + start_idx, debug=debug))
-            chunk = chunk[:original_start_idx] + text + chunk[original_end_idx:]
-
-        # Adjust the offset based on the length difference between the original match and the new text
-        offset -= (len(match.group(0)) - len(text))
-
-    cleaned_chunk = chunk
-    return style_requests, cleaned_chunk
+def execute_batch_requests(
+    service, requests, rate_limiter=None, max_retries=5, backoff=1.0, max_backoff=32.0, batch_size=MAX_BATCH_CALLS,
+    metrics=None, idempotent=True
+):
+    """
+    This executes many Google API requests of a service through its HTTP batch endpoint (new_batch_http_request),
+    batch_size requests per round trip. Every request takes a token of the rate_limiter.
+    Requests failing with a retryable error (see is_retryable_error) are sent again in a later batch, up to
+    max_retries times with jittered exponential backoff (see execute_request). Requests which are not idempotent
+    (idempotent=False) are only sent again when they were turned down before being applied. A batch failing as a whole
+    fails all its requests. With metrics (see Metrics), the batches, API calls, errors and retries are measured.
+
+    This function outputs a (response, error) pair for every request, in the order of the requests.
+    """
+    outcomes = [(None, None)] * len(requests)
+
+    def answer(request_id, response, error):
+        outcomes[int(request_id)] = (response, error)
+
+    pending = list(range(len(requests)))
+    attempt = 0
+    while True:
+        for start in range(0, len(pending), batch_size):
+            positions = pending[start:start + batch_size]
+            batch = service.new_batch_http_request(callback=answer)
+            for position in positions:
+                batch.add(requests[position], request_id=str(position))
+            if rate_limiter is not None:
+                waited = rate_limiter.acquire(len(positions))
+                if metrics is not None and waited:
+                    metrics.timing("rate_limit_wait", waited)
+            if metrics is not None:
+                metrics.count("batch_requests")
+                for position in positions:
+                    metrics.count(f"api_calls.{getattr(requests[position], 'methodId', None) or 'unknown'}")
+            try:
+                batch.execute()
+            except Exception as error:
+                for position in positions:
+                    outcomes[position] = (None, error)
+
+        failed = [position for position in pending if outcomes[position][1] is not None]
+        if metrics is not None:
+            for position in failed:
+                error = outcomes[position][1]
+                metrics.count(f"errors.{getattr(getattr(error, 'resp', None), 'status', None) or type(error).__name__}")
+        pending = [position for position in failed if is_retryable_error(outcomes[position][1], idempotent)]
+        if not pending or attempt >= max_retries:
+            return outcomes
+
+        delay = get_retry_delay(attempt, backoff, max_backoff)
+        if metrics is not None:
+            metrics.count("retries", len(pending))
+            metrics.timing("retry_wait", delay)
+            metrics.event("retry", attempt=attempt + 1, delay=delay, error=repr(outcomes[pending[0]][1]))
+        time.sleep(delay)
+        attempt += 1
+
+
+def create_empty_google_docs(
+    document_titles, credentials_file=None, scopes=None, drive_service=None, session=None, metrics=None,
+    permission_body=DEFAULT_PERMISSION_BODY
+):
+    """
+    This is the bulk version of create_empty_google_doc: it creates an empty google doc for every title in a few
+    round trips, sending the file creations and then the permissions through the Drive batch endpoint (see
+    execute_batch_requests). Every doc is shared with the permission_body (a Drive permission, a list of them or None,
+    anyone can edit by default).
+
+    This function outputs a CreatedDoc for every title, in the order of the titles. A doc which could not be created
+    or shared does not stop the others, its error is reported in its CreatedDoc. File creations are only retried when
+    they were rate limited (see execute_batch_requests).
+    """
+    if drive_service is None and session is not None:
+        with session.services() as (_, drive_service):
+            return create_empty_google_docs(
+                document_titles, drive_service=drive_service, metrics=metrics, permission_body=permission_body
+            )
+    if drive_service is None:
+        drive_service = authenticate_google_drive(credentials_file, scopes)
+
+    document_titles = list(document_titles)
+    # A creation whose answer was lost may have created its file already, so only the creations turned down (rate
+    # limited) are sent again, never leaving duplicate docs behind. Creating the same permission again is harmless.
+    files = execute_batch_requests(
+        drive_service, [drive_service.files().create(body=get_doc_metadata(title)) for title in document_titles],
+        rate_limiter=DRIVE_RATE_LIMITER, metrics=metrics, idempotent=False,
+    )
+    errors = [error for _, error in files]
+
+    # Set permissions to allow user to view and edit immediately
+    permission_requests = []
+    owners = []
+    for position, (file, error) in enumerate(files):
+        if error is not None:
+            continue
+        for permission in get_permission_bodies(permission_body):
+            permission_requests.append(drive_service.permissions().create(fileId=file["id"], body=permission))
+            owners.append(position)
+    permissions = execute_batch_requests(
+        drive_service, permission_requests, rate_limiter=DRIVE_RATE_LIMITER, metrics=metrics
+    )
+    for position, (_, error) in zip(owners, permissions):
+        if error is not None and errors[position] is None:
+            errors[position] = error
+
+    created_docs = []
+    for title, (file, _), error in zip(document_titles, files, errors):
+        doc_id = file["id"] if file is not None else None
+        doc_url = f"https://docs.google.com/document/d/{doc_id}/edit" if doc_id is not None else None
+        created_docs.append(CreatedDoc(title, doc_id, doc_url, error))
+    return created_docs
 
 
 def preprocess_markdown_table(markdown_table):
@@ -442,167 +671,1994 @@ def is_paragraph(chunk):
         return True
     return False
 
-def send_batch_update(docs_service, doc_id, requests, rate_limit=120):
+# Inline Style Scanner ===================================================================================================
+# Style markers: Bolding (**), Italics (_), Strikethrough (~ or ~~) and Hyperlinks ([text](http(s)://url)).
+# Styles can be nested inside each other, for example Bolding + Italics (**_ or _**).
+_INLINE_MARKER_PATTERN = re.compile(r"\*\*|~~|[_~\[]")
+_INLINE_MARKERS = {"**": ("**", "bold"), "_": ("_", "italic"), "~": ("~", "strike"), "~~": ("~~", "strike")}
+_HYPERLINK_PATTERN = re.compile(r"https?://")
+
+# A styled span of text: its start and end offsets in the cleaned text, the style (bold, italic, strike or link)
+# and the url for hyperlinks
+InlineSpan = namedtuple("InlineSpan", ["start", "end", "style", "url"], defaults=(None,))
+
+
+def parse_inline_styles(text):
+    """
+    This scans a chunk of text once from left to right and finds every styled span in it.
+    It outputs the cleaned text (without any style markers) and the list of InlineSpans, ordered by their start,
+    with offsets into the cleaned text.
+    """
+    parts = []
+    spans = []
+    _scan_inline_styles(text, 0, len(text), parts, spans, 0)
+    return "".join(parts), spans
+
+
+def _scan_inline_styles(text, position, end, parts, spans, offset):
+    """
+    Scans text[position:end] appending the cleaned text to parts and the spans found to spans.
+    The offset is the length of the cleaned text so far, the offset right after the scanned text is returned.
+    """
+    # Closing markers are searched at most once per scan, the next occurrence of every marker is remembered
+    next_found = {}
+
+    def find(marker, start):
+        found = next_found.get(marker)
+        if found is None or start > found >= 0:
+            found = text.find(marker, start, end)
+            next_found[marker] = found
+        return found
+
+    while position < end:
+        marker_match = _INLINE_MARKER_PATTERN.search(text, position, end)
+        if marker_match is None:
+            break
+
+        start = marker_match.start()
+        marker = marker_match.group()
+        if start > position:
+            parts.append(text[position:start])
+            offset += start - position
+
+        url = None
+        if marker == "[":
+            style = "link"
+            middle = find("](", start + 2)
+            scheme = _HYPERLINK_PATTERN.match(text, middle + 2, end) if middle >= 0 else None
+            close = find(")", scheme.end() + 1) if scheme else -1
+            content_start, content_end, resume = start + 1, middle, close + 1
+            if close >= 0:
+                url = text[middle + 2:close].strip()
+        else:
+            closing_marker, style = _INLINE_MARKERS[marker]
+            close = find(closing_marker, start + len(marker) + 1)
+            content_start, content_end, resume = start + len(marker), close, close + len(closing_marker)
+
+        # Styled text is stripped, markers around blank text are left as they are
+        if close >= 0:
+            while content_start < content_end and text[content_start].isspace():
+                content_start += 1
+            while content_end > content_start and text[content_end - 1].isspace():
+                content_end -= 1
+
+        if close < 0 or content_start == content_end:
+            parts.append(marker[0])
+            offset += 1
+            position = start + 1
+            continue
+
+        # Nested styles are scanned inside the span, the span itself comes before them
+        if _INLINE_MARKER_PATTERN.search(text, content_start, content_end) is None:
+            parts.append(text[content_start:content_end])
+            span_end = offset + content_end - content_start
+            spans.append(InlineSpan(offset, span_end, style, url))
+        else:
+            span_position = len(spans)
+            spans.append(None)
+            span_end = _scan_inline_styles(text, content_start, content_end, parts, spans, offset)
+            spans[span_position] = InlineSpan(offset, span_end, style, url)
+        offset = span_end
+        position = resume
+
+    if position < end:
+        parts.append(text[position:end])
+        offset += end - position
+    return offset
+
+
+def preprocess_nested_styles(chunk, index, paragraph_flag, debug=False):
+    """
+    This is a helper function that deals with nested markdown syntax. 
+    Since you can have multiple markdown syntax in a chunk of text, 
+    we first preprocess the ones that don't rely on text insertion such as 
+    styling (bold, italics, strikethrough) and hyperlinks (see parse_inline_styles). 
+
+    This function inputs the chunk of text, the index, and whether the chunk 
+    is a paragraph or not (as well as optional debugging). Styles of a paragraph are placed where they
+    are found in the chunk, otherwise they are placed at the start of the chunk.
+    This function outputs the stored style_requests and the cleaned-up chunk.
+    """
+    cleaned_chunk, spans = parse_inline_styles(chunk)
+
+    style_requests = []
+    for span in spans:
+        text = cleaned_chunk[span.start:span.end]
+        start_idx = span.start if paragraph_flag else 0
+        if span.style == "link":
+            style_requests.append(get_hyperlink_request(text, span.url, index + start_idx, debug=debug))
+        else:
+            style_requests.append(get_style_request(text, span.style, index + start_idx, debug=debug))
+
+    return style_requests, cleaned_chunk
+
+
+# Block Tokenizer ========================================================================================================
+# Every line is classified once against a single precompiled pattern. The alternatives are ordered the same way the
+# markdown syntax is prioritized: headers, bullet points, numbered lists, horizontal lines and then table rows.
+_BLOCK_PATTERN = re.compile(
+    r"(?P<header>#{1,6})\s+(?P<header_text>.+)"
+    r"|-\s+(?P<bullet>.+)"
+    r"|\d+\.\s+(?P<numbered>.+)"
+    r"|(?P<hr>[-*_]{3,}$)"
+    r"|(?P<table>\|.+\|)"
+)
+_BLOCK_KINDS = {"header_text": "header", "bullet": "bullet", "numbered": "numbered", "hr": "hr", "table": "table"}
+_NUMBERED_PATTERN = re.compile(r"\d+\.\s+(.+)")
+_TABLE_PATTERN = re.compile(r"\|.+\|")
+
+# A block of markdown: its kind (header, bullet, numbered, hr, table or paragraph), the text of the block without its
+# markdown syntax, the header level and, for tables, the raw table lines
+BlockToken = namedtuple("BlockToken", ["kind", "text", "level", "rows"], defaults=("", 0, None))
+
+
+def split_markdown_lines(content):
+    """
+    This is a helper function which lazily splits markdown content into lines without their line breaks.
+    The content can either be a string or any iterable of lines (such as a file object)
+    """
+    if isinstance(content, str):
+        start = 0
+        while True:
+            end = content.find("\n", start)
+            if end < 0:
+                break
+            yield from content[start:end].splitlines() or [""]
+            start = end + 1
+        yield from content[start:].splitlines()
+        return
+
+    for line in content:
+        yield from line.splitlines() or [""]
+
+
+def collapse_numbered_list_gaps(lines):
+    """
+    This is the streaming version of preprocess_numbered_lists: it removes the gaps ("") between numbered items so
+    that they are requested as a single cohesive numbered list. A run of empty lines after a numbered item is removed
+    when it is a single line followed by another numbered item, otherwise it is collapsed into a single empty line.
+    """
+    previous_numbered = False
+    empty_lines = 0
+    empty_content = True
+
+    for line in lines:
+        empty_content = False
+        stripped = line.strip()
+
+        if previous_numbered:
+            if not stripped:
+                empty_lines += 1
+                continue
+            if empty_lines and not (empty_lines == 1 and _NUMBERED_PATTERN.match(stripped)):
+                yield ""
+            empty_lines = 0
+
+        previous_numbered = _NUMBERED_PATTERN.match(stripped) is not None
+        yield line
+
+    if empty_lines or empty_content:
+        yield ""
+
+
+def tokenize_blocks(content):
+    """
+    This splits markdown content (a string or an iterable of lines) into BlockTokens, lazily.
+    Every line is classified once, consecutive table rows are grouped into a single table token and the empty line
+    closing a table is absorbed by it.
+    """
+    return tokenize_lines(collapse_numbered_list_gaps(split_markdown_lines(content)))
+
+
+def tokenize_lines(lines):
+    """
+    This is a helper function which splits preprocessed markdown lines (see tokenize_blocks) into BlockTokens, lazily
+    """
+    lines = iter(lines)
+    pending = None
+
+    while True:
+        if pending is None:
+            line = next(lines, None)
+            if line is None:
+                return
+        else:
+            line, pending = pending, None
+
+        chunk = line.strip()
+        match = _BLOCK_PATTERN.match(chunk)
+        kind = _BLOCK_KINDS[match.lastgroup] if match else "paragraph"
+
+        if kind == "header":
+            yield BlockToken("header", match.group("header_text").strip(), len(match.group("header")))
+        elif kind == "bullet" or kind == "numbered":
+            yield BlockToken(kind, match.group(kind).strip())
+        elif kind == "hr":
+            yield BlockToken("hr")
+        elif kind == "table":
+            rows = [chunk]
+            for next_line in lines:
+                next_chunk = next_line.strip()
+                if _TABLE_PATTERN.match(next_chunk):
+                    rows.append(next_chunk)
+                    continue
+                if next_chunk:
+                    pending = next_line
+                break
+            yield BlockToken("table", rows=rows)
+        else:
+            yield BlockToken("paragraph", chunk)
+
+
+# Metrics ================================================================================================================
+class Metrics:
+    """
+    Structured metrics of conversions, for when the debug prints are not enough. Pass a Metrics object as the metrics
+    of a conversion (convert_to_google_docs, process_markdown_content, sync_markdown...) and it collects:
+
+    - timings: the seconds spent in every stage. Compiling reports preprocess (splitting lines), tokenize,
+      parse_styles (scanning inline styles), populate_tables (compiling table cells, without their styles) and
+      compile (the whole compile). Sending reports optimize (coalescing and merging), batch_update (every batchUpdate
+      call), rate_limit_wait and retry_wait.
+    - counts: blocks.<kind> compiled, requests.<kind> sent, bytes_sent, batches, api_calls.<method>, retries and
+      errors.<status>.
+    - events: a batch_update event for every batch sent and a retry event for every retried API call.
+
+    Every measure is also passed on to the on_timing(stage, seconds), on_count(name, amount) and on_event(name, fields)
+    callbacks, to forward them to a metrics pipeline. Compile stages are measured per compile, never per block.
+    A Metrics object can be shared by threads. Without metrics (the default), nothing is measured at all.
+    """
+
+    def __init__(self, on_timing=None, on_count=None, on_event=None):
+        self.on_timing = on_timing
+        self.on_count = on_count
+        self.on_event = on_event
+        self.timings = Counter()
+        self.timing_calls = Counter()
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"Metrics(timings={dict(self.timings)}, counts={dict(self.counts)})"
+
+    def timing(self, stage, seconds):
+        with self._lock:
+            self.timings[stage] += seconds
+            self.timing_calls[stage] += 1
+        if self.on_timing is not None:
+            self.on_timing(stage, seconds)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counts[name] += amount
+        if self.on_count is not None:
+            self.on_count(name, amount)
+
+    def event(self, name, **fields):
+        if self.on_event is not None:
+            self.on_event(name, fields)
+
+    @contextlib.contextmanager
+    def measure(self, stage):
+        """
+        Times the block of code as the given stage:
+            with metrics.measure("upload"):
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timing(stage, time.perf_counter() - started)
+
+    def to_dict(self):
+        """
+        Returns the timings (total seconds and number of timings per stage) and the counts, ready to be dumped as JSON
+        """
+        with self._lock:
+            timings = {stage: {"seconds": seconds, "calls": self.timing_calls[stage]} for stage, seconds in self.timings.items()}
+            return {"timings": timings, "counts": dict(self.counts)}
+
+
+class TimedIterator:
+    """
+    This is a helper class which iterates over an iterable, adding the seconds spent producing its items up in seconds
+    """
+
+    def __init__(self, iterable):
+        self.iterator = iter(iterable)
+        self.seconds = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            return next(self.iterator)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+
+def get_request_kind(request):
+    """
+    This is a helper function which returns the kind of a request (insertText, updateTextStyle...), whether it is a
+    CompactRequest or a dict
+    """
+    return request.kind if isinstance(request, CompactRequest) else next(iter(request))
+
+
+# API Request Execution ==================================================================================================
+class RateLimiter:
+    """
+    A thread-safe token bucket shared by every API call of the same kind made in this process, so that concurrent
+    conversions share the quota instead of stampeding it. Tokens refill at requests_per_minute / 60 per second and
+    up to burst tokens can be saved up. Callers which find the bucket empty reserve the next token and wait for it.
+    """
+
+    def __init__(self, requests_per_minute, burst=1):
+        self.rate = requests_per_minute / 60.0
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        """
+        Takes tokens from the bucket without waiting for them. Returns the number of seconds the caller has to wait
+        before using them (asynchronous callers can wait with asyncio.sleep instead of blocking).
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def acquire(self, tokens=1):
+        """
+        Takes tokens from the bucket (one per API call), waiting for them if necessary. Returns the number of seconds
+        waited.
+        """
+        wait = self.reserve(tokens)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+# Google Docs API quotas: 60 write and 300 read requests per minute per user, Google Drive API quota: 12,000 requests
+# per minute per user (https://developers.google.com/docs/api/limits, https://developers.google.com/drive/api/guides/limits)
+DOCS_WRITE_RATE_LIMITER = RateLimiter(60)
+DOCS_READ_RATE_LIMITER = RateLimiter(300)
+DRIVE_RATE_LIMITER = RateLimiter(12000)
+
+# HTTP status codes of API errors worth retrying: rate limiting and server errors
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# HTTP status codes of API errors which mean the call was turned down before being applied: rate limiting.
+# Only these are retried for calls which are not idempotent (a server error or a dropped connection can come after the
+# call was applied already)
+REJECTED_STATUS_CODES = (429,)
+
+# Reasons of the HTTP 403 errors the Google APIs (Google Drive in particular) turn down rate limited calls with
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+
+def get_error_reasons(error):
+    """
+    This is a helper function which returns the reasons listed in the JSON content of an API error, which the Google
+    APIs answer as {"error": {"errors": [{"reason": ...}]}}
+    """
+    try:
+        content = error.content
+        if isinstance(content, bytes):
+            content = content.decode("utf-8")
+        return [item.get("reason") for item in json.loads(content)["error"].get("errors", [])]
+    except (AttributeError, TypeError, ValueError, KeyError):
+        return []
+
+
+def is_retryable_error(error, idempotent=True):
+    """
+    Checks if an error raised by an API call is temporary: a retryable HTTP status code (or an HTTP 403 for a rate
+    limit) or a connection failure.
+    For a call which is not idempotent, only the errors raised before the call could be applied are temporary: a
+    rejected HTTP status code, an HTTP 403 for a rate limit or a connection which could not even be opened.
+    """
+    status = getattr(getattr(error, "resp", None), "status", None)
+    if status is not None:
+        if int(status) == 403:
+            return any(reason in RATE_LIMIT_REASONS for reason in get_error_reasons(error))
+        return int(status) in (RETRYABLE_STATUS_CODES if idempotent else REJECTED_STATUS_CODES)
+    if not idempotent:
+        return isinstance(error, ConnectionRefusedError)
+    return isinstance(error, (ConnectionError, TimeoutError, socket.timeout))
+
+
+def get_retry_delay(attempt, backoff=1.0, max_backoff=32.0):
+    """
+    This returns the jittered exponential backoff before the retry of the given attempt (counting from 0):
+    a random time up to backoff * 2^attempt seconds, capped at max_backoff
+    """
+    return random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+
+
+def execute_request(
+    request, rate_limiter=None, max_retries=5, backoff=1.0, max_backoff=32.0, metrics=None, idempotent=True,
+    timings=None
+):
+    """
+    This executes a Google API request (such as docs_service.documents().batchUpdate(...)) through the rate_limiter,
+    retrying it up to max_retries times on retryable errors (see is_retryable_error) with jittered exponential
+    backoff: the n-th retry waits a random time up to backoff * 2^n seconds (capped at max_backoff).
+    A request which is not idempotent (idempotent=False) is only retried on the errors raised before it was applied.
+    With metrics (see Metrics), the API calls, errors, retries and waits are measured.
+    When timings (a Counter) are passed, the seconds spent waiting for the rate_limiter and between retries are added up
+    in timings["rate_limit_wait"] and timings["retry_wait"], so that callers can tell them apart from the call itself.
+    """
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            waited = rate_limiter.acquire()
+            if metrics is not None and waited:
+                metrics.timing("rate_limit_wait", waited)
+            if timings is not None and waited:
+                timings["rate_limit_wait"] += waited
+        if metrics is not None:
+            metrics.count(f"api_calls.{getattr(request, 'methodId', None) or 'unknown'}")
+        try:
+            return request.execute()
+        except Exception as error:
+            if metrics is not None:
+                metrics.count(f"errors.{getattr(getattr(error, 'resp', None), 'status', None) or type(error).__name__}")
+            if attempt >= max_retries or not is_retryable_error(error, idempotent):
+                raise
+            delay = get_retry_delay(attempt, backoff, max_backoff)
+            if metrics is not None:
+                metrics.count("retries")
+                metrics.timing("retry_wait", delay)
+                metrics.event("retry", attempt=attempt + 1, delay=delay, error=repr(error))
+            if timings is not None:
+                timings["retry_wait"] += delay
+            time.sleep(delay)
+            attempt += 1
+
+
+class BatchSizer:
+    """
+    This decides how many requests go into every batchUpdate call, by request count and serialized size together.
+    A batch is closed as soon as it holds max_requests requests or adding the next request would take it over
+    max_bytes of JSON (a single request larger than max_bytes is still sent, on its own).
+
+    With adaptive switched on, max_requests grows by a quarter after every batch answered within target_seconds,
+    and is halved (down to min_requests, up to request_ceiling) after a slower batch or a batch rejected as too large.
+    """
+
+    def __init__(
+        self, max_requests=120, max_bytes=DEFAULT_MAX_BATCH_BYTES, adaptive=False, target_seconds=2.0,
+        min_requests=1, request_ceiling=1000
+    ):
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.adaptive = adaptive
+        self.target_seconds = target_seconds
+        self.min_requests = min_requests
+        self.request_ceiling = request_ceiling
+
+    def next_batch(self, requests, start):
+        """
+        Fills a batch from the request at start. The requests are only turned into dicts (see request_to_dict) and
+        serialized to get their size as the batch is cut, so CompactRequests stay compact until their batch is sent.
+        Returns the end of the batch (exclusive), its size in bytes and its requests as dicts.
+        """
+        end = start
+        batch_bytes = 2
+        batch_requests = []
+        while end < len(requests) and end - start < self.max_requests:
+            request = request_to_dict(requests[end])
+            request_bytes = len(json.dumps(request))
+            if end > start and batch_bytes + request_bytes + 1 > self.max_bytes:
+                break
+            batch_bytes += request_bytes + (1 if end > start else 0)
+            batch_requests.append(request)
+            end += 1
+        return end, batch_bytes, batch_requests
+
+    def record(self, batch_stats):
+        """
+        Adjusts the request count limit after a batch was sent, given its stats (see send_batch_update)
+        """
+        if not self.adaptive:
+            return
+        if batch_stats["seconds"] > self.target_seconds:
+            self.max_requests = max(self.min_requests, self.max_requests // 2)
+        else:
+            self.max_requests = min(self.request_ceiling, self.max_requests + max(1, self.max_requests // 4))
+
+    def shrink(self, batch_requests):
+        """
+        Halves the limits below the size of a batch which was rejected for being too large
+        """
+        self.max_requests = max(self.min_requests, min(self.max_requests, batch_requests) // 2)
+        self.max_bytes = max(1, self.max_bytes // 2)
+
+
+def send_batch_update(docs_service, doc_id, requests, rate_limit=120, max_batch_bytes=DEFAULT_MAX_BATCH_BYTES,
+                      batch_sizer=None, rate_limiter=None, metrics=None, on_batch=None, write_control=None):
     """
     This is a helper function to send all the requests attained to the docs_service build. 
     This will request the API to update all the requests gathered into the Google Docs with the 
     appropriate Doc ID. 
 
-    This function inputs the docs_service build, the doc_id, the requests list and an optional rate_limit
-    The rate limit determines how much content you want to send in one batch. 
+    This function inputs the docs_service build, the doc_id, the requests list and an optional rate_limit and
+    max_batch_bytes. They determine how many requests and how many bytes of content you want to send in one batch.
+    A BatchSizer can be passed instead to share (and adapt) the batch limits across calls.
+    Every batch goes through the shared Docs write rate limiter unless another rate_limiter is passed, and is retried
+    on temporary errors (see execute_request). With metrics (see Metrics), every batch is measured.
+    The on_batch callback (if any) is called with the stats of every batch once it is sent. The seconds of a batch
+    only count the time spent in the API calls: the rate limiter waits and the retry backoffs are left out, so that a
+    throttled batch does not look slow to the BatchSizer.
+
+    A batchUpdate is not idempotent: a batch applied by the server before its answer was lost would be applied twice
+    by a retry, and every later batch would land at the wrong indexes. So every batch requires the revision the
+    previous batch left the doc at (a writeControl requiredRevisionId), and a retry of a batch which was applied
+    already is rejected by the Docs API instead of being applied again. The write_control dict carries the revision
+    across calls: it is updated after every batch, and can be filled with a known revision of the doc beforehand.
+    As long as no revision is known (the first batch sent to a doc), a batch is only retried on the errors raised
+    before it was applied (see is_retryable_error).
+
+    This function outputs the stats of every batch sent: {"requests": count, "bytes": size, "seconds": latency}
+    """
+    if batch_sizer is None:
+        batch_sizer = BatchSizer(rate_limit, max_batch_bytes)
+    if rate_limiter is None:
+        rate_limiter = DOCS_WRITE_RATE_LIMITER
+    if write_control is None:
+        write_control = {}
+
+    stats = []
+    start = 0
+
+    while start < len(requests):
+        end, batch_bytes, batch_requests = batch_sizer.next_batch(requests, start)
+        body = {"requests": batch_requests}
+        if write_control.get("requiredRevisionId") is not None:
+            body["writeControl"] = {"requiredRevisionId": write_control["requiredRevisionId"]}
+        waits = Counter()
+        started = time.perf_counter()
+        try:
+            response = execute_request(
+                docs_service.documents().batchUpdate(documentId=doc_id, body=body),
+                rate_limiter=rate_limiter,
+                metrics=metrics,
+                idempotent="writeControl" in body,
+                timings=waits,
+            )
+        except Exception as error:
+            # A batch rejected as too large (HTTP 413) is split up and sent again
+            if getattr(getattr(error, "resp", None), "status", None) == 413 and len(batch_requests) > 1:
+                batch_sizer.shrink(len(batch_requests))
+                continue
+            raise
+
+        seconds = time.perf_counter() - started - sum(waits.values())
+        batch_stats = {"requests": len(batch_requests), "bytes": batch_bytes, "seconds": max(seconds, 0.0)}
+        batch_sizer.record(batch_stats)
+        stats.append(batch_stats)
+        start = end
+        update_write_control(write_control, response)
+        if metrics is not None:
+            record_batch_metrics(metrics, batch_requests, batch_stats)
+        if on_batch is not None:
+            on_batch(batch_stats)
+
+    return stats
+
+
+def update_write_control(write_control, response):
+    """
+    This is a helper function which records the revision a batchUpdate response left the doc at in the write_control
+    (see send_batch_update)
+    """
+    revision_id = response.get("writeControl", {}).get("requiredRevisionId") if isinstance(response, dict) else None
+    if revision_id is not None:
+        write_control["requiredRevisionId"] = revision_id
+
+
+def record_batch_metrics(metrics, batch_requests, batch_stats):
+    """
+    This is a helper function which reports a batch sent to the metrics (see Metrics)
+    """
+    metrics.timing("batch_update", batch_stats["seconds"])
+    metrics.count("batches")
+    metrics.count("bytes_sent", batch_stats["bytes"])
+    for kind, amount in Counter(map(get_request_kind, batch_requests)).items():
+        metrics.count(f"requests.{kind}", amount)
+    metrics.event("batch_update", **batch_stats)
+
+
+class RequestPlan:
+    """
+    A compiled markdown document: every Google Docs API request needed to build the document, computed offline
+    without touching the API. A plan can be dumped to JSON/JSONL on one machine and executed on another.
+
+    - text_requests: Content insertion requests (text, paragraph styles, bullets and tables) in the order they are sent
+    - style_requests: Text styling requests, sent once all the content has been inserted
+    - tables: Table placeholders, one per table, recording the position of its insertTable request inside
+      text_requests, the location it is inserted at, its predicted start index and its size
+    """
+
+    def __init__(self, text_requests=None, style_requests=None, tables=None):
+        self.text_requests = text_requests if text_requests is not None else []
+        self.style_requests = style_requests if style_requests is not None else []
+        self.tables = tables if tables is not None else []
+
+    def __eq__(self, other):
+        if not isinstance(other, RequestPlan):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return (
+            f"RequestPlan(text_requests={len(self.text_requests)}, "
+            f"style_requests={len(self.style_requests)}, tables={len(self.tables)})"
+        )
+
+    def to_dict(self):
+        return {
+            "version": PLAN_FORMAT_VERSION,
+            "text_requests": [request_to_dict(request) for request in self.text_requests],
+            "style_requests": [request_to_dict(request) for request in self.style_requests],
+            "tables": self.tables,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("version") != PLAN_FORMAT_VERSION:
+            raise ValueError(f"Unsupported request plan version: {data.get('version')}")
+        return cls(data["text_requests"], data["style_requests"], data["tables"])
+
+    def dumps(self):
+        """
+        Serializes the plan into a single JSON string
+        """
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def loads(cls, data):
+        """
+        Loads a plan from a JSON string created by dumps()
+        """
+        return cls.from_dict(json.loads(data))
+
+    def dump_jsonl(self, fp):
+        """
+        Writes the plan to a text file object as JSON lines: a header line followed by one line per request
+        ({"text": request}, {"style": request}) and one line per table placeholder ({"table": placeholder})
+        """
+        fp.write(json.dumps({"version": PLAN_FORMAT_VERSION}) + "\n")
+        for request in self.text_requests:
+            fp.write(json.dumps({"text": request_to_dict(request)}) + "\n")
+        for request in self.style_requests:
+            fp.write(json.dumps({"style": request_to_dict(request)}) + "\n")
+        for table in self.tables:
+            fp.write(json.dumps({"table": table}) + "\n")
+
+    @classmethod
+    def load_jsonl(cls, fp):
+        """
+        Reads a plan back from a text file object written by dump_jsonl()
+        """
+        lines = (line for line in fp if line.strip())
+        header = json.loads(next(lines, "{}"))
+        if header.get("version") != PLAN_FORMAT_VERSION:
+            raise ValueError(f"Unsupported request plan version: {header.get('version')}")
+
+        plan = cls()
+        streams = {"text": plan.text_requests, "style": plan.style_requests, "table": plan.tables}
+        for line in lines:
+            (key, value), = json.loads(line).items()
+            streams[key].append(value)
+        return plan
+
+
+def compile_inline_styles(text, index, style_requests, debug=False, timings=None):
+    """
+    This is a helper function which scans a chunk of text placed at the index for styles (see parse_inline_styles),
+    appends a CompactRequest for every styled span (followed by its reset request, see get_style_request) to the
+    style_requests and returns the cleaned-up text.
+    The seconds spent scanning are added up in timings["parse_styles"] when timings are passed.
     """
-    batch_size = rate_limit
-    for i in range(0, len(requests), batch_size):
-        batch_requests = requests[i : i + batch_size]
-        docs_service.documents().batchUpdate(
-            documentId=doc_id, body={"requests": batch_requests}
-        ).execute()
+    if debug:
+        # Builds the style requests as dicts once, only for the traces they print
+        preprocess_nested_styles(text, index, True, debug=True)
+
+    if timings is None:
+        cleaned_text, spans = parse_inline_styles(text)
+    else:
+        started = time.perf_counter()
+        cleaned_text, spans = parse_inline_styles(text)
+        timings["parse_styles"] += time.perf_counter() - started
+    for span in spans:
+        value = ("link", span.url) if span.style == "link" else span.style
+        style_requests.append(CompactRequest("updateTextStyle", index + span.start, index + span.end, value))
+        style_requests.append(CompactRequest("updateTextStyle", index + span.end, index + span.end + 1))
+    return cleaned_text
+
+
+def compile_table_content(table_data, index, text_requests, style_requests, debug=False, timings=None):
+    """
+    This compiles the contents of a table starting at the index: a CompactRequest inserting the text of every non-empty
+    cell is appended to the text_requests, and the styles found in the cells to the style_requests.
+    It returns the index right after the end of the table (see get_table_content_request).
+
+    The cells are filled from the last one to the first, so that every cell is inserted at its index in the empty table
+    whatever the length of the cells before it. The styles are applied once all the text is in, at the final indexes.
+    The seconds spent scanning the cells for styles are added up in timings["parse_styles"] when timings are passed.
+    """
+    if(debug): 
+        print("Applying Table Content Insertion Request: =========================================\n")
+
+    cell_requests = []
+    # Number of characters inserted in the cells so far, the index of a cell in the empty table is index - inserted
+    inserted = 0
+
+    # Accounting for table initiation
+    index = index + 1
+    for i_row, row in enumerate(table_data):
+        # For each row we increment
+        index += 1
+        for i_cell, cell in enumerate(row):
+            # For each cell we incremenet
+            index += 1
+
+            if(debug): 
+                print("Start Index: ", index)
+
+            cleaned_cell = compile_inline_styles(cell, index, style_requests, timings=timings)
+
+            if cleaned_cell:
+                if(debug):
+                    print(f"Inserting content: {cleaned_cell} at Index: {index - inserted}")
+
+                cell_requests.append(CompactRequest("insertText", index - inserted, value=cleaned_cell))
+                inserted += len(cleaned_cell)
+
+            if(debug): 
+                print("Length of Characters in cell: ", len(cleaned_cell) + 1)
+
+            # Accounting for newline character
+            index += len(cleaned_cell) + 1
+
+            if(debug): 
+                print(f"End Index: {index}\n")
+
+    cell_requests.reverse()
+    text_requests.extend(cell_requests)
+    table_end_index = index + 1
+
+    if(debug): 
+        print("===================================================================================\n")
+
+    return table_end_index
+
+
+# Most rows a single table is created with: larger markdown tables are split into consecutive tables of this many rows,
+# so that every table is created and filled by a bounded number of requests (see compile_block)
+MAX_TABLE_CHUNK_ROWS = 500
+
+
+# The paragraph request compiled for every kind of block: its kind and the paragraph style id or bullet preset
+_BLOCK_PARAGRAPH_REQUESTS = {
+    "bullet": ("createParagraphBullets", "BULLET_DISC_CIRCLE_SQUARE"),
+    "numbered": ("createParagraphBullets", "NUMBERED_DECIMAL_NESTED"),
+    "hr": ("updateParagraphStyle", HORIZONTAL_LINE_STYLE),
+}
 
 
-def process_markdown_content(docs_service, doc_id, content_markdown, debug=False):
+def compile_block(token, index, plan, debug=False, timings=None):
     """
-    This is a helper function which splits your entire markdown content into chunks to be processed individually,
-    scanning them for any markdown syntax that may be found. Depending on the markdown syntax found, the appropriate 
-    request will be made and appended to the requests list. Eventually to be updated onto the Google Docs. 
+    This compiles a single BlockToken placed at the index into the plan, and returns the index right after it.
+    The text of the block is scanned for nested styles, then the CompactRequests matching the get_*_request builder
+    of the block are appended to the plan.
+    Tables are compiled against the start index Google Docs gives them (one past the location they are inserted at,
+    since Docs inserts a newline before every table) and recorded as table placeholders in the plan. Tables of more
+    than MAX_TABLE_CHUNK_ROWS rows are split into consecutive tables of at most that many rows, each one created and
+    filled on its own.
+    When timings are passed, the seconds spent in the parse_styles and populate_tables stages are added up in them.
     """
+    text_requests = plan.text_requests
+    style_requests = plan.style_requests
+
+    # If the block is a table, create an empty table and populate it
+    if token.kind == "table":
+        if timings is not None:
+            started = time.perf_counter()
+            parse_styles_seconds = timings["parse_styles"]
+
+        # Create a 2D List of the table 
+        table_data = preprocess_markdown_table("\n".join(token.rows))
+
+        table_columns = len(table_data[0])
+        table_end_index = index
+        for chunk_start in range(0, len(table_data), MAX_TABLE_CHUNK_ROWS):
+            table_chunk = table_data[chunk_start:chunk_start + MAX_TABLE_CHUNK_ROWS]
+
+            # Add the request to create an empty table in the google doc (right after the previous chunk of the table)
+            # and record its placeholder
+            table_rows = len(table_chunk)
+            table_start_index = table_end_index + 1
+            plan.tables.append({
+                "position": len(text_requests),
+                "location": table_end_index,
+                "startIndex": table_start_index,
+                "rows": table_rows,
+                "columns": table_columns,
+            })
+            if(debug):
+                get_empty_table_request(table_rows, table_columns, table_end_index, debug=debug)
+            text_requests.append(CompactRequest("insertTable", table_end_index, value=(table_rows, table_columns)))
+
+            # Insert the contents of the table (and their styles) into the empty table 
+            table_end_index = compile_table_content(
+                table_chunk, table_start_index, text_requests, style_requests, debug, timings
+            )
+
+        if(debug):
+            get_paragraph_request("\n", table_end_index, debug=debug)
+        text_requests.append(CompactRequest("insertText", table_end_index, value="\n\n"))
+
+        if timings is not None:
+            # The styles of the cells were already counted in parse_styles
+            table_seconds = time.perf_counter() - started
+            timings["populate_tables"] += table_seconds - (timings["parse_styles"] - parse_styles_seconds)
+        return table_end_index + 2
+
+    # Then we preprocess any styles recognized in the block and store them into the style_requests
+    text = compile_inline_styles(token.text, index, style_requests, debug=debug, timings=timings)
+    if token.kind == "hr":
+        text = ""
+    end_index = index + len(text) + 1
+
+    if(debug):
+        # The requests are built as dicts once, only for the traces they print
+        if token.kind == "header":
+            get_header_request(text, token.level, index, debug=debug)
+        elif token.kind == "bullet":
+            get_unordered_list_request(text, index, debug=debug)
+        elif token.kind == "numbered":
+            get_ordered_list_request(text, index, debug=debug)
+        elif token.kind == "hr":
+            get_horizontal_line_request(index, debug=debug)
+        else:
+            get_paragraph_request(text, index, debug=debug)
 
-    # First preprocess numbered lists, then split the content into chunks every new line detected. 
-    content_markdown = preprocess_numbered_lists(content_markdown)
-    chunks = re.split(r"(?<=\n)", content_markdown)
+    #  Append the requests and then appropriately increment the index based on the request text
+    text_requests.append(CompactRequest("insertText", index, value=text + "\n"))
+    if token.kind == "header":
+        text_requests.append(CompactRequest("updateParagraphStyle", index, end_index, f"HEADING_{token.level}"))
+    elif token.kind in _BLOCK_PARAGRAPH_REQUESTS:
+        kind, value = _BLOCK_PARAGRAPH_REQUESTS[token.kind]
+        text_requests.append(CompactRequest(kind, index, end_index, value))
+    return end_index
 
-    # Initializing variables, index = 1
-    chunks = iter(chunks)
+
+def compile_markdown(content_markdown, debug=False, metrics=None):
+    """
+    This compiles your entire markdown content into a RequestPlan without making a single API call.
+    The content is split into blocks (see tokenize_blocks) and every block is compiled one after another
+    (see compile_block), starting at index 1.
+    With metrics (see Metrics), the compile stages and the blocks compiled are measured.
+    """
+    plan = RequestPlan()
     index = 1
-    text_requests = []
-    style_requests = []
+    if metrics is None:
+        for token in tokenize_blocks(content_markdown):
+            index = compile_block(token, index, plan, debug=debug)
+        return plan
+
+    started = time.perf_counter()
+    timings = Counter()
+    blocks = Counter()
+    lines = TimedIterator(collapse_numbered_list_gaps(split_markdown_lines(content_markdown)))
+    tokens = TimedIterator(tokenize_lines(lines))
+    for token in tokens:
+        blocks[token.kind] += 1
+        index = compile_block(token, index, plan, debug=debug, timings=timings)
+
+    metrics.timing("preprocess", lines.seconds)
+    metrics.timing("tokenize", tokens.seconds - lines.seconds)
+    metrics.timing("parse_styles", timings["parse_styles"])
+    metrics.timing("populate_tables", timings["populate_tables"])
+    metrics.timing("compile", time.perf_counter() - started)
+    for kind, amount in blocks.items():
+        metrics.count(f"blocks.{kind}", amount)
+    return plan
+
+
+# Parallel Compilation ===================================================================================================
+# Compiling is pure Python work, so threads compiling at the same time are serialized by the GIL. Large documents (and
+# large batches of documents) can be compiled on a pool of processes instead: the markdown is split into chunks at
+# block boundaries where no block can continue into the next chunk, every chunk is compiled on its own from index 1,
+# and the compiled chunks are shifted into place. Only the compiled requests travel back from the processes, as
+# (kind, start, end, value) tuples.
+
+# Default size (in characters) of the chunks a markdown document is split into (see split_markdown_chunks)
+DEFAULT_COMPILE_CHUNK_SIZE = 256 * 1024
+
+
+def split_markdown_chunks(content_markdown, chunk_size=DEFAULT_COMPILE_CHUNK_SIZE):
+    """
+    This is a helper function which splits markdown content into chunks of about chunk_size characters, joining back
+    into the content. Chunks end after a non-empty line which is neither a numbered item nor a table row, since the
+    gaps of a numbered list and the rows of a table are tokenized together with the lines that follow them.
+    Compiling the chunks one after another therefore gives the same blocks as compiling the whole content.
+    """
+    chunks = []
+    start = 0
+    length = len(content_markdown)
+    while length - start > chunk_size:
+        end = content_markdown.find("\n", start + chunk_size)
+        while end >= 0 and end + 1 < length:
+            line_start = content_markdown.rfind("\n", start, end) + 1 or start
+            lines = content_markdown[line_start:end].splitlines()
+            last_line = lines[-1].strip() if lines else ""
+            if last_line and not _NUMBERED_PATTERN.match(last_line) and not _TABLE_PATTERN.match(last_line):
+                break
+            end = content_markdown.find("\n", end + 1)
+        if end < 0 or end + 1 >= length:
+            break
+        chunks.append(content_markdown[start:end + 1])
+        start = end + 1
+    chunks.append(content_markdown[start:])
+    return chunks
+
+
+def compile_markdown_chunk(content_markdown):
+    """
+    This is a helper function which compiles a chunk of markdown starting at index 1 (see compile_block) and returns it
+    in a compact picklable form: its text requests and style requests as (kind, start, end, value) tuples, its table
+    placeholders and the index right after it. It is what the processes of compile_markdown_parallel run.
+    """
+    plan = RequestPlan()
+    index = 1
+    for token in tokenize_blocks(content_markdown):
+        index = compile_block(token, index, plan)
+    return (
+        [(request.kind, request.start, request.end, request.value) for request in plan.text_requests],
+        [(request.kind, request.start, request.end, request.value) for request in plan.style_requests],
+        plan.tables,
+        index,
+    )
+
 
-    # For each chunk detected: 
-    for chunk in chunks:
-        # Initialize a chunk by stripping it and splitting into requests per chunk
-        chunk = chunk.strip()
-        requests = []
-        table_flag = False
-        paragraph_flag = is_paragraph(chunk)
-
-        # Then we preprocess any styles recognized in the chunks and store them into the style_requests
-        received_styling, cleaned_chunk = preprocess_nested_styles(chunk, index, paragraph_flag, debug=debug)
-        style_requests.extend(received_styling)
-
-        # Matches detected 
-        header_match = re.match(r"^(#{1,6})\s+(.+)", cleaned_chunk)
-        bullet_point_match = re.match(r"^-\s+(.+)", cleaned_chunk)
-        numbered_list_match = re.match(r"^\d+\.\s+(.+)", cleaned_chunk)
-        table_match = re.match(r"^\|.+\|", cleaned_chunk)
-        horizontal_line_match = re.match(r"^[-*_]{3,}$", cleaned_chunk)
-        
-        # If the chunk has header markdown syntax add the request
-        if header_match:
-            header_level = len(re.match(r"^#+", cleaned_chunk).group(0))
-            text = cleaned_chunk[header_level:].strip()
-            requests.extend(get_header_request(text, header_level, index, debug=debug))
-        
-        # If the chunk has unordered list markdown syntax add the request
-        elif bullet_point_match:
-            text = cleaned_chunk[2:].strip()
-            requests.extend(get_unordered_list_request(text, index, debug=debug))
-
-        # If the chunk has ordered list markdown syntax add the request
-        elif numbered_list_match:
-            text = re.sub(r"^\d+\.\s", "", cleaned_chunk).strip()
-            requests.extend(get_ordered_list_request(text, index, debug=debug))
-        
-        # If the chunk has horizontal line markdown syntax add the request
-        elif horizontal_line_match:
-            requests.extend(get_horizontal_line_request(index, debug=debug))
-
-        # If the chunk has table markdown syntax add the request
-        elif table_match:
-            table_flag = True
-
-            # If it's a table, first process everything already there in all_requests, then clear it
-            send_batch_update(docs_service, doc_id, text_requests)
-            text_requests.clear()
-
-            # Split the table into a list of table lines
-            table_lines = [chunk]
-            while True:
-                try:
-                    next_chunk = next(chunks).strip()
-                    if re.match(r"^\|.+\|", next_chunk):
-                        table_lines.append(next_chunk)
-                    else:
-                        break
-                except StopIteration:
-                    break
-            
-            # Create a 2D List of the table 
-            table_data = preprocess_markdown_table("\n".join(table_lines))
-
-            # Send a request to create an empty table in the google doc
-            table_rows = len(table_data)
-            table_columns = len(table_data[0])
-            table_request = get_empty_table_request(table_rows, table_columns, index, debug=debug)
-
-            # Send the request immediately 
-            docs_service.documents().batchUpdate(
-                documentId=doc_id, body={"requests": table_request}
-            ).execute()
-
-            # In the google doc, find the table and retrieve its starting index
-            content = (
-                docs_service.documents()
-                .get(documentId=doc_id, fields="body")
-                .execute()
-                .get("body")
-                .get("content")
+def merge_compiled_chunks(compiled_chunks):
+    """
+    This is a helper function which joins chunks compiled by compile_markdown_chunk into a single RequestPlan, moving
+    every chunk to the index the chunks before it end at
+    """
+    plan = RequestPlan()
+    index = 1
+    for text_requests, style_requests, tables, end_index in compiled_chunks:
+        delta = index - 1
+        position = len(plan.text_requests)
+        for requests, compiled_requests in ((plan.text_requests, text_requests), (plan.style_requests, style_requests)):
+            requests.extend(
+                CompactRequest(kind, start + delta, end + delta if end is not None else None, value)
+                for kind, start, end, value in compiled_requests
             )
-            tables = [c for c in content if c.get("table")]
-            table_start_index = tables[-1]["startIndex"]
-            
-            # Insert the contents of the table into the empty table 
-            table_content_requests, table_style_requests, table_end_index = get_table_content_request(
-                table_data, table_start_index, debug=debug
+        plan.tables.extend(
+            dict(
+                table, position=table["position"] + position, location=table["location"] + delta,
+                startIndex=table["startIndex"] + delta,
             )
+            for table in tables
+        )
+        index += end_index - 1
+    return plan
 
-            #  Append the style requests of the table contents and update index accordingly
-            requests.extend(table_content_requests) 
-            style_requests.extend(table_style_requests)
-            index = table_end_index
-            requests.append(get_paragraph_request("\n", index, debug=debug))
-            index += 2 # Update index to account for paragraph since it's not being accounted for due to table_flag
 
-        # If the chunk has none of those, then it is likely a paragraph
+def compile_markdown_parallel(
+    content_markdown, executor=None, max_workers=None, chunk_size=DEFAULT_COMPILE_CHUNK_SIZE, metrics=None
+):
+    """
+    This compiles your markdown content into the same RequestPlan as compile_markdown, on a pool of processes.
+    The content is split into chunks (see split_markdown_chunks) which are compiled in parallel, either on your own
+    executor (a concurrent.futures.ProcessPoolExecutor, which can be shared between many conversions) or on a pool of
+    max_workers processes started for this call. Content fitting in a single chunk is compiled right away when no
+    executor is passed.
+    With metrics (see Metrics), the compile time and the number of chunks are measured.
+    """
+    started = time.perf_counter()
+    chunks = split_markdown_chunks(content_markdown, chunk_size)
+    if executor is not None:
+        plan = merge_compiled_chunks(executor.map(compile_markdown_chunk, chunks))
+    elif len(chunks) == 1:
+        plan = compile_markdown(content_markdown)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+            plan = merge_compiled_chunks(pool.map(compile_markdown_chunk, chunks))
+    if metrics is not None:
+        metrics.timing("compile", time.perf_counter() - started)
+        metrics.count("compile_chunks", len(chunks))
+    return plan
+
+
+def compile_many(contents, executor=None, max_workers=None, chunk_size=DEFAULT_COMPILE_CHUNK_SIZE):
+    """
+    This compiles many markdown documents on a pool of processes (your own executor, or max_workers processes started
+    for this call). The chunks of all the documents are queued at once, so small documents are compiled side by side
+    and large ones are spread over every process.
+    This function yields the RequestPlan of every document, in the order of the contents.
+    """
+    if executor is None:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+            yield from compile_many(contents, pool, chunk_size=chunk_size)
+        return
+
+    documents = [
+        [executor.submit(compile_markdown_chunk, chunk) for chunk in split_markdown_chunks(content_markdown, chunk_size)]
+        for content_markdown in contents
+    ]
+    for futures in documents:
+        yield merge_compiled_chunks(future.result() for future in futures)
+
+
+# Request Coalescing =====================================================================================================
+# The longest text a single coalesced insertText request may carry. Even if every character had to be escaped in JSON
+# (6 bytes each), such a request stays well below the default batch size in bytes.
+MAX_COALESCED_TEXT_LENGTH = 64 * 1024
+
+
+def coalesce_requests(requests, max_text_length=MAX_COALESCED_TEXT_LENGTH):
+    """
+    This is a helper function which fuses runs of contiguous insertText requests (every insert starting right where
+    the previous one ended) into a single insertText of the concatenated text, and yields the resulting requests.
+
+    The paragraph style and bullet requests found within such a run only cover text inserted before them, so they are
+    held back and yielded right after the fused insert, in their original order. Their ranges stay valid since all
+    the text of the run ends up at the same indexes it was compiled for. Any other request (an insertTable, or a range
+    reaching past the text inserted so far) ends the run, and so does reaching max_text_length characters of text.
+    """
+    run_start = None
+    run_texts = []
+    run_end = None
+    run_length = 0
+    run_requests = []
+    deferred = []
+
+    def flush():
+        if len(run_requests) == 1:
+            yield run_requests[0]
+        elif run_requests:
+            yield CompactRequest("insertText", run_start, value="".join(run_texts))
+        yield from deferred
+        run_texts.clear()
+        run_requests.clear()
+        deferred.clear()
+
+    for request in requests:
+        if isinstance(request, CompactRequest):
+            kind, index, range_end, text = request.kind, request.start, request.end, request.value
+        else:
+            (kind, body), = request.items()
+            index = body.get("location", {}).get("index") if isinstance(body, dict) else None
+            range_end = body.get("range", {}).get("endIndex") if isinstance(body, dict) else None
+            text = body.get("text") if isinstance(body, dict) else None
+
+        if kind == "insertText" and index is not None:
+            if not run_requests or index != run_end or run_length + len(text) > max_text_length:
+                yield from flush()
+                run_start = index
+                run_length = 0
+            run_texts.append(text)
+            run_requests.append(request)
+            run_length += len(text)
+            run_end = index + len(text)
+            continue
+
+        if run_requests and range_end is not None and range_end <= run_end:
+            deferred.append(request)
+            continue
+
+        yield from flush()
+        yield request
+
+    yield from flush()
+
+
+def is_style_reset_request(request):
+    """
+    This is a helper function which checks if a request is a reset_request (see get_style_request), clearing every
+    text style field of the character after a styled span
+    """
+    if isinstance(request, CompactRequest):
+        return request.kind == "updateTextStyle" and request.value is None
+    body = request.get("updateTextStyle")
+    return body is not None and body["fields"] == "*" and not body["textStyle"]
+
+
+def merge_text_style_requests(requests):
+    """
+    This is a helper function which merges a list of updateTextStyle requests into as few requests as possible.
+
+    The reset requests are dropped: the text they point at was inserted unstyled before any style request is sent,
+    so all they could clear is the style of an enclosing span (for example the bold around "**a _b_ c**").
+    The remaining requests are applied field by field onto the elementary segments between their range boundaries
+    (a later request wins over an earlier one on the same field), each field is merged into maximal ranges of the
+    same value, and the fields sharing the exact same range are combined into a single updateTextStyle request.
+    """
+    updates = []
+    for request in requests:
+        if is_style_reset_request(request):
+            continue
+        body = request_to_dict(request)["updateTextStyle"]
+        request_range = body["range"]
+        updates.append((request_range["startIndex"], request_range["endIndex"], body["textStyle"], body["fields"]))
+
+    boundaries = sorted({index for start, end, _, _ in updates for index in (start, end)})
+    segment_of = {boundary: position for position, boundary in enumerate(boundaries)}
+    segments = [{} for _ in boundaries[1:]]
+
+    for start, end, text_style, fields in updates:
+        fields = fields.split(",")
+        for segment in segments[segment_of[start]:segment_of[end]]:
+            if "*" in fields:
+                segment.clear()
+                segment.update(text_style)
+                continue
+            for field in fields:
+                if field in text_style:
+                    segment[field] = text_style[field]
+                else:
+                    segment.pop(field, None)
+
+    # Merge every field into maximal runs of segments holding the same value
+    ranges = {}
+    open_runs = {}
+    for position, segment in enumerate(segments + [{}]):
+        for field, (start, value) in list(open_runs.items()):
+            if field not in segment or segment[field] != value:
+                ranges.setdefault((start, boundaries[position]), {})[field] = value
+                del open_runs[field]
+        for field, value in segment.items():
+            if field not in open_runs:
+                open_runs[field] = (boundaries[position], value)
+
+    return [
+        {
+            "updateTextStyle": {
+                "range": {"startIndex": start, "endIndex": end},
+                "textStyle": text_style,
+                "fields": ",".join(text_style),
+            }
+        }
+        for (start, end), text_style in sorted(ranges.items())
+    ]
+
+
+def merge_paragraph_requests(requests):
+    """
+    This is a helper function which merges consecutive paragraph requests covering contiguous ranges, and yields the
+    resulting requests. Runs of list items become a single createParagraphBullets request (when they share the same
+    bullet preset) and runs of paragraphs with the same updateParagraphStyle become a single request.
+    Any other request is yielded untouched, and ends the run.
+    """
+    pending = None
+
+    def merged(pending):
+        request, kind, _, start, end = pending
+        if isinstance(request, CompactRequest):
+            return request if request.end == end else CompactRequest(kind, start, end, request.value)
+        body = request[kind]
+        if body["range"]["endIndex"] == end:
+            return request
+        return {kind: dict(body, range=dict(body["range"], endIndex=end))}
+
+    for request in requests:
+        if isinstance(request, CompactRequest):
+            kind, paragraph_format, start, end = request.kind, request.value, request.start, request.end
         else:
-            requests.append(get_paragraph_request(cleaned_chunk, index, debug=debug))
-        
-        #  Append the general requets into the all requests and then appropriately increment the index based on the request text
-        for request in requests:
-            text_requests.append(request)
-            # Table automatically updates index due to monitoring hence, no need to update index if it's a table
-            if "insertText" in request and not table_flag:
-                index += len(request["insertText"]["text"])
+            (kind, body), = request.items()
+            if kind in ("createParagraphBullets", "updateParagraphStyle"):
+                paragraph_format = [body.get(key) for key in ("bulletPreset", "paragraphStyle", "fields")]
+                start, end = body["range"]["startIndex"], body["range"]["endIndex"]
+
+        if kind not in ("createParagraphBullets", "updateParagraphStyle"):
+            if pending is not None:
+                yield merged(pending)
+                pending = None
+            yield request
+            continue
+
+        if pending is not None and pending[1:3] == (kind, paragraph_format) and pending[4] == start:
+            pending = pending[:4] + (end,)
+            continue
+
+        if pending is not None:
+            yield merged(pending)
+        pending = (request, kind, paragraph_format, start, end)
+
+    if pending is not None:
+        yield merged(pending)
+
+
+def get_table_start_index(docs_service, doc_id, metrics=None):
+    """
+    This is a helper function which retrieves the starting index of the last table in the GDoc
+    """
+    document = execute_request(
+        docs_service.documents().get(documentId=doc_id, fields="body"), rate_limiter=DOCS_READ_RATE_LIMITER,
+        metrics=metrics,
+    )
+    content = document.get("body").get("content")
+    tables = [c for c in content if c.get("table")]
+    return tables[-1]["startIndex"]
+
+
+def execute_request_plan(
+    docs_service, doc_id, plan, verify_tables=False, batch_sizer=None, coalesce=True, merge_styles=True, metrics=None,
+    on_progress=None
+):
+    """
+    This sends a compiled RequestPlan to the Google Docs with the appropriate Doc ID.
+    Tables are created and populated within the normal batches of text requests, since their start indexes were
+    already computed while compiling. Once all the content is in, the style requests are sent.
+
+    With verify_tables switched on, the batch is split after every insertTable request and the table start index is
+    read back from the GDoc and checked against the compiled one (this costs an extra round trip per table).
+
+    With coalesce switched on, contiguous insertText requests are fused before being sent (see coalesce_requests).
+    With merge_styles switched on, paragraph and text style requests are merged as well (see merge_paragraph_requests
+    and merge_text_style_requests).
+    The batches are sized by the batch_sizer (see BatchSizer), the stats of every batch sent are returned.
+    With metrics (see Metrics), the optimizations and every batch sent are measured.
+    The on_progress callback (if any) is called with the number of requests sent and the total number of requests to
+    send, before the first batch and after every batch.
+    """
+    if batch_sizer is None:
+        batch_sizer = BatchSizer()
+    started = time.perf_counter()
+    text_requests = plan.text_requests
+    style_requests = merge_text_style_requests(plan.style_requests) if merge_styles else plan.style_requests
+    if metrics is not None:
+        metrics.timing("optimize", time.perf_counter() - started)
+    stats = []
+    sent = 0
+    write_control = {}
+
+    def prepare(requests):
+        started = time.perf_counter()
+        if coalesce:
+            requests = coalesce_requests(requests)
+        if merge_styles:
+            requests = merge_paragraph_requests(requests)
+        requests = list(requests)
+        if metrics is not None:
+            metrics.timing("optimize", time.perf_counter() - started)
+        return requests
+
+    # The text requests are sent in a single run, or in one run per table when the tables are verified
+    text_runs = []
+    if verify_tables:
+        for table in plan.tables:
+            position = table["position"] + 1
+            text_runs.append((prepare(text_requests[sent:position]), table))
+            sent = position
+    text_runs.append((prepare(text_requests[sent:]), None))
+
+    on_batch = None
+    if on_progress is not None:
+        requests_total = sum(len(requests) for requests, _ in text_runs) + len(style_requests)
+        requests_sent = 0
+
+        def on_batch(batch_stats):
+            nonlocal requests_sent
+            requests_sent += batch_stats["requests"]
+            on_progress(requests_sent, requests_total)
+
+        on_progress(requests_sent, requests_total)
 
     # Send batch updates to insert the text into the google doc
-    send_batch_update(docs_service, doc_id, text_requests)
-    
+    for requests, table in text_runs:
+        stats.extend(send_batch_update(
+            docs_service, doc_id, requests, batch_sizer=batch_sizer, metrics=metrics, on_batch=on_batch,
+            write_control=write_control,
+        ))
+        if table is None:
+            continue
+
+        # In the google doc, find the table and check its starting index against the compiled one
+        table_start_index = get_table_start_index(docs_service, doc_id, metrics=metrics)
+        if table_start_index != table["startIndex"]:
+            raise RuntimeError(
+                f"Table inserted at index {table['location']} starts at index {table_start_index} in the "
+                f"Google Doc, but was compiled for start index {table['startIndex']}"
+            )
+
     # After inserting the text, send a separate batch update for style requests
-    send_batch_update(docs_service, doc_id, style_requests)
+    stats.extend(send_batch_update(
+        docs_service, doc_id, style_requests, batch_sizer=batch_sizer, metrics=metrics, on_batch=on_batch,
+        write_control=write_control,
+    ))
+    return stats
 
 
-def convert_to_google_docs(content_markdown, document_title, docs_service, credentials_file, scopes, debug=False):
-    doc_id, doc_url = create_empty_google_doc(document_title, credentials_file, scopes)
+def process_markdown_content(
+    docs_service, doc_id, content_markdown, debug=False, verify_tables=False, batch_sizer=None, plan_cache=None,
+    metrics=None, compile_executor=None, on_progress=None
+):
+    """
+    This is a helper function which compiles your entire markdown content into a RequestPlan (see compile_markdown)
+    and then sends the plan onto the Google Docs with the appropriate Doc ID (see execute_request_plan).
+    With a plan_cache (see markgdoc.cache.PlanCache), content compiled before is not compiled again.
+    With a compile_executor (a ProcessPoolExecutor), the content is compiled on its processes while the requests are
+    still sent from this thread (see compile_markdown_parallel).
+    With metrics (see Metrics), both the compile and the requests sent are measured.
+    The on_progress callback is called as the requests are sent (see execute_request_plan).
+    """
+    if debug:
+        # The traces of the compiler are printed by the process compiling
+        compile_executor = None
+    if plan_cache is not None:
+        plan = plan_cache.compile(content_markdown, debug=debug, metrics=metrics, executor=compile_executor)
+    elif compile_executor is not None:
+        plan = compile_markdown_parallel(content_markdown, executor=compile_executor, metrics=metrics)
+    else:
+        plan = compile_markdown(content_markdown, debug=debug, metrics=metrics)
+    return execute_request_plan(
+        docs_service, doc_id, plan, verify_tables=verify_tables, batch_sizer=batch_sizer, metrics=metrics,
+        on_progress=on_progress
+    )
+
+
+def open_markdown_source(source):
+    """
+    This is a helper function which returns a context manager over the lines of a markdown source.
+    The source can either be a path to a markdown file, a file object or any iterable of lines.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return open(source, "r", encoding="utf-8")
+    return contextlib.nullcontext(source)
+
+
+def stream_markdown_content(
+    docs_service, doc_id, source, debug=False, batch_size=120, batch_sizer=None, coalesce=True, merge_styles=True,
+    metrics=None, on_progress=None
+):
+    """
+    This is the streaming version of process_markdown_content, for markdown too large to be held in memory.
+    The source (a path to a markdown file, a file object or any iterable of lines) is read and compiled block by
+    block, and the requests are sent as soon as a batch of batch_size requests fills up (though never in the middle
+    of a list, which is sent once it ends). The style requests of the text already sent go right after every text
+    batch, so memory is bounded by the batch size (and the longest list) rather than the size of the document.
+
+    With coalesce and merge_styles switched on, the requests of every batch are coalesced and merged before being sent
+    (see execute_request_plan). The batches themselves are sized by the batch_sizer (see BatchSizer), the stats of every batch sent are returned.
+    With metrics (see Metrics), every batch sent is measured.
+    The on_progress callback (if any) is called with the number of requests sent after every batch, and None as the
+    total number of requests since it is only known once the whole source was read.
+    """
+    if batch_sizer is None:
+        batch_sizer = BatchSizer(batch_size)
+    stats = []
+    requests_sent = 0
+
+    def on_batch(batch_stats):
+        nonlocal requests_sent
+        requests_sent += batch_stats["requests"]
+        on_progress(requests_sent, None)
+
+    text_requests = []
+    style_requests = []
+    index = 1
+    write_control = {}
+
+    def send_requests():
+        requests = text_requests
+        if coalesce:
+            requests = coalesce_requests(requests)
+        if merge_styles:
+            requests = merge_paragraph_requests(requests)
+        callback = on_batch if on_progress is not None else None
+        batch_stats = send_batch_update(
+            docs_service, doc_id, list(requests), batch_sizer=batch_sizer, metrics=metrics, on_batch=callback,
+            write_control=write_control,
+        )
+
+        requests = merge_text_style_requests(style_requests) if merge_styles else style_requests
+        batch_stats.extend(send_batch_update(
+            docs_service, doc_id, requests, batch_sizer=batch_sizer, metrics=metrics, on_batch=callback,
+            write_control=write_control,
+        ))
+        return batch_stats
+
+    with open_markdown_source(source) as lines:
+        for token in tokenize_blocks(lines):
+            block = RequestPlan()
+            index = compile_block(token, index, block, debug=debug)
+            text_requests.extend(block.text_requests)
+            style_requests.extend(block.style_requests)
+
+            # A list is never split between batches: its createParagraphBullets requests would then start a new
+            # list (and restart its numbering) in every batch
+            if token.kind in ("bullet", "numbered"):
+                continue
+            if len(text_requests) >= batch_size or len(style_requests) >= batch_size:
+                stats.extend(send_requests())
+                text_requests.clear()
+                style_requests.clear()
+
+    stats.extend(send_requests())
+    return stats
+
+
+# Conversion Jobs ========================================================================================================
+# convert_to_google_docs and convert_file_to_google_docs create the new google doc right away, and convert the markdown
+# in the background on a shared pool of threads. They return a ConversionJob, which holds the id and url of the doc and
+# tracks the conversion.
+
+# Number of threads of the pool converting in the background (see get_conversion_executor)
+DEFAULT_CONVERSION_WORKERS = 8
+
+_conversion_executor = None
+_conversion_executor_lock = threading.Lock()
+
+
+def get_conversion_executor():
+    """
+    This is a helper function which returns the pool of DEFAULT_CONVERSION_WORKERS threads shared by the conversions
+    started in the background, creating it on first use. Conversions queue up once every thread is busy.
+    """
+    global _conversion_executor
+    with _conversion_executor_lock:
+        if _conversion_executor is None:
+            _conversion_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=DEFAULT_CONVERSION_WORKERS, thread_name_prefix="markgdoc-conversion"
+            )
+        return _conversion_executor
+
+
+class ConversionCancelled(Exception):
+    """
+    The error of a conversion job cancelled while it was running (see ConversionJob.cancel)
+    """
+
+
+class ConversionJob:
+    """
+    A handle on the conversion of a google doc running in the background.
+
+    A ConversionJob holds the doc_id, doc_url and title of the google doc being converted. On top of that:
+
+    - status: "pending" (queued on the pool), "running", "succeeded", "failed" or "cancelled"
+    - progress: the fraction of the requests sent so far (None until the requests are counted, or throughout a
+      streamed conversion), along with requests_sent, requests_total and batches_sent
+    - error: the exception the conversion failed with, once it failed (None otherwise)
+    - seconds: how long the conversion has been running (its latency once done), queued_seconds how long it waited
+      for a thread of the pool
+    - done(), running(), cancelled(), wait(timeout), result(timeout) (the stats of every batch sent, raising the error
+      of a failed conversion), exception(timeout) and add_done_callback(callback), like a concurrent.futures.Future
+    - cancel(wait=False): a pending conversion never starts, a running one is asked to stop after the batch being
+      sent (leaving the google doc partly written) and then fails with ConversionCancelled. Like Future.cancel, it
+      returns True only if the conversion was actually cancelled (see cancel).
+    """
+
+    def __init__(self, doc_id, doc_url, title=None):
+        self.doc_id = doc_id
+        self.doc_url = doc_url
+        self.title = title
+        self.requests_sent = 0
+        self.requests_total = None
+        self.batches_sent = 0
+        self.created_at = time.perf_counter()
+        self.started_at = None
+        self.finished_at = None
+        self._future = None
+        self._cancel_requested = threading.Event()
+        self._cancel_acknowledged = threading.Event()
+
+    def __repr__(self):
+        return f"ConversionJob({self.doc_id!r}, {self.doc_url!r}, status={self.status!r}, progress={self.progress!r})"
+
+    def start(self, function, executor=None):
+        """
+        Queues the conversion: function(on_progress) on the executor (the shared pool by default)
+        """
+        self._future = (executor or get_conversion_executor()).submit(self._run, function)
+        return self
+
+    def _run(self, function):
+        if self._cancel_requested.is_set():
+            self._cancel_acknowledged.set()
+            raise ConversionCancelled(f"Conversion of {self.doc_url} was cancelled")
+        self.started_at = time.perf_counter()
+        try:
+            return function(self._on_progress)
+        finally:
+            self.finished_at = time.perf_counter()
+
+    def _on_progress(self, requests_sent, requests_total):
+        if requests_sent > self.requests_sent:
+            self.batches_sent += 1
+        self.requests_sent = requests_sent
+        self.requests_total = requests_total
+        # Stopping between two batches keeps every batch sent whole, and there is nothing left to stop once every
+        # request was sent
+        if self._cancel_requested.is_set() and (requests_total is None or requests_sent < requests_total):
+            self._cancel_acknowledged.set()
+            raise ConversionCancelled(f"Conversion of {self.doc_url} was cancelled after {requests_sent} requests")
+
+    @property
+    def status(self):
+        if self._future is None or not self._future.done():
+            return "running" if self.started_at is not None else "pending"
+        if self._future.cancelled():
+            return "cancelled"
+        error = self._future.exception()
+        if error is None:
+            return "succeeded"
+        return "cancelled" if isinstance(error, ConversionCancelled) else "failed"
+
+    @property
+    def progress(self):
+        if self.status == "succeeded":
+            return 1.0
+        if not self.requests_total:
+            return None
+        return self.requests_sent / self.requests_total
+
+    @property
+    def error(self):
+        if self._future is None or not self._future.done() or self._future.cancelled():
+            return None
+        return self._future.exception()
+
+    @property
+    def seconds(self):
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    @property
+    def queued_seconds(self):
+        return (self.started_at or time.perf_counter()) - self.created_at
+
+    def done(self):
+        return self._future is not None and self._future.done()
+
+    def running(self):
+        return self.status == "running"
+
+    def cancelled(self):
+        return self.status == "cancelled"
+
+    def cancel(self, wait=False):
+        """
+        Cancels the conversion, returning True only if it was cancelled. A pending conversion is cancelled right away.
+        A running conversion is only asked to stop: it acknowledges the request after the batch being sent, so unless
+        wait is switched on, cancel returns False for it (check cancelled() later on). With wait, cancel waits for the
+        running conversion to stop and returns whether it stopped as cancelled (a conversion sending its last batch
+        still succeeds). A conversion already done is not cancelled again.
+        """
+        if self.done():
+            return self.cancelled()
+        self._cancel_requested.set()
+        if self._future is not None and self._future.cancel():
+            return True
+        if wait and self._future is not None:
+            concurrent.futures.wait([self._future])
+        return self._cancel_acknowledged.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Waits until the conversion is done (or the timeout in seconds runs out), returns whether it is done
+        """
+        if self._future is None:
+            return False
+        concurrent.futures.wait([self._future], timeout=timeout)
+        return self._future.done()
+
+    def result(self, timeout=None):
+        return self._future.result(timeout)
+
+    def exception(self, timeout=None):
+        return self._future.exception(timeout)
+
+    def add_done_callback(self, callback):
+        """
+        Calls callback(job) once the conversion is done (right away if it is done already)
+        """
+        self._future.add_done_callback(lambda _: callback(self))
+
+
+def convert_file_to_google_docs(
+    source, document_title, docs_service=None, credentials_file=None, scopes=None, debug=False, batch_size=120,
+    session=None, metrics=None, executor=None, permission_body=DEFAULT_PERMISSION_BODY
+):
+    """
+    This is the streaming version of convert_to_google_docs (see stream_markdown_content).
+    The source can either be a path to a markdown file, a file object or any iterable of lines.
+    """
+    if docs_service is None and session is None:
+        session = get_conversion_session(credentials_file, scopes)
+
+    doc_id, doc_url = create_empty_google_doc(
+        document_title, credentials_file, scopes, session=session, metrics=metrics, permission_body=permission_body
+    )
+
+    if debug: 
+        print(f"Google Doc Link: {doc_url}\n")
+
+    def stream_content(on_progress):
+        if session is None:
+            return stream_markdown_content(
+                docs_service, doc_id, source, debug=debug, batch_size=batch_size, metrics=metrics,
+                on_progress=on_progress
+            )
+        with session.services() as (session_docs_service, _):
+            return stream_markdown_content(
+                session_docs_service, doc_id, source, debug=debug, batch_size=batch_size, metrics=metrics,
+                on_progress=on_progress
+            )
+
+    job = ConversionJob(doc_id, doc_url, document_title).start(stream_content, executor)
+
+    if debug:
+        job.wait()
+
+    return job
+
+
+def get_conversion_session(credentials_file, scopes):
+    """
+    This is a helper function which creates the MarkGDocSession of a conversion given neither a docs_service nor a
+    session. It raises a ValueError without a credentials_file, before any google doc is created.
+    """
+    if credentials_file is None:
+        raise ValueError("A docs_service, a session or a credentials_file is needed to convert markdown")
+    return MarkGDocSession(credentials_file, scopes)
+
+
+def convert_to_google_docs(
+    content_markdown, document_title, docs_service=None, credentials_file=None, scopes=None, debug=False,
+    verify_tables=False, session=None, plan_cache=None, metrics=None, executor=None,
+    permission_body=DEFAULT_PERMISSION_BODY
+):
+    """
+    This creates a new google doc titled document_title and converts your markdown content into it.
+    The google doc is created right away (shared with the permission_body, see create_empty_google_doc), and its
+    content is sent in the background on a shared pool of threads (see get_conversion_executor), or on your own
+    executor. In debug mode, the conversion is waited for.
+
+    This function outputs a ConversionJob holding the id and url of the google doc (job.doc_id and job.doc_url),
+    which tracks the progress, the status and the errors of the conversion and can cancel it.
+    When neither a docs_service nor a session is passed, a session is created from the credentials_file and scopes.
+    """
+    if docs_service is None and session is None:
+        session = get_conversion_session(credentials_file, scopes)
+
+    doc_id, doc_url = create_empty_google_doc(
+        document_title, credentials_file, scopes, session=session, metrics=metrics, permission_body=permission_body
+    )
 
     if debug: 
         print(f"Google Doc Link: {doc_url}\n")
     
-    def stream_content():
-        process_markdown_content(docs_service, doc_id, content_markdown, debug=debug)
+    def stream_content(on_progress):
+        if session is None:
+            return process_markdown_content(
+                docs_service, doc_id, content_markdown, debug=debug, verify_tables=verify_tables,
+                plan_cache=plan_cache, metrics=metrics, on_progress=on_progress
+            )
+        with session.services() as (session_docs_service, _):
+            return process_markdown_content(
+                session_docs_service, doc_id, content_markdown, debug=debug, verify_tables=verify_tables,
+                plan_cache=plan_cache, metrics=metrics, on_progress=on_progress
+            )
 
-    content_thread = threading.Thread(target=stream_content)
-    content_thread.start()
+    job = ConversionJob(doc_id, doc_url, document_title).start(stream_content, executor)
     
     if debug:
-        content_thread.join()
+        job.wait()
     
-    return doc_url
-    
\ No newline at end of file
+    return job
+
+
+# Converting in Bulk =====================================================================================================
+# The result of converting a single markdown document: its title, the google doc id and url (None if the doc could not
+# be created), the seconds the conversion took and the error it failed with (None on success)
+ConversionResult = namedtuple("ConversionResult", ["title", "doc_id", "doc_url", "seconds", "error"])
+
+
+def format_title(title_template, path, number=None, directory=None):
+    """
+    This is a helper function which fills in the title template of a markdown file (used by the convert and watch
+    subcommands): {stem} is its name without extension, {name} its name, {parent} the name of its directory, {path}
+    its path (relative to the directory, if any) and {number} its position among the files converted together (from 1)
+    """
+    name = os.path.basename(path)
+    return title_template.format(
+        stem=os.path.splitext(name)[0],
+        name=name,
+        parent=os.path.basename(os.path.dirname(os.path.abspath(os.path.join(directory or "", path)))),
+        path=path,
+        number=number,
+    )
+
+
+def convert_many(
+    items, credentials_file=None, scopes=None, max_workers=8, debug=False, session=None, plan_cache=None, metrics=None,
+    compile_processes=None, permission_body=DEFAULT_PERMISSION_BODY
+):
+    """
+    This converts many markdown documents concurrently on a bounded pool of max_workers threads.
+    The items are (content_markdown, document_title) pairs. The credentials are loaded once into a MarkGDocSession
+    (unless you pass your own session), which shares its service builds between the workers.
+    The google docs are all created up front in a few batched Drive calls (see create_empty_google_docs) and shared
+    with the permission_body, then their contents are sent by the workers.
+    API calls share the rate limiters of the process, so throughput scales with max_workers up to the quota.
+    With a plan_cache (see markgdoc.cache.PlanCache), identical documents are only compiled once.
+    With metrics (see Metrics), every conversion is measured into the same Metrics object.
+    With compile_processes, the documents are compiled on a shared pool of that many processes, so that compiling
+    scales with the cores while the threads only send the compiled plans (see compile_markdown_parallel).
+
+    This function yields a ConversionResult for every document in completion order (its seconds are those spent
+    sending its content). A failed conversion does not stop the others, its error is reported in its result.
+    """
+    if session is None:
+        session = MarkGDocSession(credentials_file, scopes)
+
+    items = list(items)
+    try:
+        with session.services() as (_, drive_service):
+            created_docs = create_empty_google_docs(
+                [title for _, title in items], drive_service=drive_service, metrics=metrics,
+                permission_body=permission_body
+            )
+    except Exception as exception:
+        created_docs = [CreatedDoc(title, None, None, exception) for _, title in items]
+
+    def convert(content_markdown, created_doc):
+        started = time.perf_counter()
+        error = created_doc.error
+        if error is None:
+            try:
+                with session.services() as (docs_service, _):
+                    process_markdown_content(
+                        docs_service, created_doc.doc_id, content_markdown, debug=debug, plan_cache=plan_cache,
+                        metrics=metrics, compile_executor=compile_executor
+                    )
+            except Exception as exception:
+                error = exception
+        seconds = time.perf_counter() - started
+        if metrics is not None:
+            metrics.timing("convert", seconds)
+            metrics.count("conversions.failed" if error is not None else "conversions.succeeded")
+        return ConversionResult(created_doc.title, created_doc.doc_id, created_doc.doc_url, seconds, error)
+
+    compile_executor = None
+    if compile_processes:
+        compile_executor = concurrent.futures.ProcessPoolExecutor(max_workers=compile_processes)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(convert, content_markdown, created_doc)
+                for (content_markdown, _), created_doc in zip(items, created_docs)
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                yield future.result()
+    finally:
+        if compile_executor is not None:
+            compile_executor.shutdown()
+
+
+# Syncing Markdown =======================================================================================================
+# A google doc created from markdown can be kept up to date with the markdown: only the blocks which changed since the
+# last sync are deleted and inserted again. The blocks of the last synced version are remembered in a local state file.
+DEFAULT_SYNC_STATE_DIR = os.path.join(os.path.expanduser("~"), ".markgdoc", "sync")
+
+# Version of the sync state file format (see sync_markdown)
+SYNC_STATE_VERSION = 1
+
+# The result of syncing markdown into a google doc: the doc id, the number of blocks inserted, deleted and left
+# unchanged, whether the whole doc had to be rewritten and the stats of every batch sent
+SyncResult = namedtuple("SyncResult", ["doc_id", "inserted", "deleted", "unchanged", "rewritten", "batches"])
+
+
+def get_block_hash(token):
+    """
+    This is a helper function which returns a hash identifying the content of a BlockToken
+    """
+    data = json.dumps([token.kind, token.text, token.level, token.rows], ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def get_sync_state_path(doc_id, state_dir=None):
+    """
+    This is a helper function which returns the path of the sync state file of a google doc
+    """
+    return os.path.join(state_dir or DEFAULT_SYNC_STATE_DIR, f"{doc_id}.json")
+
+
+def load_sync_state(doc_id, state_dir=None):
+    """
+    This loads the sync state of a google doc: {"revision_id": ..., "blocks": [[block hash, block length], ...]}.
+    None is returned when the doc was never synced (or its state was written by another version of MarkGDoc).
+    """
+    try:
+        with open(get_sync_state_path(doc_id, state_dir), "r", encoding="utf-8") as state_file:
+            state = json.load(state_file)
+    except FileNotFoundError:
+        return None
+    return state if state.get("version") == SYNC_STATE_VERSION else None
+
+
+def save_sync_state(doc_id, state, state_dir=None):
+    """
+    This saves the sync state of a google doc, replacing the previous state file at once
+    """
+    path = get_sync_state_path(doc_id, state_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as state_file:
+        json.dump(dict(state, version=SYNC_STATE_VERSION), state_file)
+    os.replace(temporary_path, path)
+
+
+def compile_sync_region(start_index, delete_end_index, tokens, debug=False):
+    """
+    This compiles the requests replacing the content between start_index and delete_end_index of the GDoc by the
+    tokens. It returns the requests and the length of every block inserted.
+
+    The old content is deleted first, then the blocks are inserted at start_index. Text inserted at the start of a
+    paragraph takes on the style of that paragraph, so the paragraph style, bullets and text style of the inserted
+    range are reset before the styles of the blocks are applied.
+    """
+    requests = []
+    if delete_end_index > start_index:
+        requests.append({"deleteContentRange": {"range": {"startIndex": start_index, "endIndex": delete_end_index}}})
+    if not tokens:
+        return requests, []
+
+    plan = RequestPlan()
+    lengths = []
+    index = start_index
+    for token in tokens:
+        block_end_index = compile_block(token, index, plan, debug=debug)
+        lengths.append(block_end_index - index)
+        index = block_end_index
+
+    # The paragraph requests only refer to text inserted before them, so they can all go after the insertions
+    insert_requests = [request for request in plan.text_requests if request.kind in ("insertText", "insertTable")]
+    paragraph_requests = [request for request in plan.text_requests if request.kind not in ("insertText", "insertTable")]
+    inserted_range = {"startIndex": start_index, "endIndex": index}
+
+    requests.extend(coalesce_requests(insert_requests))
+    requests.append({
+        "updateParagraphStyle": {
+            "range": inserted_range,
+            "paragraphStyle": {"namedStyleType": "NORMAL_TEXT"},
+            "fields": "namedStyleType,borderBottom",
+        }
+    })
+    requests.append({"deleteParagraphBullets": {"range": inserted_range}})
+    requests.append({"updateTextStyle": {"range": inserted_range, "textStyle": {}, "fields": "*"}})
+    requests.extend(merge_paragraph_requests(paragraph_requests))
+    requests.extend(merge_text_style_requests(plan.style_requests))
+    return requests, lengths
+
+
+def sync_markdown(
+    doc_id, content_markdown, docs_service=None, credentials_file=None, scopes=None, session=None, state_dir=None,
+    debug=False, batch_sizer=None, metrics=None
+):
+    """
+    This brings an existing google doc up to date with your markdown content, sending only the changes since the
+    last sync instead of rewriting the whole doc.
+
+    The markdown is split into blocks (see tokenize_blocks) and every block is hashed. The hashes are diffed against
+    the blocks of the last synced version, kept in a local state file (in state_dir, ~/.markgdoc/sync by default).
+    Every changed region is compiled on its own (see compile_sync_region) and the regions are applied from the bottom
+    of the doc to the top, so the indexes of the regions still to be applied never move.
+
+    The revision of the google doc is stored along with the blocks. When the doc was never synced, or was edited
+    since the last sync (its revision changed), its whole content is replaced instead.
+
+    The docs_service can be passed directly, or taken from a session (or from a session created from the
+    credentials_file and scopes). With metrics (see Metrics), the API calls and batches are measured.
+    This function outputs a SyncResult.
+    """
+    if docs_service is None:
+        if session is None:
+            session = MarkGDocSession(credentials_file, scopes)
+        with session.services() as (session_docs_service, _):
+            return sync_markdown(
+                doc_id, content_markdown, session_docs_service, state_dir=state_dir, debug=debug,
+                batch_sizer=batch_sizer, metrics=metrics
+            )
+
+    tokens = list(tokenize_blocks(content_markdown))
+    new_hashes = [get_block_hash(token) for token in tokens]
+
+    document = execute_request(
+        docs_service.documents().get(documentId=doc_id, fields="revisionId,body(content(endIndex))"),
+        rate_limiter=DOCS_READ_RATE_LIMITER,
+        metrics=metrics,
+    )
+    state = load_sync_state(doc_id, state_dir)
+    rewritten = state is None or state.get("revision_id") != document.get("revisionId")
+
+    if rewritten:
+        # The content of the doc is unknown: it is replaced as a whole (without its final newline, which stays)
+        content = document.get("body", {}).get("content", [])
+        content_length = content[-1]["endIndex"] - 2 if content else 0
+        old_blocks = [[None, content_length]] if content_length > 0 else []
+    else:
+        old_blocks = state["blocks"]
+    old_hashes = [block_hash for block_hash, _ in old_blocks]
+
+    old_start_indexes = [1]
+    for _, length in old_blocks:
+        old_start_indexes.append(old_start_indexes[-1] + length)
+
+    matcher = difflib.SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+    opcodes = matcher.get_opcodes()
+    new_lengths = [None] * len(tokens)
+    requests = []
+    inserted = deleted = unchanged = 0
+
+    for tag, old_start, old_end, new_start, new_end in reversed(opcodes):
+        if tag == "equal":
+            new_lengths[new_start:new_end] = [length for _, length in old_blocks[old_start:old_end]]
+            unchanged += new_end - new_start
+            continue
+
+        if(debug):
+            print(f"Syncing blocks {old_start}-{old_end} into {new_start}-{new_end} ({tag})\n")
+        region_requests, lengths = compile_sync_region(
+            old_start_indexes[old_start], old_start_indexes[old_end], tokens[new_start:new_end], debug=debug
+        )
+        requests.extend(region_requests)
+        new_lengths[new_start:new_end] = lengths
+        inserted += new_end - new_start
+        deleted += old_end - old_start
+
+    # The changes were computed against the revision just read, they are only applied to that revision. The write
+    # control then holds the revision the last batch left the doc at.
+    write_control = {"requiredRevisionId": document.get("revisionId")}
+    batches = send_batch_update(
+        docs_service, doc_id, requests, batch_sizer=batch_sizer, metrics=metrics, write_control=write_control
+    )
+
+    revision_id = write_control.get("requiredRevisionId")
+    if batches and revision_id == document.get("revisionId"):
+        # The batches did not report the revision they left the doc at: it is read instead
+        revision_id = execute_request(
+            docs_service.documents().get(documentId=doc_id, fields="revisionId"), rate_limiter=DOCS_READ_RATE_LIMITER,
+            metrics=metrics,
+        ).get("revisionId")
+    save_sync_state(
+        doc_id, {"revision_id": revision_id, "blocks": [list(block) for block in zip(new_hashes, new_lengths)]},
+        state_dir
+    )
+    return SyncResult(doc_id, inserted, deleted, unchanged, rewritten, batches)
@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import contextlib
+import concurrent.futures
+from . import markgdoc
+
+# Watch Mode =============================================================================================================
+# A directory of markdown files is kept synced to Google Docs: every markdown file gets its own google doc (created on
+# its first sync) and, whenever the file changes, only its changed blocks are sent to its doc (see sync_markdown).
+# Changes are picked up through filesystem notifications when watchdog is installed, and by polling otherwise.
+
+MARKDOWN_EXTENSIONS = (".md", ".markdown")
+
+# Name of the file keeping the file -> google doc mapping, in the watched directory by default
+DEFAULT_MAPPING_FILE_NAME = ".markgdoc-docs.json"
+
+MAPPING_VERSION = 1
+
+
+def scan_markdown_files(directory):
+    """
+    This is a helper function which lists the markdown files under the directory (skipping hidden directories such
+    as .git), returning the (modification time, size) of every file by its path relative to the directory
+    """
+    files = {}
+    for root, directories, names in os.walk(directory):
+        directories[:] = sorted(name for name in directories if not name.startswith("."))
+        for name in names:
+            if name.lower().endswith(MARKDOWN_EXTENSIONS):
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files[os.path.relpath(path, directory)] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+class DocMapping:
+    """
+    The google doc of every watched file: its doc id, its url and the sha256 of the content last synced to it, kept
+    in a JSON file (saved atomically after every change) so that a restarted watcher keeps syncing the same docs.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as mapping_file:
+                data = json.load(mapping_file)
+            if data.get("version") == MAPPING_VERSION:
+                self.files = data["files"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    def get(self, file):
+        with self._lock:
+            return self.files.get(file)
+
+    def set(self, file, entry):
+        with self._lock:
+            self.files[file] = entry
+            temporary_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as mapping_file:
+                json.dump({"version": MAPPING_VERSION, "files": self.files}, mapping_file, indent=2, sort_keys=True)
+            os.replace(temporary_path, self.path)
+
+
+class MarkdownWatcher:
+    """
+    This keeps the markdown files of a directory synced to Google Docs.
+
+    Every change of a file is debounced: the file is only pushed once it has not changed for debounce seconds, so a
+    burst of saves (or a checkout touching many files) leads to a single sync per file. At most max_workers files are
+    pushed at once, and a file changing again while it is being pushed is pushed again afterwards. A file whose push
+    failed is retried after retry_delay seconds.
+
+    A file without a google doc gets a new one (titled after the title_template, see markgdoc.format_title, and shared
+    with the permission_body, see markgdoc.create_empty_google_doc), a file with a doc is synced into it (see
+    sync_markdown), and a file whose content did not change since its last push is skipped.
+    The docs are kept in a DocMapping (.markgdoc-docs.json in the directory by default).
+
+    API calls are made through a MarkGDocSession, or through the docs_service and drive_service if they are passed
+    (they then have to be thread-safe). on_result is called with a dict describing every push: file, doc_id,
+    doc_url, seconds, created, inserted, deleted, unchanged and error.
+    """
+
+    def __init__(
+        self, directory, session=None, docs_service=None, drive_service=None, mapping_path=None, debounce=2.0,
+        max_workers=4, poll_interval=1.0, title_template="{stem}", state_dir=None, retry_delay=60.0, on_result=None,
+        use_notifications=True, permission_body=markgdoc.DEFAULT_PERMISSION_BODY
+    ):
+        self.directory = os.path.abspath(directory)
+        self.session = session
+        self.docs_service = docs_service
+        self.drive_service = drive_service
+        self.mapping = DocMapping(mapping_path or os.path.join(self.directory, DEFAULT_MAPPING_FILE_NAME))
+        self.debounce = debounce
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.title_template = title_template
+        self.state_dir = state_dir
+        self.retry_delay = retry_delay
+        self.on_result = on_result
+        self.use_notifications = use_notifications
+        self.permission_body = permission_body
+        self._pending = {}
+        self._in_flight = set()
+        self._snapshot = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def notify(self, file, delay=None):
+        """
+        Records a change of the file (a path relative to the directory, or an absolute path): it is pushed once it has
+        not changed for the debounce delay
+        """
+        if os.path.isabs(file):
+            file = os.path.relpath(file, self.directory)
+        if not file.lower().endswith(MARKDOWN_EXTENSIONS) or file.startswith(".."):
+            return
+        with self._lock:
+            self._pending[file] = time.monotonic() + (self.debounce if delay is None else delay)
+        self._wake.set()
+
+    def poll(self):
+        """
+        Scans the directory and records a change for every new or modified markdown file
+        """
+        snapshot = scan_markdown_files(self.directory)
+        for file, signature in snapshot.items():
+            if self._snapshot.get(file) != signature:
+                self.notify(file)
+        self._snapshot = snapshot
+
+    def push_file(self, file):
+        """
+        Pushes a single file to its google doc, creating the doc if the file has none yet. Returns the result of the
+        push, or None when the file was deleted or did not change since its last push.
+        """
+        path = os.path.join(self.directory, file)
+        try:
+            with open(path, "r", encoding="utf-8") as markdown_file:
+                content_markdown = markdown_file.read()
+        except FileNotFoundError:
+            return None
+
+        content_hash = hashlib.sha256(content_markdown.encode("utf-8")).hexdigest()
+        entry = self.mapping.get(file)
+        if entry is not None and entry.get("hash") == content_hash:
+            return None
+
+        started = time.perf_counter()
+        result = {"file": file, "doc_id": None, "doc_url": None, "seconds": None, "created": entry is None,
+                  "inserted": None, "deleted": None, "unchanged": None, "error": None}
+        try:
+            with self._services() as (docs_service, drive_service):
+                if entry is None:
+                    title = markgdoc.format_title(self.title_template, file, directory=self.directory)
+                    doc_id, doc_url = markgdoc.create_empty_google_doc(
+                        title, drive_service=drive_service, permission_body=self.permission_body
+                    )
+                    entry = {"doc_id": doc_id, "doc_url": doc_url, "hash": None}
+                    # The doc is recorded at once, so that it is not created again if the sync fails
+                    self.mapping.set(file, entry)
+                result["doc_id"], result["doc_url"] = entry["doc_id"], entry["doc_url"]
+
+                sync_result = markgdoc.sync_markdown(
+                    entry["doc_id"], content_markdown, docs_service, state_dir=self.state_dir
+                )
+            self.mapping.set(file, dict(entry, hash=content_hash))
+            result.update(inserted=sync_result.inserted, deleted=sync_result.deleted, unchanged=sync_result.unchanged)
+        except Exception as error:
+            result["error"] = f"{type(error).__name__}: {error}"
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        return result
+
+    def _services(self):
+        if self.session is not None:
+            return self.session.services()
+        return contextlib.nullcontext((self.docs_service, self.drive_service))
+
+    def _push(self, file):
+        result = None
+        try:
+            result = self.push_file(file)
+        finally:
+            with self._lock:
+                self._in_flight.discard(file)
+                if result is not None and result["error"] is not None and file not in self._pending:
+                    self._pending[file] = time.monotonic() + self.retry_delay
+            self._wake.set()
+        if result is not None and self.on_result is not None:
+            self.on_result(result)
+        return result
+
+    def _due_files(self):
+        """
+        Takes the pending files which are due (and not being pushed already) off the pending files
+        """
+        now = time.monotonic()
+        with self._lock:
+            due = sorted(file for file, due_time in self._pending.items() if due_time <= now and file not in self._in_flight)
+            for file in due:
+                del self._pending[file]
+            self._in_flight.update(due)
+            return due
+
+    def run_once(self):
+        """
+        Pushes every markdown file which changed since its last push (bounded by max_workers) and returns the results
+        """
+        for file in scan_markdown_files(self.directory):
+            self.notify(file, delay=0)
+        files = self._due_files()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            results = list(executor.map(self._push, files))
+        return [result for result in results if result is not None]
+
+    def run(self, stop_event=None):
+        """
+        Watches the directory until the stop_event is set (or forever), pushing the files as they change.
+        Every file is checked once on startup, so that changes made while the watcher was not running are pushed too.
+        """
+        stop_event = stop_event or threading.Event()
+        observer = self._start_observer() if self.use_notifications else None
+        self._snapshot = scan_markdown_files(self.directory)
+        for file in self._snapshot:
+            self.notify(file, delay=0)
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.max_workers))
+        try:
+            while not stop_event.is_set():
+                if observer is None:
+                    self.poll()
+                for file in self._due_files():
+                    executor.submit(self._push, file)
+
+                with self._lock:
+                    next_due = min(self._pending.values(), default=None)
+                timeout = self.poll_interval if next_due is None else max(0.0, next_due - time.monotonic())
+                self._wake.wait(min(timeout, self.poll_interval))
+                self._wake.clear()
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+            executor.shutdown(wait=True)
+
+    def _start_observer(self):
+        """
+        Starts a watchdog observer notifying the watcher of the changes of the directory, or returns None when watchdog
+        is not installed (the directory is then polled every poll_interval seconds)
+        """
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            return None
+
+        watcher = self
+
+        class ChangeHandler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory:
+                    return
+                for path in (event.src_path, getattr(event, "dest_path", None)):
+                    if path and not any(part.startswith(".") for part in os.path.relpath(path, watcher.directory).split(os.sep)):
+                        watcher.notify(path)
+
+        observer = Observer()
+        observer.schedule(ChangeHandler(), self.directory, recursive=True)
+        observer.start()
+        return observer
+
@@ -0,0 +1,9 @@
+import pytest
+from src.markgdoc import markgdoc
+
+
+@pytest.fixture(autouse=True)
+def unlimited_rate_limiters(monkeypatch):
+    # The shared rate limiters pace real API calls, tests against mocked services don't need to wait for them
+    for name in ("DOCS_WRITE_RATE_LIMITER", "DOCS_READ_RATE_LIMITER", "DRIVE_RATE_LIMITER"):
+        monkeypatch.setattr(markgdoc, name, markgdoc.RateLimiter(60_000_000, burst=1_000_000))
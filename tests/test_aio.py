@@ -0,0 +1,202 @@
+import json
+import asyncio
+import pytest
+from src.markgdoc import markgdoc
+from src.markgdoc.markgdoc import (
+    BatchSizer,
+    CompactRequest,
+    compile_markdown,
+    coalesce_requests,
+    merge_paragraph_requests,
+    merge_text_style_requests,
+)
+from src.markgdoc.aio import (
+    AsyncDocsClient,
+    AsyncHTTPClient,
+    HttpStatusError,
+    convert_to_google_docs_async,
+    process_markdown_content_async,
+    send_batch_update_async,
+)
+
+
+class StubGoogleServer:
+    """
+    A local HTTP server answering the Google Drive and Google Docs calls of the asyncio backend
+    """
+
+    def __init__(self, failures=0, failure_status=503, stalls=0, drops=0):
+        self.failures = failures
+        self.failure_status = failure_status
+        self.stalls = stalls
+        self.drops = drops
+        self.calls = []
+        self.server = None
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        self.url = f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        answered = 0
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, path, _ = request_line.decode().split(" ")
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode()
+                if line == "\r\n":
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            self.calls.append((method, path, json.loads(body) if body else None))
+
+            if self.stalls:
+                # The call is never answered: the client times out
+                self.stalls -= 1
+                await asyncio.sleep(1)
+                break
+            if self.drops and answered:
+                # The call arrives on a kept-alive connection, which is closed before it is answered
+                self.drops -= 1
+                break
+            if self.failures:
+                self.failures -= 1
+                status, response = self.failure_status, {"error": "unavailable"}
+            elif path.endswith("/files"):
+                status, response = 200, {"id": f"doc{len(self.calls)}"}
+            elif path.endswith(":batchUpdate"):
+                status, response = 200, {"writeControl": {"requiredRevisionId": f"revision{len(self.calls)}"}}
+            else:
+                status, response = 200, {}
+
+            payload = json.dumps(response).encode()
+            writer.write(f"HTTP/1.1 {status} OK\r\nContent-Length: {len(payload)}\r\n\r\n".encode() + payload)
+            await writer.drain()
+            answered += 1
+        writer.close()
+
+    def client(self, **kwargs):
+        return AsyncDocsClient(docs_api_url=f"{self.url}/v1", drive_api_url=f"{self.url}/drive/v3", **kwargs)
+
+
+CONTENT = "# Title\nSome **bold** text\n| A | B |\n| - | - |\n| 1 | _2_ |"
+
+
+def test_convert_to_google_docs_async():
+    async def convert():
+        async with StubGoogleServer() as server:
+            async with server.client() as client:
+                doc_url = await convert_to_google_docs_async(CONTENT, "Async Doc", client)
+            return doc_url, server.calls
+
+    doc_url, calls = asyncio.run(convert())
+    plan = compile_markdown(CONTENT)
+
+    assert doc_url == "https://docs.google.com/document/d/doc1/edit"
+    assert calls[0] == ("POST", "/drive/v3/files", {"name": "Async Doc", "mimeType": "application/vnd.google-apps.document"})
+    assert calls[1] == ("POST", "/drive/v3/files/doc1/permissions", {"type": "anyone", "role": "writer"})
+    assert calls[2] == ("POST", "/v1/documents/doc1:batchUpdate", {"requests": list(merge_paragraph_requests(coalesce_requests(plan.text_requests)))})
+    assert calls[3] == ("POST", "/v1/documents/doc1:batchUpdate", {
+        "requests": merge_text_style_requests(plan.style_requests),
+        "writeControl": {"requiredRevisionId": "revision3"},
+    })
+
+
+@pytest.mark.parametrize("permission_body, permissions", [
+    (None, []),
+    ([{"type": "user", "role": "reader"}, {"type": "domain", "role": "writer"}], [{"type": "user", "role": "reader"}, {"type": "domain", "role": "writer"}]),
+])
+def test_convert_to_google_docs_async_permissions(permission_body, permissions):
+    async def convert():
+        async with StubGoogleServer() as server:
+            async with server.client() as client:
+                await convert_to_google_docs_async(CONTENT, "Async Doc", client, permission_body=permission_body)
+            return server.calls
+
+    calls = asyncio.run(convert())
+    assert [body for _, path, body in calls if path.endswith("/permissions")] == permissions
+
+
+@pytest.mark.parametrize("failures, failure_status, max_retries, succeeds", [
+    (2, 429, 2, True),
+    (3, 429, 2, False),
+    # The first batch may have been applied before a server error: without a revision to require, it is not retried
+    (1, 503, 2, False),
+])
+def test_process_markdown_content_async_retries(failures, failure_status, max_retries, succeeds):
+    async def process():
+        async with StubGoogleServer(failures=failures, failure_status=failure_status) as server:
+            async with server.client(max_retries=max_retries, backoff=0) as client:
+                return await process_markdown_content_async(client, "doc", "Hello")
+
+    if succeeds:
+        assert [batch["requests"] for batch in asyncio.run(process())] == [1]
+    else:
+        with pytest.raises(HttpStatusError):
+            asyncio.run(process())
+
+
+class SlowRateLimiter:
+    def reserve(self, tokens=1):
+        return 0.2
+
+
+def test_batch_latency_leaves_waits_out(monkeypatch):
+    monkeypatch.setattr(markgdoc, "DOCS_WRITE_RATE_LIMITER", SlowRateLimiter())
+    batch_sizer = BatchSizer(max_requests=4, adaptive=True, target_seconds=0.1)
+    requests = [CompactRequest("insertText", 1, value=f"{number}\n") for number in range(8)]
+
+    async def send():
+        async with StubGoogleServer(failures=1, failure_status=429) as server:
+            async with server.client(backoff=0.2) as client:
+                return await send_batch_update_async(client, "doc", requests, batch_sizer=batch_sizer)
+
+    # Throttled and retried batches only look as slow as their API calls to the BatchSizer
+    assert all(batch["seconds"] < 0.1 for batch in asyncio.run(send()))
+    assert batch_sizer.max_requests > 4
+
+
+def test_timeouts_are_retried():
+    async def get_document():
+        async with StubGoogleServer(stalls=1) as server:
+            async with server.client(http=AsyncHTTPClient(timeout=0.05), backoff=0) as client:
+                return await client.get_document("doc"), len(server.calls)
+
+    # asyncio.wait_for raises asyncio.TimeoutError, which is not the builtin TimeoutError before Python 3.11
+    assert asyncio.run(get_document()) == ({}, 2)
+
+
+@pytest.mark.parametrize("idempotent, error, calls", [(True, None, 3), (False, ConnectionResetError, 2)])
+def test_dropped_keep_alive_connections_only_resend_idempotent_calls(idempotent, error, calls):
+    async def call():
+        async with StubGoogleServer(drops=1) as server:
+            async with server.client(backoff=0) as client:
+                await client.get_document("doc")
+                try:
+                    await (client.get_document("doc") if idempotent else client.create_document("Doc"))
+                except Exception as raised:
+                    return type(raised), len(server.calls)
+            return None, len(server.calls)
+
+    # The server may have applied the dropped call: only an idempotent call is sent again
+    assert asyncio.run(call()) == (error, calls)
+
+
+def test_many_conversions_on_one_event_loop():
+    async def convert_all():
+        async with StubGoogleServer() as server:
+            async with server.client() as client:
+                return await asyncio.gather(*(
+                    convert_to_google_docs_async(CONTENT, f"Doc {i}", client) for i in range(50)
+                ))
+
+    assert len(set(asyncio.run(convert_all()))) == 50
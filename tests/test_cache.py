@@ -0,0 +1,82 @@
+import os
+import pytest
+from unittest import mock
+from src.markgdoc import markgdoc
+from src.markgdoc.markgdoc import compile_markdown, process_markdown_content
+from src.markgdoc.cache import PlanCache
+
+CONTENT = "# Title\n- **Item** one\n| A | B |\n| - | - |\n| 1 | _2_ |\nThe end"
+
+
+def test_plan_cache_hits_after_first_compile(tmp_path):
+    plan_cache = PlanCache(tmp_path)
+    assert plan_cache.get(CONTENT) is None
+
+    plan = plan_cache.compile(CONTENT)
+    cached_plan = plan_cache.compile(CONTENT)
+    assert cached_plan == plan == compile_markdown(CONTENT)
+    assert (plan_cache.hits, plan_cache.misses) == (1, 2)
+    assert PlanCache(tmp_path).get(CONTENT) == plan
+
+
+def test_plan_cache_keys_depend_on_compiler_version(tmp_path, monkeypatch):
+    plan_cache = PlanCache(tmp_path)
+    key = plan_cache.key(CONTENT)
+    monkeypatch.setattr("src.markgdoc.cache.COMPILER_VERSION", markgdoc.COMPILER_VERSION + 1)
+    assert plan_cache.key(CONTENT) != key
+    assert plan_cache.key(CONTENT + " ") != plan_cache.key(CONTENT)
+
+
+def test_plan_cache_rejects_bytes(tmp_path):
+    with pytest.raises(TypeError):
+        PlanCache(tmp_path).compile(CONTENT.encode("utf-8"))
+
+
+def test_plan_cache_prints_the_same_traces_on_hits(tmp_path, capsys):
+    plan_cache = PlanCache(tmp_path)
+    plan = plan_cache.compile(CONTENT, debug=True)
+    miss_traces = capsys.readouterr().out
+
+    assert plan_cache.compile(CONTENT, debug=True) == plan
+    assert plan_cache.hits == 1
+    assert miss_traces and capsys.readouterr().out == miss_traces
+
+
+def test_plan_cache_evicts_least_recently_used_plans(tmp_path):
+    contents = [f"# Document {number}\n" + "Some text\n" * 50 for number in range(3)]
+    plan_cache = PlanCache(tmp_path)
+    for age, content in enumerate(contents):
+        plan_cache.put(content, compile_markdown(content))
+        os.utime(plan_cache.path(plan_cache.key(content)), (1000 + age, 1000 + age))
+
+    # Reading the oldest plan makes it the most recently used one
+    assert plan_cache.get(contents[0]) is not None
+    plan_size = os.path.getsize(plan_cache.path(plan_cache.key(contents[0])))
+    plan_cache.max_bytes = 2 * plan_size + plan_size // 2
+    plan_cache.evict()
+
+    assert plan_cache.evictions == 1
+    assert [plan_cache.get(content) is not None for content in contents] == [True, False, True]
+
+
+def test_plan_cache_drops_unreadable_plans(tmp_path):
+    plan_cache = PlanCache(tmp_path)
+    plan_cache.put(CONTENT, compile_markdown(CONTENT))
+    with open(plan_cache.path(plan_cache.key(CONTENT)), "a") as plan_file:
+        plan_file.write('{"text": ')
+
+    assert plan_cache.get(CONTENT) is None
+    assert not os.path.exists(plan_cache.path(plan_cache.key(CONTENT)))
+
+
+def test_process_markdown_content_uses_plan_cache(tmp_path):
+    plan_cache = PlanCache(tmp_path)
+    docs_service = mock.MagicMock()
+    process_markdown_content(docs_service, "doc_id", CONTENT, plan_cache=plan_cache)
+    with mock.patch("src.markgdoc.cache.compile_markdown") as compile_markdown_mock:
+        process_markdown_content(docs_service, "doc_id", CONTENT, plan_cache=plan_cache)
+
+    assert not compile_markdown_mock.called
+    batch_calls = docs_service.documents.return_value.batchUpdate.call_args_list
+    half = len(batch_calls) // 2
+    assert [call[1] for call in batch_calls[:half]] == [call[1] for call in batch_calls[half:]]
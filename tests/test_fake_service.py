@@ -0,0 +1,213 @@
+import pytest
+from src.markgdoc import markgdoc
+from src.markgdoc.markgdoc import (
+    compile_markdown,
+    create_empty_google_doc,
+    create_empty_google_docs,
+    execute_batch_requests,
+    execute_request,
+    process_markdown_content,
+    send_batch_update,
+    sync_markdown,
+)
+from src.markgdoc.fake_service import FakeDocsService, FakeDriveService, FakeHttpError
+
+CONTENT = "# Title\nIntro **bold** text\n- One\n- Two\n| A | B |\n| - | - |\n| **1** | 2 |\nThe end"
+
+
+def paragraphs(document):
+    return [element for element in document["body"]["content"] if "paragraph" in element]
+
+
+def test_fake_docs_service_converts_with_google_docs_indexes():
+    docs_service = FakeDocsService()
+    drive_service = FakeDriveService(docs_service)
+    doc_id, doc_url = create_empty_google_doc("Report", drive_service=drive_service)
+
+    # Checking the table start index against the compiled one also checks the index semantics of the fake
+    process_markdown_content(docs_service, doc_id, CONTENT, verify_tables=True)
+    document = docs_service.documents().get(documentId=doc_id).execute()
+
+    assert document["title"] == "Report" and doc_url.endswith(f"/{doc_id}/edit")
+    assert docs_service.document(doc_id).permissions == [{"type": "anyone", "role": "writer"}]
+    title, intro, first_item, second_item = paragraphs(document)[:4]
+    assert title["paragraph"]["paragraphStyle"]["namedStyleType"] == "HEADING_1"
+    assert [run["textRun"]["content"] for run in intro["paragraph"]["elements"]] == ["Intro ", "bold", " text\n"]
+    assert intro["paragraph"]["elements"][1]["textRun"]["textStyle"] == {"bold": True}
+    assert first_item["paragraph"]["bullet"] == second_item["paragraph"]["bullet"]
+
+    (table,) = [element["table"] for element in document["body"]["content"] if "table" in element]
+    cells = [cell["content"][0]["paragraph"]["elements"][0]["textRun"] for row in table["tableRows"] for cell in row["tableCells"]]
+    assert [cell["content"] for cell in cells] == ["A\n", "B\n", "1", "2\n"]
+    assert cells[2]["textStyle"] == {"bold": True}
+    assert docs_service.document(doc_id).get_text() == "Title\nIntro bold text\nOne\nTwo\n\nA\nB\n1\n2\n\n\nThe end\n\n"
+    assert docs_service.calls == {"documents.batchUpdate": 3, "documents.get": 2}
+    assert drive_service.calls == {"files.create": 1, "permissions.create": 1}
+    assert docs_service.bytes_received > 0
+
+
+def test_fake_docs_service_converts_large_tables_in_chunks(monkeypatch):
+    rows = [f"| {number} | {'' if number % 3 else f'**{number}**'} | x{number} |" for number in range(25)]
+    content = "Before\n| A | B | C |\n| - | - | - |\n" + "\n".join(rows) + "\nAfter"
+    docs_service = FakeDocsService()
+    documents = {}
+    for chunk_rows in (1000, 4):
+        monkeypatch.setattr(markgdoc, "MAX_TABLE_CHUNK_ROWS", chunk_rows)
+        doc_id = docs_service.add_document().doc_id
+        process_markdown_content(docs_service, doc_id, content, verify_tables=True)
+        documents[chunk_rows] = docs_service.documents().get(documentId=doc_id).execute()
+
+    def table_rows(document):
+        return [
+            [[run["textRun"] for run in cell["content"][0]["paragraph"]["elements"]] for cell in row["tableCells"]]
+            for element in document["body"]["content"] if "table" in element
+            for row in element["table"]["tableRows"]
+        ]
+
+    # The split table holds the same cells (and styles) as the whole one, spread over tables of at most 4 rows
+    tables = [element["table"] for element in documents[4]["body"]["content"] if "table" in element]
+    assert [len(table["tableRows"]) for table in tables] == [4] * 6 + [2]
+    assert table_rows(documents[4]) == table_rows(documents[1000])
+    assert len(table_rows(documents[4])) == 26
+
+
+@pytest.mark.parametrize("request_body", [
+    {"insertText": {"location": {"index": 0}, "text": "Before the body"}},
+    {"insertText": {"location": {"index": 100}, "text": "After the body"}},
+    {"insertText": {"location": {"index": 8}, "text": "At the start of the table"}},
+    {"deleteContentRange": {"range": {"startIndex": 9, "endIndex": 12}}},
+    {"deleteContentRange": {"range": {"startIndex": 1, "endIndex": 23}}},
+    {"updateTextStyle": {"range": {"startIndex": 5, "endIndex": 5}, "textStyle": {"bold": True}, "fields": "bold"}},
+    {"replaceAllText": {"replaceText": "Anything"}},
+])
+def test_fake_docs_service_rejects_invalid_batches_atomically(request_body):
+    docs_service = FakeDocsService()
+    document = docs_service.add_document()
+    send_batch_update(docs_service, document.doc_id, compile_markdown("| A | B |\n| - | - |\n| 1 | 2 |").text_requests)
+    text, revision_id = document.get_text(), document.revision_id
+
+    # The valid insertion moves the table to index 8
+    requests = [{"insertText": {"location": {"index": 1}, "text": "Valid\n"}}, request_body]
+    with pytest.raises(FakeHttpError) as error:
+        docs_service.documents().batchUpdate(documentId=document.doc_id, body={"requests": requests}).execute()
+
+    assert error.value.resp.status == 400
+    assert (document.get_text(), document.revision_id) == (text, revision_id)
+
+
+def test_fake_docs_service_injected_errors_are_retried():
+    docs_service = FakeDocsService()
+    document = docs_service.add_document()
+    docs_service.fail_next(2, status=503)
+
+    request = docs_service.documents().batchUpdate(
+        documentId=document.doc_id, body={"requests": [{"insertText": {"location": {"index": 1}, "text": "Hello"}}]}
+    )
+    execute_request(request, backoff=0)
+
+    assert document.get_text() == "Hello\n"
+    assert docs_service.calls["documents.batchUpdate"] == 3
+    assert (docs_service.errors_injected, docs_service.requests_applied) == (2, 1)
+
+
+def test_create_empty_google_docs_in_batches():
+    docs_service = FakeDocsService()
+    drive_service = FakeDriveService(docs_service)
+    titles = [f"Doc {number}" for number in range(150)]
+    permissions = [
+        {"type": "user", "role": "reader", "emailAddress": "reader@example.com"},
+        {"type": "domain", "role": "writer", "domain": "example.com"},
+    ]
+    drive_service.fail_next(1, status=400)
+
+    created_docs = create_empty_google_docs(titles, drive_service=drive_service, permission_body=permissions)
+
+    assert [created_doc.title for created_doc in created_docs] == titles
+    assert created_docs[0].doc_id is None and created_docs[0].error.resp.status == 400
+    for created_doc in created_docs[1:]:
+        assert created_doc.error is None and created_doc.doc_url.endswith(f"/{created_doc.doc_id}/edit")
+        assert docs_service.document(created_doc.doc_id).title == created_doc.title
+        assert docs_service.document(created_doc.doc_id).permissions == permissions
+    # 150 files and then 298 permissions, at most 100 calls per batch
+    assert drive_service.calls == {"batch": 5, "files.create": 150, "permissions.create": 298}
+
+    drive_service.reset_counters()
+    (created_doc,) = create_empty_google_docs(["Private"], drive_service=drive_service, permission_body=None)
+    assert docs_service.document(created_doc.doc_id).permissions == []
+    assert drive_service.calls == {"batch": 1, "files.create": 1}
+
+
+@pytest.mark.parametrize("status, reason, applied, retried", [
+    # A server error may come after the file was created already: it is not created again
+    (503, None, True, False),
+    (429, None, False, True),
+    (403, "rateLimitExceeded", False, True),
+    (403, "insufficientFilePermissions", False, False),
+])
+def test_create_empty_google_docs_retries_creations_only_when_rate_limited(status, reason, applied, retried, monkeypatch):
+    monkeypatch.setattr(markgdoc.time, "sleep", lambda seconds: None)
+    drive_service = FakeDriveService()
+    drive_service.fail_next(1, status=status, applied=applied, reason=reason)
+
+    created_docs = create_empty_google_docs(["A", "B"], drive_service=drive_service)
+
+    assert drive_service.calls["files.create"] == (3 if retried else 2)
+    assert (created_docs[0].error is None) == retried
+    assert len(drive_service.docs_service.docs) == (2 if applied or retried else 1)
+
+
+def test_create_empty_google_doc_is_not_created_twice():
+    drive_service = FakeDriveService()
+    drive_service.fail_next(1, status=503, applied=True)
+
+    with pytest.raises(FakeHttpError):
+        create_empty_google_doc("Report", drive_service=drive_service)
+    assert len(drive_service.docs_service.docs) == 1
+
+
+def test_execute_batch_requests_retries_failed_calls():
+    drive_service = FakeDriveService()
+    drive_service.fail_next(1, status=503)
+    drive_service.fail_next(1, status=404)
+    requests = [drive_service.files().create(body={"name": f"Doc {number}"}) for number in range(3)]
+
+    outcomes = execute_batch_requests(drive_service, requests, backoff=0)
+
+    # Only the call failing with a temporary error is sent again, in a batch of its own
+    assert [error.resp.status if error else response["name"] for response, error in outcomes] == ["Doc 0", 404, "Doc 2"]
+    assert drive_service.calls == {"batch": 2, "files.create": 4}
+
+
+def test_fake_docs_service_rejects_payloads_too_large():
+    docs_service = FakeDocsService(max_payload_bytes=400)
+    document = docs_service.add_document()
+    requests = compile_markdown("\n".join(f"Paragraph number {number}" for number in range(20))).text_requests
+
+    stats = send_batch_update(docs_service, document.doc_id, requests)
+
+    assert len(stats) > 1 and sum(batch["requests"] for batch in stats) == len(requests)
+    assert docs_service.calls["documents.batchUpdate"] > len(stats)
+    assert document.get_text().startswith("Paragraph number 0\nParagraph number 1\n")
+
+
+@pytest.mark.parametrize("edited_content", [
+    CONTENT.replace("Intro **bold**", "An intro _with_ **bold**"),
+    CONTENT.replace("- Two", "- Two\n- Three"),
+    CONTENT.replace("| **1** | 2 |", "| 1 | ~2~ |\n| 3 | 4 |"),
+    "# Another title\n---\nNothing else",
+])
+def test_sync_markdown_on_fake_docs_service(tmp_path, edited_content):
+    docs_service = FakeDocsService()
+    synced, converted = docs_service.add_document(), docs_service.add_document()
+    sync_markdown(synced.doc_id, CONTENT, docs_service, state_dir=tmp_path)
+    sync_markdown(synced.doc_id, edited_content, docs_service, state_dir=tmp_path)
+    process_markdown_content(docs_service, converted.doc_id, edited_content)
+
+    synced_document = docs_service.documents().get(documentId=synced.doc_id).execute()
+    converted_document = docs_service.documents().get(documentId=converted.doc_id).execute()
+    # Lists are numbered in the order they were created, which differs between the two documents
+    for document in (synced_document, converted_document):
+        for paragraph in paragraphs(document):
+            if "bullet" in paragraph["paragraph"]:
+                paragraph["paragraph"]["bullet"]["listId"] = None
+    assert synced_document["body"] == converted_document["body"]
@@ -0,0 +1,72 @@
+import json
+import datetime
+import pytest
+from unittest import mock
+from src.markgdoc import markgdoc
+from src.markgdoc.__main__ import run, expand_file_patterns
+from src.markgdoc.fake_service import FakeDocsService, FakeDriveService
+
+
+@pytest.fixture
+def markdown_files(tmp_path):
+    (tmp_path / "notes").mkdir()
+    (tmp_path / "notes" / "one.md").write_text("# One\nSome **bold** text")
+    (tmp_path / "notes" / "two.md").write_text("- A\n- B\n| A | B |\n| - | - |\n| 1 | 2 |")
+    (tmp_path / "notes" / "skipped.txt").write_text("Not markdown")
+    return tmp_path
+
+
+def output_lines(capsys):
+    return sorted((json.loads(line) for line in capsys.readouterr().out.splitlines()), key=lambda line: line["file"])
+
+
+def test_expand_file_patterns(markdown_files):
+    pattern = str(markdown_files / "**" / "*.md")
+    one = str(markdown_files / "notes" / "one.md")
+    missing = str(markdown_files / "missing.md")
+
+    assert expand_file_patterns([pattern, one, missing]) == [one, str(markdown_files / "notes" / "two.md"), missing]
+    assert markgdoc.format_title("{parent} - {stem} ({number})", one, 3) == "notes - one (3)"
+
+
+@pytest.mark.parametrize("options", [[], ["--processes", "2"]])
+def test_convert_dry_run(markdown_files, capsys, options):
+    status = run(["convert", str(markdown_files / "notes" / "*.md"), "--dry-run", "--jobs", "2"] + options)
+
+    lines = output_lines(capsys)
+    assert status == 0
+    assert [line["title"] for line in lines] == ["one", "two"]
+    assert all(line["doc_url"] is None and line["requests"] > 0 and line["error"] is None for line in lines)
+
+
+READER = {"type": "user", "role": "reader", "emailAddress": "reader@example.com"}
+
+
+@pytest.mark.parametrize("options, permissions", [
+    ([], [markgdoc.DEFAULT_PERMISSION_BODY]),
+    (["--private"], []),
+    (["--permission", json.dumps(READER)], [READER]),
+])
+def test_convert_creates_google_docs(markdown_files, capsys, monkeypatch, options, permissions):
+    docs_service = FakeDocsService()
+    drive_service = FakeDriveService(docs_service)
+    credentials = mock.Mock(token="token", expiry=datetime.datetime(2100, 1, 1))
+    monkeypatch.setattr(markgdoc, "load_service_account_credentials", mock.Mock(return_value=credentials))
+    monkeypatch.setattr(markgdoc, "build_service", lambda name, *args: docs_service if name == "docs" else drive_service)
+
+    status = run([
+        "convert", str(markdown_files / "notes" / "*.md"), str(markdown_files / "missing.md"),
+        "--title", "Notes - {stem}", "--jobs", "3",
+    ] + options)
+
+    lines = output_lines(capsys)
+    assert status == 1
+    assert lines[0]["error"].startswith("FileNotFoundError") and lines[0]["doc_url"] is None
+    for line in lines[1:]:
+        assert line["error"] is None
+        assert line["doc_url"] == f"https://docs.google.com/document/d/{line['doc_id']}/edit"
+        assert docs_service.document(line["doc_id"]).title == line["title"]
+        assert docs_service.document(line["doc_id"]).permissions == permissions
+        assert line["requests"] > 0
+    assert [line["title"] for line in lines[1:]] == ["Notes - one", "Notes - two"]
+    assert docs_service.requests_applied == sum(line["requests"] for line in lines[1:])
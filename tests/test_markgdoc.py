@@ -1,4 +1,12 @@
+import io
+import sys
+import subprocess
+import time
+import datetime
+import threading
 import pytest
+from unittest import mock
+from src.markgdoc import markgdoc
 from src.markgdoc.markgdoc import (
     get_header_request, 
     get_paragraph_request, 
@@ -8,8 +16,40 @@ from src.markgdoc.markgdoc import (
     get_unordered_list_request, 
     get_ordered_list_request, 
     get_empty_table_request, 
-    get_table_content_request
+    get_table_content_request,
+    compile_markdown,
+    compile_markdown_parallel,
+    compile_many,
+    split_markdown_chunks,
+    tokenize_blocks,
+    parse_inline_styles,
+    preprocess_nested_styles,
+    InlineSpan,
+    BlockToken,
+    execute_request_plan,
+    send_batch_update,
+    BatchSizer,
+    RateLimiter,
+    execute_request,
+    convert_many,
+    MarkGDocSession,
+    stream_markdown_content,
+    coalesce_requests,
+    CompactRequest,
+    request_to_dict,
+    sync_markdown,
+    merge_text_style_requests,
+    merge_paragraph_requests,
+    RequestPlan,
+    Metrics,
+    process_markdown_content,
+    convert_to_google_docs,
+    convert_file_to_google_docs,
+    ConversionJob,
+    ConversionCancelled,
 )
+import concurrent.futures
+from src.markgdoc.fake_service import FakeDocsService, FakeDriveService, FakeHttpError
 
 
 # Example test data for testing purposes
@@ -158,3 +198,736 @@ def test_get_table_content_request(table_data, index, expected_requests_length,
     assert len(requests) == expected_requests_length
     assert len(style_requests) == expected_style_requests_length
     assert table_end_index == expected_table_end_index
+
+
+@pytest.mark.parametrize("content, expected_text_requests, expected_style_requests, expected_tables", [
+    ("# Title\nSome **bold** text", 3, 2, 0),
+    ("| A | B |\n| - | - |\n| 1 | 2 |", 6, 0, 1),
+])
+def test_compile_markdown(content, expected_text_requests, expected_style_requests, expected_tables):
+    plan = compile_markdown(content)
+    assert len(plan.text_requests) == expected_text_requests
+    assert len(plan.style_requests) == expected_style_requests
+    assert len(plan.tables) == expected_tables
+
+
+def test_compile_markdown_table_placeholder():
+    plan = compile_markdown("Intro\n| A | B |\n| - | - |\n| 1 | 2 |")
+    table = plan.tables[0]
+    assert table == {"position": 1, "location": 7, "startIndex": 8, "rows": 2, "columns": 2}
+    assert plan.text_requests[table["position"]] == get_empty_table_request(2, 2, 7)
+
+
+PARALLEL_CONTENT = "\n".join([
+    "# Title",
+    "Intro with **bold** and [a link](https://example.com)",
+    "1. One",
+    "",
+    "2. Two",
+    "",
+    "",
+    "Between lists",
+    "| A | B |",
+    "| - | - |",
+    "| **1** | 2 |",
+    "",
+    "- Bullet _one_",
+    "---",
+    "Closing ~~text~~",
+    "",
+])
+
+
+@pytest.mark.parametrize("content", [PARALLEL_CONTENT, PARALLEL_CONTENT * 3, PARALLEL_CONTENT.rstrip(), "", "\n\n"])
+@pytest.mark.parametrize("chunk_size", [1, 20, 1000])
+def test_compile_markdown_parallel_matches_compile_markdown(content, chunk_size):
+    chunks = split_markdown_chunks(content, chunk_size)
+    assert "".join(chunks) == content
+    assert all(chunks) or chunks == [""]
+
+    # The pool is replaced by a map compiling the chunks in this process
+    executor = mock.Mock(map=map)
+    assert compile_markdown_parallel(content, executor=executor, chunk_size=chunk_size) == compile_markdown(content)
+
+
+def test_compile_many_on_processes():
+    contents = [PARALLEL_CONTENT * 4, "# Small", PARALLEL_CONTENT]
+    plans = list(compile_many(contents, max_workers=2, chunk_size=100))
+    assert plans == [compile_markdown(content) for content in contents]
+
+
+def test_compile_markdown_splits_large_tables(monkeypatch):
+    monkeypatch.setattr(markgdoc, "MAX_TABLE_CHUNK_ROWS", 2)
+    plan = compile_markdown("| A | B |\n| - | - |\n| 1 |  |\n| **3** | 4 |")
+
+    assert [(table["position"], table["location"], table["rows"]) for table in plan.tables] == [(0, 1, 2), (4, 17, 1)]
+    # The cells are filled from the last to the first at their indexes in the empty table, empty cells are skipped
+    assert plan.text_requests == [
+        get_empty_table_request(2, 2, 1),
+        CompactRequest("insertText", 10, value="1"),
+        CompactRequest("insertText", 7, value="B"),
+        CompactRequest("insertText", 5, value="A"),
+        get_empty_table_request(1, 2, 17),
+        CompactRequest("insertText", 23, value="4"),
+        CompactRequest("insertText", 21, value="3"),
+        CompactRequest("insertText", 27, value="\n\n"),
+    ]
+    assert plan.style_requests == get_style_request("3", "bold", 21)
+
+
+def test_request_plan_serialization():
+    plan = compile_markdown("# Title\n- **Item** one\n| A | B |\n| - | - |\n| 1 | _2_ |\nThe end")
+    assert RequestPlan.loads(plan.dumps()) == plan
+
+    buffer = io.StringIO()
+    plan.dump_jsonl(buffer)
+    buffer.seek(0)
+    assert RequestPlan.load_jsonl(buffer) == plan
+
+
+def test_compact_request_shifted():
+    request = CompactRequest("insertText", 5, value="Text\n")
+    style_request = CompactRequest("updateTextStyle", 5, 9, "bold")
+    assert request.shifted(3) == get_paragraph_request("Text", 8)
+    assert style_request.shifted(3) == get_style_request("Text", "bold", 8)[0]
+    assert request.start == 5 and style_request.end == 9
+
+
+def test_execute_request_plan_sends_tables_in_normal_batches():
+    docs_service = mock.MagicMock()
+    plan = compile_markdown("Intro\n| A | B |\n| - | - |\n| **1** | 2 |")
+    execute_request_plan(docs_service, "doc_id", plan)
+
+    batch_calls = docs_service.documents.return_value.batchUpdate.call_args_list
+    assert len(batch_calls) == 2
+    assert batch_calls[0][1]["body"]["requests"] == list(coalesce_requests(plan.text_requests))
+    assert not docs_service.documents.return_value.get.called
+
+
+@pytest.mark.parametrize("compact, expected", [
+    (CompactRequest("insertText", 3, value="Text\n"), get_paragraph_request("Text", 3)),
+    (CompactRequest("insertTable", 5, value=(3, 3)), get_empty_table_request(3, 3, 5)),
+    (CompactRequest("updateParagraphStyle", 1, 7, "HEADING_2"), get_header_request("Title", 2, 1)[1]),
+    (CompactRequest("updateParagraphStyle", 10, 11, "HORIZONTAL_LINE"), get_horizontal_line_request(10)[1]),
+    (CompactRequest("createParagraphBullets", 7, 25, "NUMBERED_DECIMAL_NESTED"), get_ordered_list_request("Ordered list item", 7)[1]),
+    (CompactRequest("updateTextStyle", 8, 17, "bold"), get_style_request("Bold Text", "bold", 8)[0]),
+    (CompactRequest("updateTextStyle", 17, 18), get_style_request("Bold Text", "bold", 8)[1]),
+    (CompactRequest("updateTextStyle", 20, 29, ("link", "http://example.com")), get_hyperlink_request("Link Text", "http://example.com", 20)[0]),
+])
+def test_compact_request(compact, expected):
+    assert compact.to_dict() == expected
+    assert compact == expected
+
+
+def test_optimizers_accept_compact_and_dict_requests():
+    plan = compile_markdown("# A\n# B\n- **x**\n- y\n| A | B |\n| - | - |\n| _1_ | 2 |\nEnd ~z~")
+    text_requests = [request_to_dict(r) for r in plan.text_requests]
+    style_requests = [request_to_dict(r) for r in plan.style_requests]
+
+    assert list(merge_paragraph_requests(coalesce_requests(plan.text_requests))) == list(
+        merge_paragraph_requests(coalesce_requests(text_requests))
+    )
+    assert merge_text_style_requests(plan.style_requests) == merge_text_style_requests(style_requests)
+
+
+def apply_insert_requests(requests, document="\n"):
+    """
+    Applies the insertion and deletion requests onto a plain text document (an empty table being a run of "#"), checking
+    that every other request only refers to text which is in the document. Returns the text of the document.
+    """
+    for request in map(request_to_dict, requests):
+        if "insertText" in request:
+            index = request["insertText"]["location"]["index"]
+            document = document[:index - 1] + request["insertText"]["text"] + document[index - 1:]
+        elif "insertTable" in request:
+            index = request["insertTable"]["location"]["index"]
+            rows, columns = request["insertTable"]["rows"], request["insertTable"]["columns"]
+            document = document[:index - 1] + "\n" + "#" * (rows + 2 * rows * columns + 2) + document[index - 1:]
+        elif "deleteContentRange" in request:
+            request_range = request["deleteContentRange"]["range"]
+            assert request_range["endIndex"] < len(document) + 1
+            document = document[:request_range["startIndex"] - 1] + document[request_range["endIndex"] - 1:]
+        else:
+            (body,) = request.values()
+            assert body["range"]["endIndex"] <= len(document)
+    return document
+
+
+@pytest.mark.parametrize("content, max_text_length, expected_inserts", [
+    ("# Title\nSome **bold** text\n- One\n1. Two\n---\nThe end", 1000, 1),
+    ("# Title\nSome **bold** text\n- One\n1. Two\n---\nThe end", 10, 4),
+    ("Intro\n| A | B |\n| - | - |\n| 1 | 2 |\nAfter", 1000, 6),
+])
+def test_coalesce_requests(content, max_text_length, expected_inserts):
+    text_requests = [request_to_dict(r) for r in compile_markdown(content).text_requests]
+    coalesced = [request_to_dict(r) for r in coalesce_requests(text_requests, max_text_length=max_text_length)]
+
+    assert sum("insertText" in request for request in coalesced) == expected_inserts
+    assert [r for r in coalesced if "insertText" not in r] == [r for r in text_requests if "insertText" not in r]
+    assert apply_insert_requests(coalesced) == apply_insert_requests(text_requests)
+
+
+def text_style_request(start, end, **text_style):
+    return {
+        "updateTextStyle": {
+            "range": {"startIndex": start, "endIndex": end},
+            "textStyle": text_style,
+            "fields": ",".join(text_style),
+        }
+    }
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("**a _b_ c**", [text_style_request(1, 6, bold=True), text_style_request(3, 4, italic=True)]),
+    ("**_Both_** and **more**", [text_style_request(1, 5, bold=True, italic=True), text_style_request(10, 14, bold=True)]),
+    ("**one****two** [l](http://l.com)", [text_style_request(1, 7, bold=True), text_style_request(8, 9, link={"url": "http://l.com"})]),
+])
+def test_merge_text_style_requests(text, expected):
+    assert merge_text_style_requests(compile_markdown(text).style_requests) == expected
+
+
+def test_merge_paragraph_requests():
+    plan = compile_markdown("# A\n# B\n- x\n- y\n1. z\n1. w\nEnd\n- v")
+    merged = [request_to_dict(r) for r in merge_paragraph_requests(coalesce_requests(plan.text_requests))]
+    merged = [r for r in merged if "insertText" not in r]
+    assert [(next(iter(r)), next(iter(r.values()))["range"]) for r in merged] == [
+        ("updateParagraphStyle", {"startIndex": 1, "endIndex": 5}),
+        ("createParagraphBullets", {"startIndex": 5, "endIndex": 9}),
+        ("createParagraphBullets", {"startIndex": 9, "endIndex": 13}),
+        ("createParagraphBullets", {"startIndex": 17, "endIndex": 19}),
+    ]
+
+
+@pytest.mark.parametrize("server_start_index, raises", [(8, False), (9, True)])
+def test_execute_request_plan_verify_tables(server_start_index, raises):
+    docs_service = mock.MagicMock()
+    docs_service.documents.return_value.get.return_value.execute.return_value = {
+        "body": {"content": [{"startIndex": 1, "paragraph": {}}, {"startIndex": server_start_index, "table": {"rows": 2}}]}
+    }
+    plan = compile_markdown("Intro\n| A | B |\n| - | - |\n| 1 | 2 |")
+
+    if raises:
+        with pytest.raises(RuntimeError):
+            execute_request_plan(docs_service, "doc_id", plan, verify_tables=True)
+    else:
+        execute_request_plan(docs_service, "doc_id", plan, verify_tables=True)
+        assert docs_service.documents.return_value.get.call_count == 1
+
+
+@pytest.mark.parametrize("content, expected", [
+    ("## Header **2**", [BlockToken("header", "Header **2**", 2)]),
+    ("- Bullet\n1. Numbered\n---\nParagraph", [
+        BlockToken("bullet", "Bullet"),
+        BlockToken("numbered", "Numbered"),
+        BlockToken("hr"),
+        BlockToken("paragraph", "Paragraph"),
+    ]),
+    ("1. One\n\n2. Two\n\n\nAfter", [
+        BlockToken("numbered", "One"),
+        BlockToken("numbered", "Two"),
+        BlockToken("paragraph", ""),
+        BlockToken("paragraph", "After"),
+    ]),
+    ("| A |\n| - |\n| 1 |\n\nAfter", [
+        BlockToken("table", rows=["| A |", "| - |", "| 1 |"]),
+        BlockToken("paragraph", "After"),
+    ]),
+    ("| A |\n| - |\nAfter", [
+        BlockToken("table", rows=["| A |", "| - |"]),
+        BlockToken("paragraph", "After"),
+    ]),
+])
+def test_tokenize_blocks(content, expected):
+    assert list(tokenize_blocks(content)) == expected
+    assert list(tokenize_blocks(io.StringIO(content))) == expected
+
+
+@pytest.mark.parametrize("text, expected_text, expected_spans", [
+    ("**One** and **two**", "One and two", [InlineSpan(0, 3, "bold"), InlineSpan(8, 11, "bold")]),
+    ("**Bold** then _italic_", "Bold then italic", [InlineSpan(0, 4, "bold"), InlineSpan(10, 16, "italic")]),
+    ("**_Both_** ~gone~", "Both gone", [InlineSpan(0, 4, "bold"), InlineSpan(0, 4, "italic"), InlineSpan(5, 9, "strike")]),
+    ("See [Google](https://www.google.com/) or [this](ftp://x)", "See Google or [this](ftp://x)", [
+        InlineSpan(4, 10, "link", "https://www.google.com/"),
+    ]),
+    ("Unclosed **bold and _ _", "Unclosed **bold and _ _", []),
+])
+def test_parse_inline_styles(text, expected_text, expected_spans):
+    assert parse_inline_styles(text) == (expected_text, expected_spans)
+
+
+def test_preprocess_nested_styles():
+    style_requests, cleaned_chunk = preprocess_nested_styles("A **b** [c](http://c.com)", 10, True)
+    assert cleaned_chunk == "A b c"
+    assert style_requests == [get_style_request("b", "bold", 12), get_hyperlink_request("c", "http://c.com", 14)]
+
+
+def sent_requests(docs_service):
+    return [
+        request
+        for call in docs_service.documents.return_value.batchUpdate.call_args_list
+        for request in call[1]["body"]["requests"]
+    ]
+
+
+@pytest.mark.parametrize("source_type", ["path", "file", "lines"])
+def test_stream_markdown_content(tmp_path, source_type):
+    content = "\n".join(["# Title", "Some **bold** text", "- Item _one_", "| A | B |", "| - | - |", "| 1 | 2 |"] * 20)
+    path = tmp_path / "content.md"
+    path.write_text(content)
+    source = {"path": str(path), "file": io.StringIO(content), "lines": content.splitlines(True)}[source_type]
+
+    docs_service = mock.MagicMock()
+    stream_markdown_content(docs_service, "doc_id", source, batch_size=10, coalesce=False, merge_styles=False)
+
+    plan = compile_markdown(content)
+    requests = sent_requests(docs_service)
+    assert [r for r in requests if "updateTextStyle" not in r] == plan.text_requests
+    assert [r for r in requests if "updateTextStyle" in r] == plan.style_requests
+    assert docs_service.documents.return_value.batchUpdate.call_count > 2
+
+
+@pytest.mark.parametrize("marker", ["-", "1."])
+def test_stream_markdown_content_keeps_long_lists_whole(marker):
+    lines = ["Intro"] + [f"{marker} Item {number}" for number in range(30)] + [f"Outro **{number}**" for number in range(15)]
+    content = "\n".join(lines)
+    docs_service = FakeDocsService()
+    document = docs_service.add_document()
+    stream_markdown_content(docs_service, document.doc_id, content.splitlines(True), batch_size=10)
+
+    paragraphs = [element["paragraph"] for element in document.to_dict()["body"]["content"][1:]]
+    list_ids = {paragraph["bullet"]["listId"] for paragraph in paragraphs if "bullet" in paragraph}
+    assert len(list_ids) == 1 and sum("bullet" in paragraph for paragraph in paragraphs) == 30
+    assert docs_service.calls["documents.batchUpdate"] > 2
+    assert document.get_text().startswith("Intro\nItem 0\n")
+
+
+@pytest.mark.parametrize("texts, rate_limit, max_batch_bytes, expected_batch_sizes", [
+    (["a"] * 5, 2, 1024, [2, 2, 1]),
+    (["a" * 100, "b", "c" * 100, "d"], 120, 250, [2, 2]),
+    (["a" * 500, "b"], 120, 250, [1, 1]),
+])
+def test_send_batch_update_batch_limits(texts, rate_limit, max_batch_bytes, expected_batch_sizes):
+    docs_service = mock.MagicMock()
+    requests = [get_paragraph_request(text, 1) for text in texts]
+    stats = send_batch_update(docs_service, "doc_id", requests, rate_limit=rate_limit, max_batch_bytes=max_batch_bytes)
+
+    assert [batch["requests"] for batch in stats] == expected_batch_sizes
+    assert sent_requests(docs_service) == requests
+    assert all(batch["bytes"] <= max_batch_bytes for batch in stats if batch["requests"] > 1)
+
+
+def test_send_batch_update_serializes_requests_batch_by_batch(monkeypatch):
+    to_dict = CompactRequest.to_dict
+    serialized = []
+    monkeypatch.setattr(CompactRequest, "to_dict", lambda request: serialized.append(request) or to_dict(request))
+    requests = [CompactRequest("insertText", 1, value=f"Text {number}\n") for number in range(10)]
+    serialized_per_batch = []
+
+    stats = send_batch_update(
+        mock.MagicMock(), "doc_id", requests, rate_limit=3,
+        on_batch=lambda batch_stats: serialized_per_batch.append(len(serialized)),
+    )
+
+    assert [batch["requests"] for batch in stats] == [3, 3, 3, 1]
+    assert serialized_per_batch == [3, 6, 9, 10]
+
+
+def test_send_batch_update_never_applies_a_batch_twice():
+    docs_service = FakeDocsService()
+    document = docs_service.add_document()
+    requests = [CompactRequest("insertText", 1, value=f"{number}\n") for number in range(4)]
+    # The second batch is applied, but its answer is lost: the server answers with a 503
+    on_batch = lambda batch_stats: docs_service.fail_next(1, status=503, applied=True)
+
+    with mock.patch.object(markgdoc.time, "sleep"), pytest.raises(FakeHttpError) as error:
+        send_batch_update(docs_service, document.doc_id, requests, rate_limit=2, on_batch=on_batch)
+
+    # Its retry requires the revision the first batch left the doc at, and is rejected instead of applied again
+    assert error.value.resp.status == 400
+    assert docs_service.calls["documents.batchUpdate"] == 3
+    assert document.get_text() == "3\n2\n1\n0\n\n"
+
+
+@pytest.mark.parametrize("status, applied", [(503, True), (429, False)])
+def test_send_batch_update_retries_first_batch_only_before_it_is_applied(status, applied):
+    docs_service = FakeDocsService()
+    document = docs_service.add_document()
+    docs_service.fail_next(1, status=status, applied=applied)
+    requests = [CompactRequest("insertText", 1, value="Text\n")]
+
+    # Without a known revision, the first batch is only retried when it was turned down (rate limited)
+    with mock.patch.object(markgdoc.time, "sleep"):
+        if applied:
+            with pytest.raises(FakeHttpError):
+                send_batch_update(docs_service, document.doc_id, requests)
+        else:
+            send_batch_update(docs_service, document.doc_id, requests)
+    assert docs_service.calls["documents.batchUpdate"] == (1 if applied else 2)
+    assert document.get_text() == "Text\n\n"
+
+
+def test_send_batch_update_splits_batches_rejected_as_too_large():
+    class PayloadTooLarge(Exception):
+        resp = mock.Mock(status=413)
+
+    docs_service = mock.MagicMock()
+    docs_service.documents.return_value.batchUpdate.return_value.execute.side_effect = [PayloadTooLarge(), {}, {}]
+    requests = [get_paragraph_request("Text", 1)] * 4
+    stats = send_batch_update(docs_service, "doc_id", requests)
+
+    assert [batch["requests"] for batch in stats] == [2, 2]
+
+
+class SlowRateLimiter:
+    def acquire(self, tokens=1):
+        time.sleep(0.2)
+        return 0.2
+
+
+def test_send_batch_update_leaves_waits_out_of_batch_latency():
+    docs_service = FakeDocsService()
+    document = docs_service.add_document()
+    docs_service.fail_next(1, status=429)
+    batch_sizer = BatchSizer(max_requests=4, adaptive=True, target_seconds=0.1)
+    requests = [CompactRequest("insertText", 1, value=f"{number}\n") for number in range(8)]
+
+    # Throttled and retried batches only look as slow as their API calls to the BatchSizer
+    with mock.patch.object(markgdoc, "get_retry_delay", return_value=0.2):
+        stats = send_batch_update(
+            docs_service, document.doc_id, requests, batch_sizer=batch_sizer, rate_limiter=SlowRateLimiter()
+        )
+
+    assert all(batch["seconds"] < 0.1 for batch in stats)
+    assert batch_sizer.max_requests > 4
+
+
+def test_batch_sizer_adapts_to_latency():
+    batch_sizer = BatchSizer(max_requests=100, adaptive=True, target_seconds=1.0)
+    batch_sizer.record({"requests": 100, "bytes": 1000, "seconds": 0.1})
+    assert batch_sizer.max_requests == 125
+    batch_sizer.record({"requests": 125, "bytes": 1000, "seconds": 5.0})
+    assert batch_sizer.max_requests == 62
+
+
+class RetryableError(Exception):
+    resp = mock.Mock(status=503)
+
+
+@pytest.mark.parametrize("failures, max_retries, succeeds", [(0, 2, True), (2, 2, True), (3, 2, False)])
+def test_execute_request_retries(failures, max_retries, succeeds):
+    request = mock.Mock()
+    request.execute.side_effect = [RetryableError()] * failures + [{"id": "doc_id"}]
+
+    if succeeds:
+        assert execute_request(request, max_retries=max_retries, backoff=0) == {"id": "doc_id"}
+    else:
+        with pytest.raises(RetryableError):
+            execute_request(request, max_retries=max_retries, backoff=0)
+    assert request.execute.call_count == min(failures, max_retries) + 1
+
+
+def test_execute_request_does_not_retry_client_errors():
+    class ClientError(Exception):
+        resp = mock.Mock(status=400)
+
+    request = mock.Mock()
+    request.execute.side_effect = ClientError()
+    with pytest.raises(ClientError):
+        execute_request(request, backoff=0)
+    assert request.execute.call_count == 1
+
+
+def test_metrics_measure_conversions():
+    docs_service = FakeDocsService()
+    doc_id = docs_service.add_document().doc_id
+    docs_service.fail_next(1, status=429)
+    events = []
+    metrics = Metrics(on_event=lambda name, fields: events.append(name))
+    content = "# Title\nSome **bold** text\n- One\n| A | B |\n| - | - |\n| _1_ | 2 |"
+
+    with mock.patch.object(markgdoc.time, "sleep"):
+        stats = process_markdown_content(docs_service, doc_id, content, metrics=metrics)
+
+    stages = ("preprocess", "tokenize", "parse_styles", "populate_tables", "compile", "optimize", "batch_update")
+    assert all(stage in metrics.timings for stage in stages)
+    assert metrics.timing_calls["batch_update"] == len(stats) == metrics.counts["batches"] == 2
+    assert metrics.counts["bytes_sent"] == sum(batch["bytes"] for batch in stats)
+    assert sum(amount for name, amount in metrics.counts.items() if name.startswith("requests.")) == docs_service.requests_applied
+    assert metrics.counts["requests.insertTable"] == 1
+    assert (metrics.counts["blocks.header"], metrics.counts["blocks.table"]) == (1, 1)
+    assert (metrics.counts["api_calls.docs.documents.batchUpdate"], metrics.counts["retries"]) == (3, 1)
+    assert metrics.counts["errors.429"] == 1
+    assert events == ["retry", "batch_update", "batch_update"]
+    assert compile_markdown(content, metrics=Metrics()).to_dict() == compile_markdown(content).to_dict()
+
+
+def test_rate_limiter_waits_once_burst_is_spent():
+    rate_limiter = RateLimiter(600, burst=2)
+    waits = [rate_limiter.acquire() for _ in range(3)]
+    assert waits[:2] == [0.0, 0.0]
+    assert 0 < waits[2] <= 0.1
+
+
+def fake_build(service_name, version, credentials):
+    service = mock.MagicMock()
+
+    def create_file(body):
+        if body["name"] == "Broken":
+            return mock.Mock(execute=mock.Mock(side_effect=RuntimeError("Drive is unavailable")))
+        return mock.Mock(execute=mock.Mock(return_value={"id": f"id-{body['name']}"}))
+
+    def new_batch_http_request(callback):
+        calls = []
+
+        def execute():
+            for request_id, request in calls:
+                try:
+                    response = request.execute()
+                except Exception as error:
+                    callback(request_id, None, error)
+                else:
+                    callback(request_id, response, None)
+
+        return mock.Mock(add=lambda request, request_id: calls.append((request_id, request)), execute=execute)
+
+    service.files.return_value.create.side_effect = create_file
+    service.new_batch_http_request.side_effect = new_batch_http_request
+    return service
+
+
+def fake_credentials(expiry=datetime.datetime(2100, 1, 1)):
+    return mock.Mock(token="token", expiry=expiry)
+
+
+@pytest.mark.parametrize("compile_processes", [None, 2])
+def test_convert_many(monkeypatch, compile_processes):
+    monkeypatch.setattr(markgdoc, "load_service_account_credentials", mock.Mock(return_value=fake_credentials()))
+    monkeypatch.setattr(markgdoc, "build_service", mock.Mock(side_effect=fake_build))
+    items = [(f"# Document {i}\nSome **text**", f"Doc {i}") for i in range(10)] + [("# Broken", "Broken")]
+
+    results = list(convert_many(items, "credentials.json", ["scope"], max_workers=3, compile_processes=compile_processes))
+
+    assert len(results) == 11
+    assert {result.title for result in results} == {title for _, title in items}
+    succeeded = [result for result in results if result.error is None]
+    assert len(succeeded) == 10
+    assert all(result.doc_url == f"https://docs.google.com/document/d/id-{result.title}/edit" for result in succeeded)
+    assert markgdoc.load_service_account_credentials.call_count == 1
+    assert markgdoc.build_service.call_count <= 6
+
+
+def fake_service_session(monkeypatch, docs_service):
+    drive_service = FakeDriveService(docs_service)
+    monkeypatch.setattr(markgdoc, "load_service_account_credentials", mock.Mock(return_value=fake_credentials()))
+    monkeypatch.setattr(markgdoc, "build_service", lambda name, *args: docs_service if name == "docs" else drive_service)
+    return MarkGDocSession("credentials.json", ["scope"])
+
+
+def test_convert_to_google_docs_returns_a_job(monkeypatch):
+    docs_service = FakeDocsService()
+    session = fake_service_session(monkeypatch, docs_service)
+    finished = []
+
+    job = convert_to_google_docs("# Title\nSome **bold** text", "Job", session=session)
+    job.add_done_callback(finished.append)
+
+    assert isinstance(job, ConversionJob)
+    assert not isinstance(job, str) and job.title == "Job"
+    assert job.doc_url == f"https://docs.google.com/document/d/{job.doc_id}/edit"
+    assert job.wait(5)
+    assert (job.status, job.progress, job.error) == ("succeeded", 1.0, None)
+    assert job.requests_sent == job.requests_total == docs_service.requests_applied
+    assert job.batches_sent == len(job.result()) == 2
+    assert job.seconds >= 0 and finished == [job]
+    assert docs_service.document(job.doc_id).get_text() == "Title\nSome bold text\n\n"
+
+
+@pytest.mark.parametrize("convert", [convert_to_google_docs, convert_file_to_google_docs])
+def test_conversions_create_private_docs(monkeypatch, convert):
+    docs_service = FakeDocsService()
+    session = fake_service_session(monkeypatch, docs_service)
+    source = "Some text" if convert is convert_to_google_docs else ["Some text"]
+
+    job = convert(source, "Private", session=session, permission_body=None)
+
+    assert job.wait(5) and job.status == "succeeded"
+    assert docs_service.document(job.doc_id).permissions == []
+
+
+@pytest.mark.parametrize("convert", [convert_to_google_docs, convert_file_to_google_docs])
+def test_conversions_without_docs_service_use_the_credentials(monkeypatch, convert):
+    docs_service = FakeDocsService()
+    fake_service_session(monkeypatch, docs_service)
+    source = "Some text" if convert is convert_to_google_docs else ["Some text"]
+
+    job = convert(source, "Doc", credentials_file="credentials.json", scopes=["scope"])
+
+    assert job.wait(5) and job.status == "succeeded"
+    assert docs_service.document(job.doc_id).get_text() == "Some text\n\n"
+    with pytest.raises(ValueError):
+        convert(source, "Doc")
+    assert len(docs_service.docs) == 1
+
+
+def test_conversion_job_reports_errors(monkeypatch):
+    docs_service = FakeDocsService()
+    docs_service.fail_next(1, status=400)
+
+    job = convert_to_google_docs("Some text", "Failing", session=fake_service_session(monkeypatch, docs_service))
+
+    assert job.wait(5)
+    assert job.status == "failed" and isinstance(job.error, FakeHttpError)
+    with pytest.raises(FakeHttpError):
+        job.result()
+    assert not job.cancel()
+
+
+def test_conversion_job_cancellation(monkeypatch):
+    docs_service = FakeDocsService(latency=0.02)
+    session = fake_service_session(monkeypatch, docs_service)
+    content = "| A | B |\n| - | - |\n" + "\n".join(f"| {row} | x |" for row in range(300))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        running = convert_to_google_docs(content, "Running", session=session, executor=executor)
+        pending = convert_to_google_docs(content, "Pending", session=session, executor=executor)
+        assert pending.status == "pending" and pending.progress is None
+
+        # A pending conversion never starts, a running one stops between two batches
+        assert pending.cancel()
+        while running.requests_sent == 0:
+            running.wait(0.005)
+        assert running.cancel(wait=True)
+        assert running.wait(5) and pending.wait(5)
+
+    assert running.status == pending.status == "cancelled"
+    assert isinstance(running.error, ConversionCancelled)
+    assert 0 < running.requests_sent < running.requests_total
+    assert pending.started_at is None and docs_service.document(pending.doc_id).get_text() == "\n"
+
+
+def test_conversion_job_cancelled_on_its_last_batch_succeeds(monkeypatch):
+    last_batch_sent = threading.Event()
+
+    def latency(method):
+        # The style batch (the last one) is slow to be answered
+        if method == "documents.batchUpdate" and docs_service.calls[method] == 1:
+            last_batch_sent.set()
+            return 0.05
+        return 0
+
+    docs_service = FakeDocsService(latency=latency)
+    job = convert_to_google_docs("Some **bold** text", "Job", session=fake_service_session(monkeypatch, docs_service))
+
+    assert last_batch_sent.wait(5)
+    assert not job.cancel(wait=True)
+    assert job.status == "succeeded" and not job.cancelled()
+
+
+@pytest.mark.parametrize("expires_in, refreshed", [(3600, False), (60, True)])
+def test_session_refreshes_tokens_near_expiry(expires_in, refreshed):
+    credentials = fake_credentials(datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) + datetime.timedelta(seconds=expires_in))
+    session = MarkGDocSession(credentials=credentials, refresh_margin=300)
+    session.ensure_fresh()
+    assert credentials.refresh.called == refreshed
+
+
+def test_session_reuses_service_builds(monkeypatch):
+    monkeypatch.setattr(markgdoc, "build_service", mock.Mock(side_effect=fake_build))
+    session = MarkGDocSession(credentials=fake_credentials())
+
+    for i in range(3):
+        assert markgdoc.create_empty_google_doc(f"Doc {i}", session=session)[0] == f"id-Doc {i}"
+    with session.services() as first_pair:
+        with session.services() as second_pair:
+            assert first_pair is not second_pair
+
+    assert markgdoc.build_service.call_count == 4
+
+
+def test_import_does_not_load_google_client_libraries():
+    code = "import sys; import src.markgdoc; print(any(name.startswith('googleapiclient') for name in sys.modules))"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "False"
+
+
+class TextDocsService:
+    """
+    A docs service keeping the text of a single document (see apply_insert_requests) and its revision
+    """
+
+    def __init__(self):
+        self.document = "\n"
+        self.revision = 0
+        self.batch_updates = 0
+        self.gets = 0
+        self.reports_revisions = True
+
+    def documents(self):
+        return self
+
+    def get(self, documentId, fields=None):
+        self.gets += 1
+        response = {"revisionId": f"r{self.revision}", "body": {"content": [{"endIndex": len(self.document) + 1}]}}
+        return mock.Mock(execute=mock.Mock(return_value=response))
+
+    def batchUpdate(self, documentId, body):
+        def execute():
+            self.document = apply_insert_requests(body["requests"], self.document)
+            self.revision += 1
+            self.batch_updates += 1
+            return {"writeControl": {"requiredRevisionId": f"r{self.revision}"}} if self.reports_revisions else {}
+
+        return mock.Mock(execute=execute)
+
+
+SYNCED_CONTENT = "\n".join([
+    "# Report", "Intro with **bold** text", "- One", "- Two", "| A | B |", "| - | - |", "| 1 | _2_ |", "---", "The end",
+])
+
+
+def converted_text(content):
+    return apply_insert_requests(compile_markdown(content).text_requests)
+
+
+@pytest.mark.parametrize("edited_content, expected_counts", [
+    (SYNCED_CONTENT, (0, 0, 7)),
+    (SYNCED_CONTENT.replace("Intro with", "An intro with"), (1, 1, 6)),
+    (SYNCED_CONTENT.replace("- Two", "- Two\n- Three"), (1, 0, 7)),
+    (SYNCED_CONTENT.replace("# Report\n", "").replace("| 1 | _2_ |", "| 1 | 3 |"), (1, 2, 5)),
+    ("Brand new", (1, 7, 0)),
+])
+def test_sync_markdown(tmp_path, edited_content, expected_counts):
+    docs_service = TextDocsService()
+    first = sync_markdown("doc_id", SYNCED_CONTENT, docs_service, state_dir=tmp_path)
+    assert first.rewritten and first.inserted == 7
+    assert docs_service.document == converted_text(SYNCED_CONTENT)
+
+    batch_updates = docs_service.batch_updates
+    result = sync_markdown("doc_id", edited_content, docs_service, state_dir=tmp_path)
+    assert not result.rewritten
+    assert (result.inserted, result.deleted, result.unchanged) == expected_counts
+    assert docs_service.document == converted_text(edited_content)
+    assert docs_service.batch_updates == batch_updates + (1 if expected_counts[:2] != (0, 0) else 0)
+    # The revision the batches left the doc at is taken from their responses
+    assert docs_service.gets == 2
+
+
+def test_sync_markdown_reads_revisions_not_reported_by_batches(tmp_path):
+    docs_service = TextDocsService()
+    docs_service.reports_revisions = False
+    sync_markdown("doc_id", SYNCED_CONTENT, docs_service, state_dir=tmp_path)
+    assert docs_service.gets == 2
+
+    result = sync_markdown("doc_id", SYNCED_CONTENT.replace("The end", "The very end"), docs_service, state_dir=tmp_path)
+    assert not result.rewritten and result.inserted == 1
+
+
+def test_sync_markdown_rewrites_docs_edited_elsewhere(tmp_path):
+    docs_service = TextDocsService()
+    sync_markdown("doc_id", SYNCED_CONTENT, docs_service, state_dir=tmp_path)
+    docs_service.document = "Edited by hand\n" + docs_service.document
+    docs_service.revision += 1
+
+    result = sync_markdown("doc_id", SYNCED_CONTENT, docs_service, state_dir=tmp_path)
+    assert result.rewritten
+    assert docs_service.document == converted_text(SYNCED_CONTENT)
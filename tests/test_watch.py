@@ -0,0 +1,102 @@
+import json
+import threading
+import time
+import pytest
+from src.markgdoc.markgdoc import format_title
+from src.markgdoc.watch import MarkdownWatcher, DocMapping, scan_markdown_files
+from src.markgdoc.fake_service import FakeDocsService, FakeDriveService
+
+
+@pytest.fixture
+def notes(tmp_path):
+    directory = tmp_path / "notes"
+    (directory / "drafts").mkdir(parents=True)
+    (directory / ".git").mkdir()
+    (directory / "one.md").write_text("# One\nSome **bold** text")
+    (directory / "drafts" / "two.markdown").write_text("- A\n- B")
+    (directory / "skipped.txt").write_text("Not markdown")
+    (directory / ".git" / "hidden.md").write_text("Hidden")
+    return directory
+
+
+@pytest.fixture
+def watcher(notes, tmp_path):
+    docs_service = FakeDocsService()
+    return MarkdownWatcher(
+        notes, docs_service=docs_service, drive_service=FakeDriveService(docs_service), debounce=0.05,
+        poll_interval=0.01, title_template="Notes - {stem}", state_dir=tmp_path / "state", use_notifications=False,
+    )
+
+
+def document_text(watcher, file):
+    return watcher.docs_service.document(watcher.mapping.get(file)["doc_id"]).get_text()
+
+
+def test_scan_markdown_files(notes):
+    assert sorted(scan_markdown_files(notes)) == ["drafts/two.markdown", "one.md"]
+    assert format_title("{parent}: {stem} ({path})", "drafts/two.markdown", directory=notes) == "drafts: two (drafts/two.markdown)"
+    assert format_title("{parent}: {name}", "one.md", directory=notes) == "notes: one.md"
+
+
+def test_run_once_creates_then_syncs_changed_files(notes, watcher):
+    results = sorted(watcher.run_once(), key=lambda result: result["file"])
+    assert [result["file"] for result in results] == ["drafts/two.markdown", "one.md"]
+    assert all(result["created"] and result["error"] is None for result in results)
+    assert watcher.docs_service.document(results[1]["doc_id"]).title == "Notes - one"
+    assert "Some bold text" in document_text(watcher, "one.md")
+
+    # Unchanged files are skipped, and only the changed file is synced into its existing doc
+    assert watcher.run_once() == []
+    (notes / "one.md").write_text("# One\nSome **bold** text\n\nAnother paragraph")
+    results = watcher.run_once()
+    assert [(result["file"], result["created"]) for result in results] == [("one.md", False)]
+    assert results[0]["inserted"] and results[0]["unchanged"]
+    assert "Another paragraph" in document_text(watcher, "one.md")
+
+    # The mapping is kept on disk, so a new watcher keeps using the same docs
+    with open(notes / ".markgdoc-docs.json") as mapping_file:
+        files = json.load(mapping_file)["files"]
+    assert files["one.md"]["doc_id"] == results[0]["doc_id"]
+    assert DocMapping(watcher.mapping.path).files == files
+
+
+def test_failed_pushes_are_retried(notes, watcher):
+    watcher.docs_service.fail_next(2, status=400)
+    results = sorted(watcher.run_once(), key=lambda result: result["file"])
+    assert all(result["error"] for result in results)
+    assert sorted(watcher._pending) == ["drafts/two.markdown", "one.md"]
+
+    # The docs created before the failure are kept, and filled by the next push
+    doc_ids = {file: entry["doc_id"] for file, entry in watcher.mapping.files.items()}
+    results = watcher.run_once()
+    assert all(result["error"] is None and not result["created"] for result in results)
+    assert {result["file"]: result["doc_id"] for result in results} == doc_ids
+    assert "Some bold text" in document_text(watcher, "one.md")
+
+
+def test_run_debounces_changes(notes, watcher):
+    pushes = []
+    watcher.on_result = pushes.append
+    stop_event = threading.Event()
+    thread = threading.Thread(target=watcher.run, args=(stop_event,))
+    thread.start()
+    try:
+        deadline = time.monotonic() + 5
+        while len(pushes) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # A burst of saves leads to a single push of the last content
+        for number in range(5):
+            (notes / "one.md").write_text(f"# One\nVersion {number}" + " padding" * number)
+            time.sleep(0.005)
+        (notes / "three.md").write_text("Three")
+        while len(pushes) < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.2)
+    finally:
+        stop_event.set()
+        thread.join()
+
+    assert sorted(push["file"] for push in pushes[2:]) == ["one.md", "three.md"]
+    assert all(push["error"] is None for push in pushes)
+    assert "Version 4" in document_text(watcher, "one.md")
+    assert document_text(watcher, "three.md").startswith("Three")